@@ -0,0 +1,252 @@
+"""
+Benchmark suite for the upscale path, on synthetic raw images.
+
+Times the three stages that dominate a run:
+  crop       ImagePipeline.crop_to_16_9 (decode + 16:9 crop) per raw resolution
+  inference  TiledUpscaler on a 16:9 sample for every tile size x thread count x precision
+  encode     OutputWriter on a 4MP output (PNG defaults, parallel/high-compression PNG, JPEG)
+
+Inference uses weights/RealESRGAN_x4plus.pth if present and random weights
+otherwise (throughput doesn't depend on the weight values). Results are written
+to benchmarks/results/<date>_<commit>.json together with the host, torch
+version and commit, so runs can be compared across commits (--compare).
+
+Usage:
+    python benchmarks/bench_pipeline.py [--tiles 128 256] [--threads 4 8] [--precisions fp32 bf16]
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/OLD.json [NEW.json] [--threshold 0.1]
+"""
+
+import os
+import sys
+import copy
+import json
+import glob
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+RESULTS_DIR = os.path.join(BASE_DIR, "benchmarks", "results")
+WEIGHTS = os.path.join(BASE_DIR, "weights", "RealESRGAN_x4plus.pth")
+CASES = ("crop", "inference", "encode")
+# Inference sample (width, height): a 16:9 center crop, small enough for a full sweep
+SAMPLE_SIZE = (256, 144)
+# Encoded output: a 16:9 image at the 4MP Adobe Stock minimum
+ENCODE_SIZE = (2667, 1500)
+
+
+def git_commit():
+    """(short commit, dirty) of the working tree, or (None, None) outside git."""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                         stderr=subprocess.DEVNULL, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                             cwd=BASE_DIR, stderr=subprocess.DEVNULL, text=True).strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def _time(fn, repeats):
+    """Median and best wall time of `repeats` calls after one warm-up call."""
+    fn()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {"seconds": round(statistics.median(times), 4), "best": round(min(times), 4), "runs": repeats}
+
+
+def bench_crop(raw_paths, repeats, log=print):
+    from generation_pipeline import ImagePipeline
+    pipeline = ImagePipeline.__new__(ImagePipeline)  # the crop helpers need no run state
+    results = []
+    for name, path in raw_paths.items():
+        timing = _time(lambda: pipeline.crop_to_16_9(path), repeats)
+        cropped = pipeline.crop_to_16_9(path)
+        results.append({"case": "crop", "params": {"resolution": name}, **timing,
+                        "mpix_per_s": round(cropped.width * cropped.height / 1e6 / timing["seconds"], 2)})
+        log(f"  crop       {name:<16} {timing['seconds'] * 1000:8.1f}ms")
+    return results
+
+
+def bench_inference(sample, tiles, thread_counts, precisions, tile_batch, blocks, repeats, log=print):
+    import torch
+    from models import RRDBNet
+    from tiled_inference import TiledUpscaler, load_rrdbnet
+    from precision import resolve_precision
+    from generation_pipeline import FUSED_RDB
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    use_weights = os.path.exists(WEIGHTS) and blocks == 23
+    if not use_weights:
+        log("  (random weights)")
+    pixels = sample.shape[0] * sample.shape[1]
+    original_threads = torch.get_num_threads()
+    results = []
+    try:
+        for requested in precisions:
+            precision, note = resolve_precision(requested, device)
+            if note:
+                log(f"  inference  {requested}: skipped ({note})")
+                continue
+            fused = FUSED_RDB and precision != "int8"
+            if use_weights:
+                base_model = load_rrdbnet(WEIGHTS, fused=fused)
+            else:
+                torch.manual_seed(0)
+                base_model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=blocks, num_grow_ch=32,
+                                     scale=4, fused=fused).eval()
+            for threads in thread_counts:
+                torch.set_num_threads(threads)
+                for tile in tiles:
+                    upsampler = TiledUpscaler(copy.deepcopy(base_model), scale=4, tile=tile,
+                                              batch_size=tile_batch, precision=precision, device=device,
+                                              log=lambda message: None)
+                    timing = _time(lambda: upsampler.enhance(sample), repeats)
+                    params = {"precision": precision, "threads": threads, "tile": tile, "tile_batch": tile_batch,
+                              "blocks": blocks, "sample": f"{sample.shape[1]}x{sample.shape[0]}"}
+                    results.append({"case": "inference", "params": params, **timing,
+                                    "mpix_per_s": round(pixels / 1e6 / timing["seconds"], 4)})
+                    log(f"  inference  {precision:<5} threads={threads:<3} tile={tile:<4} "
+                        f"{timing['seconds']:8.3f}s  {pixels / timing['seconds']:9.0f} px/s")
+    finally:
+        torch.set_num_threads(original_threads)
+    return results
+
+
+def bench_encode(image, thread_counts, repeats, log=print):
+    from output_writer import OutputWriter
+    from upscale_planner import UpscalePlan
+
+    height, width = image.shape[:2]
+    plan = UpscalePlan("none", 1, (width, height), (width, height), (width, height), 0)
+    variants = [{"fmt": "png"}, {"fmt": "png", "png_level": 6, "png_filter": "adaptive", "png_strategy": "default"},
+                {"fmt": "jpeg"}]
+    variants += [{"fmt": "png", "threads": threads} for threads in thread_counts if threads > 1]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for options in variants:
+            writer = OutputWriter(**options, log=lambda message: None)
+            out_path = os.path.join(tmp, "out" + writer.ext)
+            timing = _time(lambda: writer.write(out_path, image, plan), repeats)
+            params = dict(writer.options(), size=f"{width}x{height}")
+            results.append({"case": "encode", "params": params, **timing, "bytes": os.path.getsize(out_path)})
+            log(f"  encode     {writer.describe():<52} {timing['seconds'] * 1000:8.1f}ms  "
+                f"{os.path.getsize(out_path) / 1024 ** 2:6.1f}MB")
+    return results
+
+
+def run_suite(cases=CASES, tiles=(128, 256), thread_counts=None, precisions=("fp32",), tile_batch=4, blocks=23,
+              repeats=3, out_path=None, log=print):
+    """Run the selected cases and write the results JSON. Returns its path."""
+    import torch
+    from tile_autotune import host_key
+    from benchmarks.synthetic import RESOLUTIONS, synthetic_image, write_raw_images
+
+    cores = os.cpu_count() or 1
+    thread_counts = thread_counts or sorted({cores, max(1, cores // 2)})
+    commit, dirty = git_commit()
+    log(f"Benchmarking commit {commit}{' (dirty)' if dirty else ''} on {host_key()}")
+    results = []
+    if "crop" in cases:
+        with tempfile.TemporaryDirectory() as tmp:
+            results += bench_crop(write_raw_images(tmp), repeats, log)
+    if "inference" in cases:
+        raw = synthetic_image(*RESOLUTIONS["generator_16_9"])
+        w, h = SAMPLE_SIZE
+        y0, x0 = (raw.shape[0] - h) // 2, (raw.shape[1] - w) // 2
+        results += bench_inference(raw[y0:y0 + h, x0:x0 + w], tiles, thread_counts, precisions, tile_batch,
+                                   blocks, repeats, log)
+    if "encode" in cases:
+        results += bench_encode(synthetic_image(*ENCODE_SIZE, seed=7), thread_counts, repeats, log)
+
+    report = {"meta": {"commit": commit, "dirty": dirty, "host": host_key(), "platform": platform.platform(),
+                       "python": platform.python_version(), "torch": torch.__version__, "cpu_count": cores,
+                       "created_at": datetime.now().isoformat(timespec="seconds")},
+              "results": results}
+    if out_path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out_path = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d_%H%M%S}_{commit or 'nogit'}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    log(f"Results written to {out_path}")
+    return out_path
+
+
+def _case_key(result):
+    return result["case"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(base_path, new_path=None, threshold=0.10, log=print):
+    """Print the per-case change between two result files. Returns the number of regressions.
+
+    A case regresses when its median time grew by more than `threshold`.
+    new_path defaults to the most recent file in benchmarks/results.
+    """
+    if new_path is None:
+        candidates = sorted(p for p in glob.glob(os.path.join(RESULTS_DIR, "*.json"))
+                            if os.path.abspath(p) != os.path.abspath(base_path))
+        if not candidates:
+            raise SystemExit("No result file to compare against")
+        new_path = candidates[-1]
+    with open(base_path, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    log(f"Base: {base['meta'].get('commit')} ({os.path.basename(base_path)})")
+    log(f"New:  {new['meta'].get('commit')} ({os.path.basename(new_path)})")
+    if base["meta"].get("host") != new["meta"].get("host"):
+        log(f"WARNING: different hosts ({base['meta'].get('host')} vs {new['meta'].get('host')})")
+    base_results = {_case_key(r): r for r in base["results"]}
+    regressions = 0
+    for result in new["results"]:
+        key = _case_key(result)
+        label = f"{result['case']:<10} " + " ".join(f"{k}={v}" for k, v in sorted(result["params"].items()))
+        old = base_results.pop(key, None)
+        if old is None:
+            log(f"  new        {label}")
+            continue
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        log(f"  x{ratio:5.2f}     {label}  {old['seconds']:.4f}s -> {result['seconds']:.4f}s{flag}")
+    for old in base_results.values():
+        log(f"  removed    {old['case']} {old['params']}")
+    log(f"{regressions} regression(s) over {threshold:.0%}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark crop / inference / encode on synthetic images.")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--tiles", nargs="+", type=int, default=[128, 256])
+    parser.add_argument("--threads", nargs="+", type=int, default=None,
+                        help="torch / encoder thread counts (default: all cores and half of them)")
+    parser.add_argument("--precisions", nargs="+", default=["fp32"],
+                        choices=["fp32", "fp16", "bf16", "int8"])
+    parser.add_argument("--tile-batch", type=int, default=4)
+    parser.add_argument("--blocks", type=int, default=23,
+                        help="RRDB blocks (default: 23; fewer for a quick smoke run, random weights)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--out", default=None, help="Results file (default: benchmarks/results/<date>_<commit>.json)")
+    parser.add_argument("--compare", nargs="+", metavar="RESULTS_JSON",
+                        help="Compare BASE [NEW] result files instead of running; exits 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Slowdown that counts as a regression in --compare (default: 0.10)")
+    args = parser.parse_args()
+    if args.compare:
+        sys.exit(1 if compare(*args.compare[:2], threshold=args.threshold) else 0)
+    run_suite(args.cases, args.tiles, args.threads, args.precisions, args.tile_batch, args.blocks, args.repeats,
+              args.out)
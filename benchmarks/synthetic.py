@@ -0,0 +1,47 @@
+"""
+Synthetic raw images for the benchmarks.
+
+Generator drafts are smooth gradients with some edges and fine texture, so
+the images here mix the three (random noise would make PNG encoding and the
+16:9 crop look unrealistically slow). Content is deterministic per seed.
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+# (width, height) of typical raw drafts: ImageFX landscape/square/portrait and the 1376x768 generator size
+RESOLUTIONS = {
+    "imagefx_16_9": (1408, 768),
+    "imagefx_1_1": (1024, 1024),
+    "imagefx_9_16": (768, 1408),
+    "generator_16_9": (1376, 768),
+}
+
+
+def synthetic_image(width, height, seed=0):
+    """BGR uint8 image of gradients, a few filled shapes and mild noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    angle = rng.uniform(0, np.pi)
+    ramp = (x * np.cos(angle) + y * np.sin(angle)) / (width + height)
+    img = np.stack([ramp * rng.uniform(120, 255) + rng.uniform(0, 60) for _ in range(3)], axis=-1)
+    for _ in range(12):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(min(width, height) // 20, min(width, height) // 4))
+        color = tuple(float(c) for c in rng.uniform(0, 255, 3))
+        cv2.circle(img, center, radius, color, thickness=-1, lineType=cv2.LINE_AA)
+    img += rng.normal(0, 6, img.shape).astype(np.float32)
+    img = cv2.GaussianBlur(img, (0, 0), 1.2)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def write_raw_images(folder, resolutions=RESOLUTIONS, seed=0):
+    """Write one PNG per resolution into `folder`; returns {name: path}."""
+    paths = {}
+    for i, (name, (width, height)) in enumerate(resolutions.items()):
+        path = os.path.join(folder, f"{name}.png")
+        cv2.imwrite(path, synthetic_image(width, height, seed + i))
+        paths[name] = path
+    return paths
@@ -0,0 +1,108 @@
+"""
+Compiled RRDBNet cache.
+
+Traces the network once per (model, scale, num_block, precision) with
+TorchScript, freezes it and stores the artifact under weights/compiled/.
+The frozen graph is shape-generic, so it is traced on a small TRACE_SHAPE
+example and one artifact serves every tile size and batch. Later pipeline
+runs and --workers processes load the frozen graph directly - no RRDBNet
+construction, no state-dict load, no Python dispatch through 23x3 dense
+blocks per tile.
+
+Backends:
+    torchscript - frozen torch.jit trace saved to weights/compiled/*.ts (default)
+    inductor    - torch.compile(dynamic=True); kernels are cached in
+                  weights/compiled/inductor (needs a C++ toolchain on CPU)
+    none        - plain eager model
+"""
+
+import os
+import hashlib
+import warnings
+
+import torch
+
+from precision import prepare_model, InferencePlan
+
+COMPILE_BACKENDS = ("torchscript", "inductor", "none")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+COMPILED_DIR = os.path.join(BASE_DIR, "weights", "compiled")
+# Trace example (batch 1, h, w); the trace runs a full forward pass, which at
+# the padded tile size and batch took minutes per model on a single core
+TRACE_SHAPE = (32, 32)
+
+
+def artifact_path(model_name, model_path, scale, num_block, precision, fused=False):
+    """Cache file for one compiled configuration.
+
+    The name embeds a fingerprint of the source weights and the torch version,
+    so replacing the .pth or upgrading torch never loads a stale graph.
+    """
+    st = os.stat(model_path)
+    fingerprint = hashlib.sha1(f"{st.st_size}|{st.st_mtime_ns}|{torch.__version__}".encode()).hexdigest()[:10]
+    variant = "_fused" if fused else ""
+    name = f"{model_name}_x{scale}_b{num_block}{variant}_{precision}_{fingerprint}.ts"
+    return os.path.join(COMPILED_DIR, name)
+
+
+def is_compiled(model_name, model_path, scale, precision, num_block=23, fused=False):
+    """Whether a torchscript artifact for this configuration is already cached."""
+    return os.path.exists(artifact_path(model_name, model_path, scale, num_block, precision, fused))
+
+
+def load_compiled(model_name, model_path, scale, precision, device, backend="torchscript",
+                  load_model=None, calibration=None, num_block=23, fused=False, log=print):
+    """Return (module, InferencePlan) for a prepared, compiled RRDBNet.
+
+    Args:
+        load_model: Callable returning the fp32 RRDBNet; only called on a cache miss.
+        fused: Whether load_model builds FusedRRDB blocks (kept apart in the cache).
+    """
+    if backend == "inductor":
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(COMPILED_DIR, "inductor"))
+        model, plan = prepare_model(load_model(), precision, device, calibration)
+        return torch.compile(model, dynamic=True), plan
+
+    if backend != "torchscript" or precision == "bf16":
+        if backend == "torchscript":
+            log("bf16 autocast can't be traced - running eager")
+        return prepare_model(load_model(), precision, device, calibration)
+
+    plan = InferencePlan.for_precision(precision, device)
+    path = artifact_path(model_name, model_path, scale, num_block, precision, fused)
+    with warnings.catch_warnings():
+        # torch.jit is deprecated upstream but remains the portable on-disk format here
+        warnings.simplefilter("ignore")
+        if os.path.exists(path):
+            try:
+                module = torch.jit.load(path, map_location=plan.device)
+                log(f"Loaded compiled model: {os.path.basename(path)}")
+                return _optimize(module, plan), plan
+            except (RuntimeError, OSError) as e:
+                log(f"Compiled model unreadable, rebuilding: {e}")
+
+        model, plan = prepare_model(load_model(), precision, device, calibration)
+        example = torch.rand(1, 3, *TRACE_SHAPE, device=plan.device, dtype=plan.input_dtype)
+        try:
+            if fused:
+                # The per-sample trunk loop must stay a loop, not be unrolled for the example's batch
+                model.body = torch.jit.script(model.body)
+            with torch.no_grad():
+                module = torch.jit.freeze(torch.jit.trace(model, example).eval())
+        except Exception as e:
+            log(f"TorchScript trace failed, running eager: {e}")
+            return model, plan
+        os.makedirs(COMPILED_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.jit.save(module, tmp_path)
+        os.replace(tmp_path, path)
+        log(f"Compiled model cached: {os.path.basename(path)}")
+        return _optimize(module, plan), plan
+
+
+def _optimize(module, plan):
+    # optimize_for_inference graphs can't be re-serialized, so it's applied after load
+    if plan.device.type == 'cpu' and plan.precision == "fp32":
+        return torch.jit.optimize_for_inference(module)
+    return module
@@ -1,10 +1,11 @@
-from flask import Flask, render_template, jsonify, request, send_from_directory
+from flask import Flask, Response, render_template, jsonify, request, send_file
 import os
 import sys
 import csv
 import json
 import shutil
 import threading
+import mimetypes
 import subprocess
 from datetime import datetime
 
@@ -48,6 +49,13 @@ except (ImportError, OSError, Exception) as e:
     print(f"Warning: Could not import generation_pipeline: {e}")
     ImagePipeline = None
 
+from job_scheduler import JobScheduler, RECENT_FINISHED
+from image_catalog import ImageCatalog, DEFAULT_PAGE_SIZE, file_version
+from catalog_watcher import CatalogWatcher
+from event_stream import EventBroker
+from thumbnails import ThumbnailService, THUMB_SIZES
+from log_tail import LogTail
+
 # Debug: Print paths on startup
 print(f"=== PATH DEBUG ===")
 print(f"BASE_DIR: {BASE_DIR}")
@@ -110,43 +118,181 @@ def get_metadata_for_file(filename, image_dir=None):
 def index():
     return render_template('index.html')
 
+# Image catalog: SQLite index of generations/ (see image_catalog.py), kept in sync
+# by a filesystem watcher that pushes changes to the browser (/api/events)
+CATALOG_DB = os.path.join(PARENT_DIR, "cache", "image_catalog.db")
+TRASH_DIR = os.path.join(PARENT_DIR, "trash")
+SUBMISSIONS_DIR = os.path.join(PARENT_DIR, "submissions")
+EVENTS = EventBroker()
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog():
+    """The image catalog, created and watched on first use (lazily, like get_scheduler)."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ImageCatalog(GENERATIONS_ROOT, PARENT_DIR, CATALOG_DB, get_metadata_for_file)
+            _catalog.refresh()
+            CatalogWatcher(_catalog, {"trash": TRASH_DIR, "submissions": SUBMISSIONS_DIR}, EVENTS).start()
+        return _catalog
+
 @app.route('/api/images')
 def list_images():
     if not os.path.exists(GENERATIONS_ROOT):
         return jsonify([])
     
-    image_list = []
+    # Answered from the index; the catalog watcher keeps it up to date
+    catalog = get_catalog()
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        return jsonify(catalog.list_images())  # unpaged: every image, as before
     
-    for root, dirs, files in os.walk(GENERATIONS_ROOT):
-        for f in files:
-            if f.lower().endswith(('.png', '.jpg', '.jpeg')):
-                full_path = os.path.join(root, f)
-                rel_id = os.path.relpath(full_path, PARENT_DIR).replace('\\', '/')
-                folder_name = os.path.basename(root)
-                
-                # Pass image directory for JSON lookup (BUG FIX)
-                image_dir = root
-                meta = get_metadata_for_file(f, image_dir)
-                image_list.append({
-                    "id": rel_id,
-                    "filename": f,
-                    "folder": folder_name,
-                    "title": meta["Title"],
-                    "has_json": meta.get("has_json", False),
-                    "url": f"/images_serve/{rel_id}"
-                })
+    # Paged: ?limit=&cursor=&sort=&timestamp=&folder=&stage=raw|processed|upscaled&has_json=0|1&category=&q=
+    has_json = request.args.get('has_json')
+    filters = {
+        "timestamp": request.args.get('timestamp'),
+        "folder": request.args.get('folder'),
+        "stage": request.args.get('stage'),
+        "category": request.args.get('category'),
+        "q": request.args.get('q', '').strip(),
+        "has_json": None if has_json in (None, '') else has_json in ('1', 'true'),
+    }
+    try:
+        images, next_cursor = catalog.query(sort=request.args.get('sort', 'date-desc'),
+                                            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+                                            cursor=request.args.get('cursor'), **filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # The total is only counted for the first page
+    total = catalog.count_matching(**filters) if not request.args.get('cursor') else None
+    return jsonify({"images": images, "next_cursor": next_cursor, "total": total})
+
+@app.route('/api/images/facets')
+def image_facets():
+    """Timestamps and categories for the filter dropdowns."""
+    return jsonify(get_catalog().facets())
+
+@app.route('/api/events')
+def events():
+    """Server-Sent Events: `catalog` deltas and `folder` changes."""
+    get_catalog()  # starts the watcher
+    client = EVENTS.subscribe()
+    return Response(EVENTS.stream(client), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/images/reindex', methods=['POST'])
+def reindex_images():
+    """Full rescan that re-reads every image's metadata."""
+    listed, updated, removed = get_catalog().refresh(full=True)
+    return jsonify({"success": True, "message": f"Reindexed {listed} folders: {updated} images, {removed} removed"})
+
+# Previews for the grid (see thumbnails.py); full-size images only load in the lightbox
+THUMB_WORKERS = int(os.environ.get("DASHBOARD_THUMB_WORKERS", "2"))
+_thumbnails = None
+
+def get_thumbnails():
+    global _thumbnails
+    with _catalog_lock:
+        if _thumbnails is None:
+            _thumbnails = ThumbnailService(_catalog, workers=THUMB_WORKERS)
+        return _thumbnails
+
+@app.route('/thumbs/<path:filepath>')
+def serve_thumbnail(filepath):
+    """Preview of an image, ?size= one of THUMB_SIZES (max width). A current ?v= marks an immutable URL."""
+    width = request.args.get('size', THUMB_SIZES[0], type=int)
+    if width not in THUMB_SIZES:
+        return jsonify({"error": f"size must be one of {list(THUMB_SIZES)}"}), 400
+    full_path = os.path.realpath(os.path.join(PARENT_DIR, filepath))
+    if not full_path.startswith(os.path.realpath(PARENT_DIR) + os.sep) or not os.path.isfile(full_path):
+        return jsonify({"error": "Not found"}), 404
     
-    image_list.sort(key=lambda x: (x['folder'], x['filename']), reverse=True)
-    return jsonify(image_list)
+    get_catalog()  # digests are remembered in the catalog
+    thumbnails = get_thumbnails()
+    key = thumbnails.key(filepath, full_path, width)
+    if request.if_none_match.contains(key):
+        response = Response(status=304)
+        response.set_etag(key)
+    else:
+        try:
+            entry = thumbnails.get(key, full_path, width)
+        except Exception as e:
+            print(f"[THUMBNAIL] {filepath}: {e}")
+            return jsonify({"error": "Could not render preview"}), 404
+        response = send_file(entry, mimetype=thumbnails.mimetype, etag=key, conditional=True)
+    st = os.stat(full_path)
+    if request.args.get('v') == file_version(st.st_mtime, st.st_size):
+        # The URL changes with the source file, so the browser never has to revalidate
+        response.cache_control.no_cache = None  # send_file defaults to no-cache
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+# Sidecar files served instead of the original when the browser accepts the encoding
+# (e.g. metadata.json.br). Only checked for compressible types - PNG/JPEG/WebP are compressed already.
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+UNCOMPRESSED_TYPES = ("image/png", "image/jpeg", "image/webp", "image/avif")
+
+def file_etag(st):
+    """Strong validator: changes whenever the file is replaced (inode) or rewritten (size, mtime)."""
+    return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+def precompressed_variant(full_path, st):
+    """(path, stat, encoding) of a sidecar at least as new as the file that the client accepts, else None."""
+    for encoding, suffix in PRECOMPRESSED:
+        if encoding not in request.accept_encodings:
+            continue
+        try:
+            variant_st = os.stat(full_path + suffix)
+        except OSError:
+            continue
+        if variant_st.st_mtime_ns >= st.st_mtime_ns:
+            return full_path + suffix, variant_st, encoding
+    return None
 
 @app.route('/images_serve/<path:filepath>')
 def serve_image(filepath):
-    return send_from_directory(PARENT_DIR, filepath)
-
-# Job Queue for Upscale Tasks
-# Format: {"timestamp": str, "status": "pending"|"running"|"completed"|"failed", "pid": int, ...}
-UPSCALE_QUEUE = []
-QUEUE_LOCK = threading.Lock()
+    """Full-size file with ETag/Range support. ?v= (see image_catalog.file_version) marks an immutable URL."""
+    full_path = os.path.realpath(os.path.join(PARENT_DIR, filepath))
+    if not full_path.startswith(os.path.realpath(PARENT_DIR) + os.sep):
+        return jsonify({"error": "Not found"}), 404
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        return jsonify({"error": "Not found"}), 404
+    if not os.path.isfile(full_path):
+        return jsonify({"error": "Not found"}), 404
+    
+    mimetype = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    path, etag, encoding = full_path, file_etag(st), None
+    if mimetype not in UNCOMPRESSED_TYPES:
+        variant = precompressed_variant(full_path, st)
+        if variant:
+            path, variant_st, encoding = variant
+            etag = f"{file_etag(variant_st)}-{encoding}"
+    
+    if request.if_none_match.contains(etag):
+        # Revalidation costs a stat, not a read
+        response = Response(status=304)
+        response.set_etag(etag)
+    else:
+        response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, last_modified=st.st_mtime)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if mimetype not in UNCOMPRESSED_TYPES:
+        response.vary.add('Accept-Encoding')
+    if request.args.get('v') == file_version(st.st_mtime, st.st_size):
+        # Upscaled outputs are written once; any rewrite changes `v`, so the browser never revalidates
+        response.cache_control.no_cache = None  # send_file defaults to no-cache
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
 
 # Dashboard log helper
 LOG_DIR = os.path.join(PARENT_DIR, "logs")
@@ -164,56 +310,57 @@ def dashboard_log(message):
     except Exception as e:
         print(f"Error writing dashboard log: {e}")
 
-def monitor_subprocess(timestamp, proc):
-    """Monitor subprocess and update queue status when it completes."""
-    try:
-        # === IMPORTANT: Read stdout to prevent pipe buffer checking (Deadlock fix) ===
-        # generation_pipeline.py already writes to upscale.log, so we don't need to write to file again.
-        # But we must drain the pipe. We can optionally print to console for debugging.
-        for line in iter(proc.stdout.readline, b''):
-            line_str = line.decode('utf-8', errors='replace').strip()
-            if line_str:
-                # Optional: print to server console only, don't double-write to log file
-                # print(f"[SUBPROCESS] {line_str}")
-                pass
-                
-        proc.wait()  # Block until subprocess finishes
-        exit_code = proc.returncode
-        
-        with QUEUE_LOCK:
-            job = next((j for j in UPSCALE_QUEUE if j['timestamp'] == timestamp), None)
-            if job:
-                if exit_code == 0:
-                    job['status'] = 'completed'
-                    dashboard_log(f"✅ Upscale COMPLETED: {timestamp} (PID {proc.pid})")
-                else:
-                    job['status'] = 'failed'
-                    job['error'] = f"Process exited with code {exit_code}"
-                    dashboard_log(f"❌ Upscale FAILED: {timestamp} (exit code {exit_code})")
-                job['completed_at'] = datetime.now().isoformat()
-                
-                # Open upscaled folder on completion (no auto CSV - user generates via button)
-                if exit_code == 0:
-                    try:
-                        upscaled_dir = os.path.join(GENERATIONS_ROOT, timestamp, "upscaled")
-                        if os.path.exists(upscaled_dir):
-                            os.startfile(upscaled_dir)
-                    except Exception as e:
-                        print(f"[OPEN FOLDER] Error: {e}")
-                        
-    except Exception as e:
-        print(f"Error monitoring subprocess: {e}")
-        with QUEUE_LOCK:
-            job = next((j for j in UPSCALE_QUEUE if j['timestamp'] == timestamp), None)
-            if job:
-                job['status'] = 'failed'
-                job['error'] = str(e)
+# Job Queue for Upscale Tasks (see job_scheduler.py)
+# Job: {"id": int, "timestamp": str, "status": "pending"|"running"|"completed"|"failed"|"cancelled",
+#       "priority": int, "pid": int, "created_at": str, "started_at": str, "completed_at": str, "error": str, ...}
+JOBS_DB = os.path.join(LOG_DIR, "upscale_jobs.db")
+# Upscale subprocesses allowed at once; each one already uses every core for PyTorch
+MAX_CONCURRENT_JOBS = int(os.environ.get("UPSCALE_MAX_JOBS", "1"))
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def upscale_command(job):
+    """argv of a job's subprocess."""
+    # === SUBPROCESS ISOLATION ===
+    # Run upscaling in a separate process so crashes don't kill the dashboard
+    cmd = [sys.executable, os.path.join(PARENT_DIR, "generation_pipeline.py"), job['timestamp']]
+    if job.get('resume'):
+        cmd.append("--resume")
+    return cmd
+
+def open_upscaled_folder(job):
+    """Open the upscaled folder on completion (no auto CSV - user generates via button)."""
+    upscaled_dir = os.path.join(GENERATIONS_ROOT, job['timestamp'], "upscaled")
+    if os.path.exists(upscaled_dir) and hasattr(os, "startfile"):
+        os.startfile(upscaled_dir)
+
+def get_scheduler():
+    """The job scheduler, created and started on first use.
+
+    Started lazily from request handlers rather than at import: with debug=True
+    the reloader's watcher process imports this module too but never serves a
+    request, so an import-time start would run the saved queue twice.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler(
+                upscale_command, JOBS_DB, max_concurrent=MAX_CONCURRENT_JOBS, cwd=PARENT_DIR,
+                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0,
+                on_complete=open_upscaled_folder, log=dashboard_log)
+            _scheduler.start()
+        return _scheduler
 
 
 @app.route('/api/upscale', methods=['POST'])
 def upscale_images():
     data = request.json
     selected_ids = data.get('images', []) # list of rel paths
+    try:
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'priority must be an integer'}), 400
     
     timestamps = set()
     for rel_path in selected_ids:
@@ -229,72 +376,72 @@ def upscale_images():
     if not timestamps:
         return jsonify({'success': False, 'message': 'No valid timestamps found'})
     
+    scheduler = get_scheduler()
     count = 0
-    with QUEUE_LOCK:
-        for ts in timestamps:
-            # Check if already in queue
-            if any(j['timestamp'] == ts for j in UPSCALE_QUEUE):
-                continue
-                
-            print(f"[SUBPROCESS] Starting upscale for {ts}")
-            dashboard_log(f"🚀 Starting upscale subprocess for batch: {ts}")
-            
-            # === SUBPROCESS ISOLATION ===
-            # Run upscaling in a separate process so crashes don't kill the dashboard
-            pipeline_script = os.path.join(PARENT_DIR, "generation_pipeline.py")
-            proc = subprocess.Popen(
-                [sys.executable, pipeline_script, ts],
-                cwd=PARENT_DIR,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-            )
-            
-            dashboard_log(f"📋 Subprocess started: PID {proc.pid}")
-            
-            UPSCALE_QUEUE.append({
-                "timestamp": ts,
-                "status": "running",
-                "pid": proc.pid,
-                "created_at": datetime.now().isoformat(),
-                "started_at": datetime.now().isoformat()
-            })
-            
-            # Monitor subprocess in background thread
-            monitor_thread = threading.Thread(target=monitor_subprocess, args=(ts, proc))
-            monitor_thread.daemon = True
-            monitor_thread.start()
-            
+    for ts in sorted(timestamps):
+        # Skipped if the timestamp is already pending or running
+        if scheduler.submit(ts, priority=priority):
             count += 1
-        
-    return jsonify({'success': True, 'message': f'Started {count} upscale processes (isolated)'})
+    
+    skipped = len(timestamps) - count
+    message = f'Queued {count} upscale job(s), max {scheduler.max_concurrent} running at once'
+    if skipped:
+        message += f' ({skipped} already queued)'
+    return jsonify({'success': True, 'message': message})
 
 @app.route('/api/queue', methods=['GET'])
 def get_queue():
-    with QUEUE_LOCK:
-        return jsonify(UPSCALE_QUEUE)
+    """Active jobs plus the most recent finished ones (?finished=N, default 20)."""
+    finished = min(max(request.args.get('finished', RECENT_FINISHED, type=int), 0), 500)
+    return jsonify(get_scheduler().list_jobs(finished=finished))
+
+@app.route('/api/queue/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    try:
+        job = get_scheduler().cancel(job_id)
+    except KeyError:
+        return jsonify({'success': False, 'message': f'Unknown job {job_id}'}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/queue/<int:job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    try:
+        job = get_scheduler().retry(job_id)
+    except KeyError:
+        return jsonify({'success': False, 'message': f'Unknown job {job_id}'}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/queue/config', methods=['GET', 'POST'])
+def queue_config():
+    scheduler = get_scheduler()
+    if request.method == 'POST':
+        max_concurrent = (request.json or {}).get('max_concurrent')
+        if not isinstance(max_concurrent, int) or max_concurrent < 1:
+            return jsonify({'success': False, 'message': 'max_concurrent must be a positive integer'}), 400
+        scheduler.set_max_concurrent(max_concurrent)
+    return jsonify({'success': True, 'max_concurrent': scheduler.max_concurrent})
+
+# Log viewer (see log_tail.py): polls pass back `offset`/`file` and only get the new lines
+LOG_MAX_MB = int(os.environ.get("DASHBOARD_LOG_MAX_MB", "10"))
+upscale_log = LogTail(LOG_FILE, max_bytes=LOG_MAX_MB * 1024 ** 2, log=dashboard_log)
 
 @app.route('/api/logs', methods=['GET'])
 def get_logs():
-    log_file = os.path.join(PARENT_DIR, "logs", "upscale.log")
-    if not os.path.exists(log_file):
-        return jsonify({"lines": []})
-        
+    """Last 50 lines, or with ?offset=&file= from the previous response only the lines written since."""
     try:
-        # Read last 50 lines
-        with open(log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            return jsonify({"lines": lines[-50:]})
+        return jsonify(upscale_log.read(request.args.get('offset', type=int), request.args.get('file')))
     except Exception as e:
-        return jsonify({"lines": [f"Error reading log: {str(e)}"]})
+        return jsonify({"lines": [f"Error reading log: {str(e)}"], "offset": None, "file": None, "reset": True})
 
 @app.route('/api/logs/clear', methods=['POST'])
 def clear_logs():
     """Clear the upscale log file."""
-    log_file = os.path.join(PARENT_DIR, "logs", "upscale.log")
     try:
-        with open(log_file, 'w', encoding='utf-8') as f:
-            f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Log cleared\n")
+        upscale_log.clear(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Log cleared\n")
         return jsonify({"success": True, "message": "Logs cleared"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
@@ -357,7 +504,7 @@ def _create_submission_package_internal(selected_ids):
     print(f"[DEBUG] Creating submission package for {len(selected_ids)} files")
     
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    submission_folder = os.path.join(PARENT_DIR, "submissions", f"submission_{timestamp}")
+    submission_folder = os.path.join(SUBMISSIONS_DIR, f"submission_{timestamp}")
     os.makedirs(submission_folder, exist_ok=True)
     
     successful = []
@@ -416,6 +563,8 @@ def _create_submission_package_internal(selected_ids):
 def create_submission_package():
     """Generate submission.csv in the upscaled folder using JSON metadata."""
     selected_ids = request.json.get('files', [])
+    if not selected_ids and request.json.get('all'):
+        selected_ids = get_catalog().ids(stage='upscaled')
     if not selected_ids:
         return jsonify({"success": False, "message": "No files selected"})
     
@@ -456,7 +605,7 @@ def delete_images():
     print(f"[DELETE] Received request for {len(selected_ids)} files: {selected_ids}")
     
     # Ensure trash folder exists
-    trash_folder = os.path.join(PARENT_DIR, "trash")
+    trash_folder = TRASH_DIR
     os.makedirs(trash_folder, exist_ok=True)
     print(f"[DELETE] Trash folder: {trash_folder}")
     
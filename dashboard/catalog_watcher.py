@@ -0,0 +1,140 @@
+"""
+Filesystem watcher for the dashboard.
+
+Watches generations/, trash/ and submissions/ and keeps the image catalog up
+to date without anyone pressing Refresh. With the optional `watchdog`
+package, native change notifications (inotify, ReadDirectoryChangesW,
+FSEvents) wake the watcher; bursts of events (a run writing hundreds of
+files) are coalesced for DEBOUNCE_SECONDS into one incremental refresh that
+rescans the directories of the changed paths (a JSON sidecar edited in place
+doesn't change its folder's mtime). Without watchdog, or if the observer
+can't start, it polls every POLL_SECONDS instead - refresh() only stats the
+known folders and files, so a poll is cheap.
+
+Catalog deltas go to the browser as `catalog` events ({"upserted": [...],
+"removed": [...]}); changes to trash/ and submissions/ as `folder` events.
+"""
+
+import os
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# Quiet period before a burst of filesystem events is processed
+DEBOUNCE_SECONDS = 0.5
+# Poll interval without watchdog
+POLL_SECONDS = 2.0
+# Safety refresh with watchdog (missed events, network drives)
+RESYNC_SECONDS = 60.0
+
+
+class _Handler(FileSystemEventHandler):
+    def __init__(self, watcher, name):
+        self.watcher = watcher
+        self.name = name
+
+    def on_any_event(self, event):
+        if event.event_type in ("opened", "closed_no_write"):  # reads don't change anything
+            return
+        self.watcher.mark_dirty(self.name, event.src_path, getattr(event, "dest_path", None))
+
+
+class CatalogWatcher:
+    """Keeps `catalog` in sync with its root and publishes changes to `broker`.
+
+    Args:
+        catalog (ImageCatalog): Catalog of the generations/ folder.
+        folders (dict): Other folders to watch, name -> path (trash, submissions).
+        broker (EventBroker): Where change events are published.
+    """
+
+    def __init__(self, catalog, folders, broker, log=print):
+        self.catalog = catalog
+        self.folders = dict(folders)
+        self.broker = broker
+        self.log = log
+        self.mode = None
+        self._dirty = set()
+        self._paths = set()  # changed paths under generations/ since the last refresh
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._observer = None
+        self._mtimes = {}
+        catalog.on_change = self._publish_catalog
+
+    def start(self):
+        if self.mode is not None:
+            return
+        self.mode = "poll"
+        if Observer is not None:
+            try:
+                self._observer = Observer()
+                watched = [("generations", self.catalog.root)] + list(self.folders.items())
+                for name, path in watched:
+                    if os.path.isdir(path):
+                        self._observer.schedule(_Handler(self, name), path, recursive=True)
+                self._observer.daemon = True
+                self._observer.start()
+                self.mode = "watchdog"
+            except Exception as e:
+                self.log(f"[WATCHER] watchdog unavailable ({e}), polling every {POLL_SECONDS:.0f}s")
+                self._observer = None
+        self._mtimes = {name: self._folder_mtime(path) for name, path in self.folders.items()}
+        threading.Thread(target=self._run, name="catalog-watcher", daemon=True).start()
+        self.log(f"[WATCHER] Watching generations/, {', '.join(self.folders)} ({self.mode})")
+
+    def mark_dirty(self, name, *paths):
+        with self._lock:
+            self._dirty.add(name)
+            if name == "generations":
+                self._paths.update(os.fsdecode(p) for p in paths if p)
+        self._wake.set()
+
+    def _run(self):
+        interval = RESYNC_SECONDS if self.mode == "watchdog" else POLL_SECONDS
+        while True:
+            woken = self._wake.wait(interval)
+            if woken:
+                # Let the burst settle
+                while self._wake.wait(DEBOUNCE_SECONDS):
+                    self._wake.clear()
+            self._wake.clear()
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                paths, self._paths = self._paths, set()
+            try:
+                if not woken:
+                    self.catalog.refresh()
+                elif "generations" in dirty:
+                    self.catalog.refresh(paths=paths)
+                self._check_folders(dirty if woken else None)
+            except Exception as e:
+                self.log(f"[WATCHER] Refresh failed: {e}")
+
+    @staticmethod
+    def _folder_mtime(path):
+        """Newest mtime of a folder and its direct subfolders (a submission adds files one level down)."""
+        try:
+            with os.scandir(path) as entries:
+                mtimes = [e.stat().st_mtime for e in entries if e.is_dir(follow_symlinks=False)]
+            return max(mtimes + [os.stat(path).st_mtime])
+        except OSError:
+            return None
+
+    def _check_folders(self, dirty):
+        for name, path in self.folders.items():
+            if dirty is not None and name not in dirty:
+                continue
+            mtime = self._folder_mtime(path)
+            if dirty is None and mtime == self._mtimes.get(name):
+                continue
+            self._mtimes[name] = mtime
+            self.broker.publish("folder", {"name": name})
+
+    def _publish_catalog(self, upserted, removed):
+        self.broker.publish("catalog", {"upserted": upserted, "removed": removed})
@@ -0,0 +1,71 @@
+"""
+Server-Sent Events for the dashboard.
+
+EventBroker fans events out to every connected browser: each /api/events
+connection subscribes a bounded queue and streams it as `text/event-stream`.
+A client that stops reading is dropped once its queue is full (the browser's
+EventSource reconnects on its own and refetches what it missed).
+"""
+
+import json
+import queue
+import threading
+
+# Events buffered per client before it is considered gone
+CLIENT_QUEUE_SIZE = 256
+# Seconds between keep-alive comments (stops proxies from closing idle streams)
+KEEPALIVE_SECONDS = 15
+
+
+class EventBroker:
+    def __init__(self):
+        self._clients = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        client = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    @property
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def publish(self, event, data):
+        """Send `data` (JSON-serializable) as a named event to every client."""
+        message = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                # Slow client: drop it, making room for the None that ends its stream
+                self.unsubscribe(client)
+                try:
+                    client.get_nowait()
+                    client.put_nowait(None)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def stream(self, client):
+        """SSE body generator for one subscribed client."""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = client.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(client)
@@ -0,0 +1,372 @@
+"""
+Persistent image catalog for the dashboard.
+
+/api/images used to os.walk the whole generations/ tree and read every
+image's JSON sidecar on every refresh. ImageCatalog keeps one SQLite row per
+image (cache/image_catalog.db) keyed by its path relative to the project,
+with the file's mtime/size and the metadata the grid shows, and answers the
+listing from the index.
+
+refresh() is incremental: every known directory is stat'ed, and only
+directories whose mtime changed (a file was added, removed or renamed into
+it - the pipeline writes outputs atomically via rename) are listed again.
+Files rewritten in place (a JSON sidecar edited by update_json_metadata.py)
+don't change their directory's mtime, so the known images and sidecars of
+the other directories are stat'ed too. Inside a listed directory, only
+images whose mtime/size or JSON sidecar changed get their metadata re-read.
+refresh(paths=[...]) skips that stat pass and rescans the directories of the
+given paths instead (the watcher knows which files changed);
+refresh(full=True) re-reads everything. Each refresh that changed the index
+reports the delta to `on_change` (catalog_watcher.py pushes it to the
+browser). Refreshes are driven by that watcher, never by a request: reads
+only query the index.
+
+query() pages through the index with keyset cursors: a cursor holds the sort
+key of the last row returned, so every page is an index range scan no
+matter how deep it is, and rows added or removed meanwhile don't shift pages.
+"""
+
+import os
+import json
+import base64
+import sqlite3
+import threading
+import time
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+STAGES = ("raw", "processed", "upscaled")
+# Bump when the schema changes; the catalog is a cache and is rebuilt
+SCHEMA_VERSION = 3
+# Sort orders of query(): name -> (key columns, descending). `id` makes keys unique.
+SORTS = {
+    "date-desc": (("folder", "filename", "id"), True),
+    "date-asc": (("folder", "filename", "id"), False),
+    "name-asc": (("filename", "id"), False),
+    "name-desc": (("filename", "id"), True),
+}
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+IMAGE_FIELDS = "id, filename, folder, timestamp, stage, mtime, size, title, category, has_json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    timestamp TEXT,
+    stage TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    json_mtime REAL,
+    title TEXT,
+    keywords TEXT,
+    category TEXT,
+    has_json INTEGER NOT NULL DEFAULT 0,
+    digest TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_images_dir ON images (dir);
+CREATE INDEX IF NOT EXISTS idx_images_date ON images (folder, filename, id);
+CREATE INDEX IF NOT EXISTS idx_images_name ON images (filename, id);
+CREATE INDEX IF NOT EXISTS idx_images_timestamp ON images (timestamp, folder, filename, id);
+CREATE INDEX IF NOT EXISTS idx_images_stage ON images (stage, folder, filename, id);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dirs_parent ON dirs (parent);
+"""
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class ImageCatalog:
+    """SQLite index of the images under `root`.
+
+    Args:
+        root (str): Folder to index (generations/).
+        base (str): Folder image ids are relative to (the project root).
+        db_path (str): SQLite database file.
+        metadata (callable): (filename, image_dir) -> dict with Title,
+            Keywords, Category and has_json (get_metadata_for_file).
+        on_change (callable): Called after a refresh that changed the index with
+            (list of added/updated image dicts, list of removed image ids).
+    """
+
+    def __init__(self, root, base, db_path, metadata, on_change=None, log=print):
+        self.root = os.path.abspath(root)
+        self.base = os.path.abspath(base)
+        self.db_path = db_path
+        self.metadata = metadata
+        self.on_change = on_change
+        self.log = log
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._db.executescript("DROP TABLE IF EXISTS images; DROP TABLE IF EXISTS dirs;")
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._db.executescript(SCHEMA)
+
+    # --- paths ---
+
+    def rel_id(self, path):
+        return os.path.relpath(path, self.base).replace("\\", "/")
+
+    def describe_path(self, path):
+        """(timestamp, stage) of an image path: generations/<ts>[/processed|/upscaled]/<file>."""
+        parts = os.path.relpath(os.path.dirname(path), self.root).replace("\\", "/").split("/")
+        timestamp = parts[0] if parts[0] not in (".", "..") else None
+        stage = parts[-1] if len(parts) > 1 and parts[-1] in STAGES else "raw"
+        return timestamp, stage
+
+    # --- scanning ---
+
+    def refresh(self, full=False, paths=None):
+        """Bring the index up to date. Returns (directories listed, images updated, images removed).
+
+        Args:
+            full (bool): Re-read every image, not only changed ones.
+            paths (iterable): Files/directories known to have changed. Their directories are
+                rescanned and the other directories' files aren't stat'ed.
+        """
+        with self._refresh_lock:
+            t0 = time.perf_counter()
+            known = {row["path"]: row["mtime"] for row in self._rows("SELECT path, mtime FROM dirs")}
+            touched = None
+            if paths is not None:
+                touched = set()
+                for changed in paths:
+                    changed = os.path.abspath(changed)
+                    touched.add(changed if os.path.isdir(changed) else os.path.dirname(changed))
+            listed = 0
+            updated, removed = [], []
+            seen = set()
+            stack = [self.root] if os.path.isdir(self.root) else []
+            while stack:
+                path = stack.pop()
+                seen.add(path)
+                mtime = _mtime(path)
+                if mtime is None:
+                    continue
+                if (full or known.get(path) != mtime or
+                        (path in touched if touched is not None else self._files_changed(path))):
+                    subdirs, changed, gone = self.scan_dir(path, mtime, force=full)
+                    listed += 1
+                    updated += changed
+                    removed += gone
+                else:
+                    subdirs = [row["path"] for row in
+                               self._rows("SELECT path FROM dirs WHERE parent = ?", (path,))]
+                stack.extend(subdirs)
+            for path in set(known) - seen:
+                removed += self.forget_dir(path)
+        if updated or removed:
+            self.log(f"[CATALOG] {listed} dir(s) rescanned, {len(updated)} image(s) indexed, "
+                     f"{len(removed)} removed in {time.perf_counter() - t0:.2f}s")
+            if self.on_change:
+                self.on_change(self.images(updated), removed)
+        return listed, len(updated), len(removed)
+
+    def _files_changed(self, path):
+        """Whether an indexed image of `path` or its JSON sidecar was rewritten, without listing `path`."""
+        for row in self._rows("SELECT filename, mtime, size, json_mtime FROM images WHERE dir = ?", (path,)):
+            try:
+                st = os.stat(os.path.join(path, row["filename"]))
+            except OSError:
+                return True
+            json_mtime = _mtime(os.path.join(path, row["filename"].rsplit(".", 1)[0] + ".json"))
+            if (row["mtime"], row["size"], row["json_mtime"]) != (st.st_mtime, st.st_size, json_mtime):
+                return True
+        return False
+
+    def scan_dir(self, path, mtime=None, force=False):
+        """List one directory and sync its images. Returns (subdirectories, updated ids, removed ids)."""
+        subdirs, files = [], {}
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file():
+                        files[entry.name] = entry
+        except OSError:
+            return [], [], self.forget_dir(path)
+
+        existing = {row["filename"]: row for row in
+                    self._rows("SELECT filename, mtime, size, json_mtime FROM images WHERE dir = ?", (path,))}
+        rows = []
+        for name, entry in files.items():
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            st = entry.stat()
+            sidecar = files.get(name.rsplit(".", 1)[0] + ".json")
+            json_mtime = sidecar.stat().st_mtime if sidecar is not None else None
+            old = existing.get(name)
+            if not force and old is not None and (old["mtime"], old["size"], old["json_mtime"]) == \
+                    (st.st_mtime, st.st_size, json_mtime):
+                continue
+            rows.append(self._image_row(path, name, st, json_mtime))
+        gone = [name for name in existing if name not in files]
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                # Replacing a row also clears its digest (the file changed)
+                self._db.executemany("INSERT OR REPLACE INTO images VALUES "
+                                     "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)", rows)
+                self._db.executemany("DELETE FROM images WHERE dir = ? AND filename = ?",
+                                     [(path, name) for name in gone])
+                self._db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                                 (path, os.path.dirname(path) if path != self.root else None,
+                                  mtime if mtime is not None else _mtime(path)))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return subdirs, [row[0] for row in rows], [self.rel_id(os.path.join(path, name)) for name in gone]
+
+    def _image_row(self, directory, filename, st, json_mtime):
+        full_path = os.path.join(directory, filename)
+        timestamp, stage = self.describe_path(full_path)
+        meta = self.metadata(filename, directory)
+        return (self.rel_id(full_path), directory, filename, os.path.basename(directory), timestamp, stage,
+                st.st_mtime, st.st_size, json_mtime, meta["Title"], meta.get("Keywords"), meta.get("Category"),
+                int(bool(meta.get("has_json", False))))
+
+    def forget_dir(self, path):
+        """Drop a directory and everything below it from the index. Returns the removed image ids."""
+        prefix = path.rstrip(os.sep) + os.sep
+        like = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        with self._lock:
+            where = "dir = ? OR dir LIKE ? ESCAPE '\\'"
+            removed = [row[0] for row in self._db.execute(f"SELECT id FROM images WHERE {where}", (path, like))]
+            self._db.execute(f"DELETE FROM images WHERE {where}", (path, like))
+            self._db.execute("DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'", (path, like))
+        return removed
+
+    # --- queries ---
+
+    def _rows(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _image_dict(row):
+        # `v` changes with the file, so image and thumbnail URLs can be cached as immutable
+        version = file_version(row["mtime"], row["size"])
+        return {"id": row["id"], "filename": row["filename"], "folder": row["folder"],
+                "timestamp": row["timestamp"], "stage": row["stage"], "title": row["title"],
+                "category": row["category"], "has_json": bool(row["has_json"]),
+                "url": f"/images_serve/{row['id']}?v={version}", "thumb": f"/thumbs/{row['id']}?v={version}"}
+
+    def list_images(self):
+        """Every indexed image as the dicts /api/images returns, newest folder first."""
+        return [self._image_dict(row) for row in
+                self._rows(f"SELECT {IMAGE_FIELDS} FROM images ORDER BY folder DESC, filename DESC, id DESC")]
+
+    @staticmethod
+    def _where(timestamp=None, folder=None, stage=None, has_json=None, category=None, q=None):
+        clauses, params = [], []
+        for column, value in (("timestamp", timestamp), ("folder", folder), ("stage", stage),
+                              ("category", category)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if has_json is not None:
+            clauses.append("has_json = ?")
+            params.append(int(bool(has_json)))
+        if q:
+            like = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            clauses.append("(title LIKE ? ESCAPE '\\' OR filename LIKE ? ESCAPE '\\')")
+            params += [like, like]
+        return clauses, params
+
+    def query(self, sort="date-desc", limit=DEFAULT_PAGE_SIZE, cursor=None, **filters):
+        """One page of images matching `filters` (see _where). Returns (images, next cursor or None).
+
+        Raises:
+            ValueError: Unknown sort or malformed cursor.
+        """
+        if sort not in SORTS:
+            raise ValueError(f"sort must be one of {list(SORTS)}")
+        columns, descending = SORTS[sort]
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        clauses, params = self._where(**filters)
+        if cursor:
+            key = decode_cursor(cursor, len(columns))
+            clauses.append(f"({', '.join(columns)}) {'<' if descending else '>'} ({', '.join('?' * len(key))})")
+            params += key
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = ", ".join(f"{c} {'DESC' if descending else 'ASC'}" for c in columns)
+        rows = self._rows(f"SELECT {IMAGE_FIELDS} FROM images {where} ORDER BY {order} LIMIT ?", params + [limit + 1])
+        next_cursor = encode_cursor([rows[limit - 1][c] for c in columns]) if len(rows) > limit else None
+        return [self._image_dict(row) for row in rows[:limit]], next_cursor
+
+    def count_matching(self, **filters):
+        clauses, params = self._where(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._rows(f"SELECT COUNT(*) FROM images {where}", params)[0][0]
+
+    def facets(self):
+        """Filter values present in the index: timestamps (newest first) and categories."""
+        timestamps = [row[0] for row in self._rows("SELECT DISTINCT timestamp FROM images "
+                                                   "WHERE timestamp IS NOT NULL ORDER BY timestamp DESC")]
+        categories = [row[0] for row in self._rows("SELECT DISTINCT category FROM images "
+                                                   "WHERE category IS NOT NULL")]
+        return {"timestamps": timestamps, "categories": sorted(categories, key=lambda c: (len(c), c))}
+
+    def ids(self, **filters):
+        clauses, params = self._where(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return [row[0] for row in self._rows(f"SELECT id FROM images {where}", params)]
+
+    def images(self, ids):
+        """Image dicts of `ids` (unknown ids are skipped)."""
+        found = []
+        for i in range(0, len(ids), 500):  # stay under SQLite's bound-parameter limit
+            chunk = ids[i:i + 500]
+            found += self._rows(f"SELECT {IMAGE_FIELDS} FROM images WHERE id IN ({', '.join('?' * len(chunk))})",
+                                chunk)
+        return [self._image_dict(row) for row in found]
+
+    def digest_for(self, image_id, mtime, size):
+        """Remembered sha256 of an image, if its mtime/size still match."""
+        rows = self._rows("SELECT digest FROM images WHERE id = ? AND mtime = ? AND size = ?", (image_id, mtime, size))
+        return rows[0][0] if rows else None
+
+    def set_digest(self, image_id, mtime, size, digest):
+        with self._lock:
+            self._db.execute("UPDATE images SET digest = ? WHERE id = ? AND mtime = ? AND size = ?",
+                             (digest, image_id, mtime, size))
+
+    def count(self):
+        return self._rows("SELECT COUNT(*) FROM images")[0][0]
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, length):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Malformed cursor: {e}") from e
+    if not isinstance(key, list) or len(key) != length:
+        raise ValueError("Cursor doesn't match the sort order")
+    return key
+
+
+def file_version(mtime, size):
+    """Short token that changes whenever a file is rewritten (the `v` of image URLs)."""
+    return f"{int(mtime * 1000):x}-{size:x}"
@@ -0,0 +1,304 @@
+"""
+Upscale job scheduler for the dashboard.
+
+The dashboard used to start one generation_pipeline.py subprocess per selected
+timestamp, all at once, so five selected batches meant five PyTorch processes
+competing for the same cores and RAM. JobScheduler queues the jobs instead and
+runs at most `max_concurrent` of them; the rest wait, highest priority first
+and FIFO within a priority.
+
+Each job still runs in its own subprocess, so a pipeline crash can't take the
+dashboard down. Jobs live in a SQLite store (job_store.py) that is updated on
+every change. On start, pending jobs are picked up where they were. A job that
+was running when the dashboard stopped is adopted if its process is still
+alive: it keeps its slot and is watched until it exits. Otherwise it is marked
+failed so it can be retried (retries pass --resume, which keeps every image
+already finished).
+"""
+
+import os
+import sys
+import time
+import signal
+import threading
+import subprocess
+from datetime import datetime
+
+from job_store import JobStore, ACTIVE_STATES
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+JOB_STATES = ("pending", "running", "completed", "failed", "cancelled")
+RETRYABLE_STATES = ("failed", "cancelled")
+# Seconds a cancelled job gets to exit after terminate() before it is killed
+CANCEL_GRACE_SECONDS = 10
+# Poll interval for adopted processes (their exit can't be waited on)
+ORPHAN_POLL_SECONDS = 2.0
+# Finished jobs returned by list_jobs() besides the active ones
+RECENT_FINISHED = 20
+
+
+def _now():
+    return datetime.now().isoformat()
+
+
+class OrphanProcess:
+    """Popen-like handle of a job process started by a previous dashboard process.
+
+    It isn't our child, so its exit code is unknown (returncode stays None).
+    """
+
+    def __init__(self, pid, process=None):
+        self.pid = pid
+        self.returncode = None
+        self._process = process
+
+    @staticmethod
+    def find(pid, timestamp):
+        """Handle of `pid` if it is still an upscale of `timestamp`, else None (exited or PID reused)."""
+        if not pid:
+            return None
+        if psutil is not None:
+            try:
+                process = psutil.Process(pid)
+                cmdline = " ".join(process.cmdline())
+            except (psutil.Error, OSError):
+                return None
+            if "generation_pipeline.py" not in cmdline or timestamp not in cmdline:
+                return None
+            return OrphanProcess(pid, process)
+        if sys.platform == "win32":
+            return None  # no portable liveness check without psutil
+        orphan = OrphanProcess(pid)
+        return orphan if orphan.poll() is None else None
+
+    def poll(self):
+        if self._process is not None:
+            try:
+                running = self._process.is_running() and self._process.status() != psutil.STATUS_ZOMBIE
+            except psutil.Error:
+                return 0
+            return None if running else 0
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return 0
+        except PermissionError:
+            pass  # exists, owned by someone else
+        return None
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(f"PID {self.pid}", timeout)
+            time.sleep(ORPHAN_POLL_SECONDS if deadline is None else 0.2)
+
+    def terminate(self):
+        self._signal(signal.SIGTERM)
+
+    def kill(self):
+        self._signal(getattr(signal, "SIGKILL", signal.SIGTERM))
+
+    def _signal(self, signum):
+        try:
+            os.kill(self.pid, signum)
+        except OSError:
+            pass  # already gone
+
+
+class JobScheduler:
+    """Runs upscale jobs as subprocesses, at most `max_concurrent` at a time.
+
+    Args:
+        command (callable): Job dict -> argv of the job's subprocess.
+        store_path (str): SQLite database the jobs are kept in.
+        max_concurrent (int): Jobs allowed to run at the same time.
+        cwd (str): Working directory of the subprocesses.
+        creationflags (int): Popen creationflags (CREATE_NO_WINDOW on Windows).
+        on_complete (callable): Called with the job dict after a job exits with code 0.
+    """
+
+    def __init__(self, command, store_path, max_concurrent=1, cwd=None, creationflags=0, on_complete=None,
+                 log=print):
+        self.command = command
+        self.store_path = store_path
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.cwd = cwd
+        self.creationflags = creationflags
+        self.on_complete = on_complete
+        self.log = log
+        self.store = None
+        self._procs = {}  # id -> Popen / OrphanProcess of every job whose process hasn't exited yet
+        self._lock = threading.RLock()
+        self._started = False
+
+    def start(self):
+        """Open the store, recover jobs of the previous run and start pending ones. Safe to call more than once."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self.store = JobStore(self.store_path)
+            removed = self.store.compact()
+            adopted = interrupted = 0
+            for job in self.store.active():
+                if job["status"] != "running":
+                    continue
+                # Its monitor died with the previous dashboard process
+                orphan = OrphanProcess.find(job["pid"], job["timestamp"])
+                if orphan is not None:
+                    self._procs[job["id"]] = orphan
+                    threading.Thread(target=self._monitor, args=(job["id"], orphan), daemon=True).start()
+                    adopted += 1
+                else:
+                    self.store.update(job["id"], status="failed", error="Interrupted by a dashboard restart",
+                                      completed_at=_now())
+                    interrupted += 1
+            pending = sum(1 for j in self.store.active() if j["status"] == "pending")
+            if pending or adopted or interrupted or removed:
+                self.log(f"📋 Job queue restored: {pending} pending, {adopted} still running, "
+                         f"{interrupted} interrupted, {removed} old job(s) compacted "
+                         f"(max {self.max_concurrent} concurrent)")
+            self._dispatch()
+
+    # --- queue operations ---
+
+    def list_jobs(self, finished=RECENT_FINISHED):
+        """The most recent `finished` finished jobs, then the active ones in run order."""
+        self.start()
+        return self.store.recent_finished(finished) + self.store.active()
+
+    def submit(self, timestamp, priority=0, resume=False):
+        """Queue an upscale of `timestamp`. Returns the job, or None if one is already pending/running."""
+        self.start()
+        with self._lock:
+            if self.store.active_for(timestamp):
+                return None
+            job = self.store.insert(timestamp, priority=priority, resume=resume)
+            self.log(f"📥 Queued upscale: {timestamp} (job {job['id']}, priority {job['priority']})")
+            self._dispatch()
+            return self.store.get(job["id"])
+
+    def cancel(self, job_id):
+        """Cancel a pending job, or terminate a running one. Returns the job.
+
+        Raises:
+            KeyError: Unknown job id.
+            ValueError: The job already finished.
+        """
+        self.start()
+        with self._lock:
+            job = self._get(job_id)
+            if job["status"] not in ACTIVE_STATES:
+                raise ValueError(f"Job {job_id} is already {job['status']}")
+            proc = self._procs.get(job_id)
+            job = self.store.update(job_id, status="cancelled", completed_at=_now(), error="Cancelled")
+            self.log(f"🛑 Upscale CANCELLED: {job['timestamp']} (job {job_id})")
+        if proc is not None:
+            # The slot is freed by the monitor once the process has actually exited
+            threading.Thread(target=self._terminate, args=(proc,), daemon=True).start()
+        return job
+
+    def retry(self, job_id):
+        """Queue a failed or cancelled job again, with --resume. Returns the job.
+
+        Raises:
+            KeyError: Unknown job id.
+            ValueError: The job can't be retried (still active, or its timestamp has another active job).
+        """
+        self.start()
+        with self._lock:
+            job = self._get(job_id)
+            if job["status"] not in RETRYABLE_STATES:
+                raise ValueError(f"Job {job_id} is {job['status']}, only failed or cancelled jobs can be retried")
+            if job_id in self._procs:
+                raise ValueError(f"Job {job_id} is still shutting down")
+            other = self.store.active_for(job["timestamp"])
+            if other:
+                raise ValueError(f"{job['timestamp']} already has an active job ({other['id']})")
+            self.store.requeue(job_id, resume=True, pid=None, started_at=None, completed_at=None, error=None)
+            self.log(f"🔁 Retrying upscale: {job['timestamp']} (job {job_id})")
+            self._dispatch()
+            return self.store.get(job_id)
+
+    def set_max_concurrent(self, max_concurrent):
+        self.start()
+        with self._lock:
+            self.max_concurrent = max(1, int(max_concurrent))
+            self.log(f"⚙️ Max concurrent upscale jobs: {self.max_concurrent}")
+            self._dispatch()
+
+    def _get(self, job_id):
+        job = self.store.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    # --- running jobs ---
+
+    def _dispatch(self):
+        """Start pending jobs while slots are free (call with the lock held)."""
+        while len(self._procs) < self.max_concurrent:
+            job = self.store.next_pending()
+            if job is None:
+                return
+            self._run(job)
+
+    def _run(self, job):
+        try:
+            # generation_pipeline.py writes its own upscale.log. No pipe back to the dashboard: its read
+            # end would close on a dashboard restart, and the adopted job would die of BrokenPipeError
+            proc = subprocess.Popen(self.command(job), cwd=self.cwd, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL, creationflags=self.creationflags)
+        except OSError as e:
+            self.store.update(job["id"], status="failed", error=f"Could not start process: {e}",
+                              completed_at=_now())
+            self.log(f"❌ Upscale FAILED to start: {job['timestamp']} ({e})")
+            return
+        self._procs[job["id"]] = proc
+        self.store.update(job["id"], status="running", pid=proc.pid, started_at=_now(),
+                          attempts=job["attempts"] + 1)
+        self.log(f"🚀 Starting upscale subprocess for batch: {job['timestamp']} (job {job['id']}, PID {proc.pid})")
+        threading.Thread(target=self._monitor, args=(job["id"], proc), daemon=True).start()
+
+    def _monitor(self, job_id, proc):
+        """Wait for the job's process, record how it ended and start the next job."""
+        error = None
+        try:
+            proc.wait()
+        except Exception as e:
+            error = str(e)
+        completed = None
+        with self._lock:
+            self._procs.pop(job_id, None)
+            job = self.store.get(job_id)
+            if job is not None and job["status"] == "running":
+                exit_code = proc.returncode
+                if error is None and exit_code == 0:
+                    completed = self.store.update(job_id, status="completed", completed_at=_now())
+                    self.log(f"✅ Upscale COMPLETED: {job['timestamp']} (PID {proc.pid})")
+                else:
+                    if error is None:
+                        error = (f"Process exited with code {exit_code}" if exit_code is not None else
+                                 "Exit status unknown (process outlived a dashboard restart); retry to resume")
+                    self.store.update(job_id, status="failed", error=error, completed_at=_now())
+                    self.log(f"❌ Upscale FAILED: {job['timestamp']} ({error})")
+                self.store.compact()
+            self._dispatch()
+        if completed and self.on_complete:
+            try:
+                self.on_complete(completed)
+            except Exception as e:
+                self.log(f"⚠️ on_complete failed for {completed['timestamp']}: {e}")
+
+    @staticmethod
+    def _terminate(proc):
+        proc.terminate()
+        try:
+            proc.wait(timeout=CANCEL_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            proc.kill()
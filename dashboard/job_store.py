@@ -0,0 +1,147 @@
+"""
+SQLite store for the dashboard's upscale jobs.
+
+One row per job in logs/upscale_jobs.db. Lookups the scheduler makes on
+every request (active jobs, the next pending job, the active job of a
+timestamp) go through indexes on status and timestamp, so they cost the
+number of active jobs, not the length of the job history. Finished jobs are
+kept for RETENTION_DAYS, and at most KEEP_FINISHED of them (compact()).
+
+The database runs in WAL mode and every change is its own transaction, so
+a killed dashboard leaves the queue as of its last change.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+ACTIVE_STATES = ("pending", "running")
+# Retention of finished jobs
+RETENTION_DAYS = 14
+KEEP_FINISHED = 500
+
+COLUMNS = ("id", "timestamp", "status", "priority", "seq", "resume", "attempts", "pid", "created_at",
+           "started_at", "completed_at", "error")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    seq INTEGER NOT NULL,
+    resume INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    pid INTEGER,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    completed_at TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority DESC, seq);
+CREATE INDEX IF NOT EXISTS idx_jobs_timestamp ON jobs (timestamp, status);
+CREATE INDEX IF NOT EXISTS idx_jobs_completed ON jobs (completed_at);
+"""
+
+
+def _row(row):
+    if row is None:
+        return None
+    job = dict(row)
+    if "resume" in job:
+        job["resume"] = bool(job["resume"])
+    return job
+
+
+class JobStore:
+    """Thread-safe job table. Jobs are plain dicts with the COLUMNS keys."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [_row(r) for r in self._db.execute(sql, params).fetchall()]
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params)
+
+    def get(self, job_id):
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def insert(self, timestamp, priority=0, resume=False, created_at=None):
+        """Add a pending job at the back of its priority. Returns it."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM jobs").fetchone()[0]
+                cur = self._db.execute(
+                    "INSERT INTO jobs (timestamp, status, priority, seq, resume, created_at) "
+                    "VALUES (?, 'pending', ?, ?, ?, ?)",
+                    (timestamp, int(priority), seq, int(bool(resume)), created_at or datetime.now().isoformat()))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return self.get(cur.lastrowid)
+
+    def update(self, job_id, **fields):
+        unknown = set(fields) - set(COLUMNS[1:])
+        if unknown:
+            raise ValueError(f"Unknown job fields: {sorted(unknown)}")
+        if "resume" in fields:
+            fields["resume"] = int(bool(fields["resume"]))
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        return self.get(job_id)
+
+    def requeue(self, job_id, **fields):
+        """Move a job to the back of its priority as pending."""
+        with self._lock:
+            seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM jobs").fetchone()[0]
+        return self.update(job_id, status="pending", seq=seq, **fields)
+
+    def active(self):
+        """Pending and running jobs, in the order they will run (running first)."""
+        return self._query("SELECT * FROM jobs WHERE status IN ('running', 'pending') "
+                           "ORDER BY status = 'pending', priority DESC, seq")
+
+    def next_pending(self):
+        rows = self._query("SELECT * FROM jobs WHERE status = 'pending' ORDER BY priority DESC, seq LIMIT 1")
+        return rows[0] if rows else None
+
+    def active_for(self, timestamp):
+        rows = self._query("SELECT * FROM jobs WHERE timestamp = ? AND status IN ('pending', 'running') LIMIT 1",
+                           (timestamp,))
+        return rows[0] if rows else None
+
+    def recent_finished(self, limit):
+        rows = self._query("SELECT * FROM jobs WHERE completed_at IS NOT NULL AND status IN "
+                           "('completed', 'failed', 'cancelled') ORDER BY completed_at DESC LIMIT ?", (limit,))
+        return rows[::-1]
+
+    def compact(self, retention_days=RETENTION_DAYS, keep=KEEP_FINISHED):
+        """Delete finished jobs older than `retention_days` or beyond the newest `keep`. Returns the count."""
+        cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+        finished = "status IN ('completed', 'failed', 'cancelled')"
+        with self._lock:
+            deleted = self._db.execute(f"DELETE FROM jobs WHERE {finished} AND completed_at < ?",
+                                       (cutoff,)).rowcount
+            deleted += self._db.execute(
+                f"DELETE FROM jobs WHERE {finished} AND id NOT IN "
+                f"(SELECT id FROM jobs WHERE {finished} ORDER BY completed_at DESC LIMIT ?)", (keep,)).rowcount
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._db.close()
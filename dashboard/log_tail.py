@@ -0,0 +1,197 @@
+"""
+Incremental reader for logs/upscale.log.
+
+The dashboard polls the log every 2 seconds. Reading the whole file for the
+last 50 lines made each poll cost the size of the log, so LogTail reads the
+initial tail backwards from EOF in blocks, then hands out an `offset` (and a
+`file` id) with every response. The next poll passes them back and only the
+bytes written since are read. Only complete lines are returned; a partial
+last line waits for the next poll.
+
+The log is rotated by size (upscale.log -> upscale.log.1 -> ... .N) when it
+grows past `max_bytes`. Writers open the file per line in append mode, so
+the next line after a rotation simply creates a fresh upscale.log. A client
+whose `file` id is now upscale.log.1 gets the rest of that file first, then
+the new log; any other mismatch (cleared, deleted, rotated twice) resets
+the client to a fresh tail.
+
+Clearing the log truncates it in place, which keeps the inode. So the
+`file` id also carries a truncation generation: LogTail remembers the
+furthest offset it served per file, and a file that shrank below it (or
+was emptied through clear()) gets a new generation. Clients of an older
+generation start over at offset 0, and so does a client whose offset no
+longer falls on a line start (truncated and refilled between two polls).
+"""
+
+import os
+import threading
+
+# Lines of the initial tail
+TAIL_LINES = 50
+# Bytes read per step when seeking backwards from EOF
+TAIL_BLOCK = 64 * 1024
+# Most bytes one poll returns (a client far behind catches up over several polls)
+MAX_READ_BYTES = 256 * 1024
+DEFAULT_MAX_MB = 10
+DEFAULT_BACKUPS = 3
+
+
+def file_id(st):
+    """Identity of a log file: survives appends and renames, changes when the file is replaced."""
+    return f"{st.st_dev:x}-{st.st_ino:x}"
+
+
+def tail_lines(f, end, count=TAIL_LINES, block=TAIL_BLOCK):
+    """Last `count` complete lines before byte `end` of binary file `f`, reading backwards. Returns (lines, end)."""
+    data = b""
+    pos = end
+    while pos > 0 and data.count(b"\n") <= count:
+        step = min(block, pos)
+        pos -= step
+        f.seek(pos)
+        data = f.read(step) + data
+    # Drop a trailing partial line (still being written)
+    complete = data.rfind(b"\n") + 1
+    end -= len(data) - complete
+    lines = data[:complete].splitlines(keepends=True)[-count:]
+    return [line.decode("utf-8", errors="replace") for line in lines], end
+
+
+def _at_line_start(f, offset):
+    """Whether `offset` is 0 or just past a newline; an offset from before an unseen truncation may not be."""
+    if offset == 0:
+        return True
+    f.seek(offset - 1)
+    return f.read(1) == b"\n"
+
+
+def read_from(f, offset, limit=MAX_READ_BYTES):
+    """Complete lines between `offset` and EOF (at most `limit` bytes). Returns (lines, new offset)."""
+    f.seek(offset)
+    data = f.read(limit)
+    complete = data.rfind(b"\n") + 1
+    if not complete and len(data) == limit:
+        complete = len(data)  # one huge line: hand it out in pieces
+    data = data[:complete]
+    return data.decode("utf-8", errors="replace").splitlines(keepends=True), offset + len(data)
+
+
+class LogTail:
+    """Tails one log file for many polling clients and rotates it by size.
+
+    Args:
+        path (str): The log file.
+        max_bytes (int): Size at which the log is rotated (0 disables rotation).
+        backups (int): Rotated files kept (path.1 is the newest).
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_MB * 1024 ** 2, backups=DEFAULT_BACKUPS, log=print):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.log = log
+        self._lock = threading.Lock()
+        self._generations = {}  # file_id -> truncations seen
+        self._served = {}  # file_id -> furthest offset handed out
+
+    def _id(self, st):
+        """Client-facing id: file_id plus the truncation generation, if any."""
+        base = file_id(st)
+        with self._lock:
+            if st.st_size < self._served.get(base, 0):
+                self._generations[base] = self._generations.get(base, 0) + 1
+                self._served[base] = 0
+            generation = self._generations.get(base, 0)
+        return f"{base}.{generation}" if generation else base
+
+    def _serve(self, st, result):
+        with self._lock:
+            base = file_id(st)
+            self._served[base] = max(self._served.get(base, 0), result["offset"])
+        return result
+
+    def clear(self, first_line=""):
+        """Truncate the log in place (optionally starting it with `first_line`); clients start over."""
+        with self._lock:
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(first_line)
+                st = os.fstat(f.fileno())
+            base = file_id(st)
+            self._generations[base] = self._generations.get(base, 0) + 1
+            self._served[base] = 0
+
+    def read(self, offset=None, file=None, count=TAIL_LINES):
+        """New lines since `offset` of log `file`, or the last `count` lines for a new client.
+
+        Returns {"lines": [...], "offset": int, "file": str, "reset": bool}; `reset` means the
+        lines replace what the client shows instead of being appended to it.
+        """
+        self.rotate_if_needed()
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return {"lines": [], "offset": 0, "file": None, "reset": True}
+        current = self._id(st)
+        if file is not None and offset is not None and file != current:
+            rotated = self._read_rotated(file, offset)
+            if rotated is not None:
+                return rotated
+        with open(self.path, "rb") as f:
+            if (file == current and offset is not None and 0 <= offset <= st.st_size
+                    and _at_line_start(f, offset)):
+                lines, end = read_from(f, offset)
+                return self._serve(st, {"lines": lines, "offset": end, "file": current, "reset": False})
+            if file is not None and file.split(".")[0] == file_id(st):
+                # Same file, truncated since that client's last poll: it starts over
+                lines, end = read_from(f, 0)
+            else:
+                lines, end = tail_lines(f, st.st_size, count)
+            return self._serve(st, {"lines": lines, "offset": end, "file": current, "reset": True})
+
+    def _read_rotated(self, file, offset):
+        """Rest of the client's file if it was rotated to path.1 since its last poll."""
+        backup = f"{self.path}.1"
+        try:
+            st = os.stat(backup)
+        except OSError:
+            return None
+        if self._id(st) != file or not 0 <= offset <= st.st_size:
+            return None
+        with open(backup, "rb") as f:
+            lines, end = read_from(f, offset)
+        if end < st.st_size:
+            return {"lines": lines, "offset": end, "file": file, "reset": False}
+        # Caught up with the old file: continue at the start of the new one
+        try:
+            with open(self.path, "rb") as f:
+                new_st = os.fstat(f.fileno())
+                new_lines, new_end = read_from(f, 0)
+        except FileNotFoundError:
+            return {"lines": lines, "offset": end, "file": file, "reset": False}
+        return self._serve(new_st, {"lines": lines + new_lines, "offset": new_end, "file": self._id(new_st),
+                                    "reset": False})
+
+    def rotate_if_needed(self):
+        """Rotate the log if it outgrew max_bytes. Returns True if it was rotated."""
+        if not self.max_bytes:
+            return False
+        with self._lock:
+            try:
+                size = os.path.getsize(self.path)
+                if size < self.max_bytes:
+                    return False
+                for i in range(self.backups - 1, 0, -1):
+                    src = f"{self.path}.{i}"
+                    if os.path.exists(src):
+                        os.replace(src, f"{self.path}.{i + 1}")
+                if self.backups:
+                    os.replace(self.path, f"{self.path}.1")
+                else:
+                    os.remove(self.path)
+            except OSError as e:
+                # Missing log, or (Windows) a writer has it open right now - try again next poll
+                if not isinstance(e, FileNotFoundError):
+                    self.log(f"[LOGS] Could not rotate {os.path.basename(self.path)}: {e}")
+                return False
+        self.log(f"[LOGS] Rotated {os.path.basename(self.path)} at {size / 1024 ** 2:.1f} MB")
+        return True
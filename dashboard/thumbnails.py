@@ -0,0 +1,116 @@
+"""
+Thumbnails for the dashboard grid.
+
+The grid used to load every image at full size - 4K-8K upscales included -
+so a page load cost hundreds of megabytes. ThumbnailService renders previews
+at a few fixed widths (THUMB_SIZES) as WebP (JPEG if Pillow lacks WebP) on a
+small thread pool, so at most `workers` full-size images are decoded at once
+and concurrent requests for the same preview share one render.
+
+Previews are stored in a content-addressed ResultCache under
+cache/thumbnails/: the key hashes the source bytes plus width and format, so
+copies of an image (hardlinked upscales in several runs) share a preview,
+and the cache is LRU-evicted to `max_bytes`. The source digest is remembered
+in the image catalog and only recomputed when the file's mtime/size change.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, features
+
+from result_cache import ResultCache, file_digest, cache_key
+
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THUMB_DIR = os.path.join(PARENT_DIR, "cache", "thumbnails")
+THUMB_SIZES = (320, 640, 1280)  # max width in pixels
+DEFAULT_MAX_MB = 1024
+THUMB_QUALITY = 80
+# Bump to invalidate every cached preview (rendering changed)
+THUMB_VERSION = 1
+THUMB_FORMAT = "webp" if features.check("webp") else "jpeg"
+MIMETYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+def render_thumbnail(src_path, dst_path, width, fmt=THUMB_FORMAT, quality=THUMB_QUALITY):
+    """Write a preview of `src_path` at most `width` pixels wide (and as tall, keeping aspect ratio)."""
+    with Image.open(src_path) as im:
+        if im.format == "JPEG":
+            im.draft("RGB", (width, width))  # let libjpeg decode at 1/2, 1/4 or 1/8 scale
+        if im.mode.startswith("I"):  # 16-bit grayscale
+            im = im.convert("I").point(lambda v: v * (1 / 256)).convert("L")
+        if fmt == "jpeg" or im.mode not in ("RGB", "RGBA", "L"):
+            im = im.convert("RGB")
+        # reducing_gap: integer box reduction first, Lanczos for the last step
+        im.thumbnail((width, width * 4), Image.LANCZOS, reducing_gap=3.0)
+        if fmt == "webp":
+            im.save(dst_path, "WEBP", quality=quality, method=4)
+        else:
+            im.save(dst_path, "JPEG", quality=quality, optimize=True, progressive=True)
+
+
+class ThumbnailService:
+    """Renders and caches previews.
+
+    Args:
+        catalog (ImageCatalog): Remembers source digests (may be None).
+        workers (int): Previews rendered at the same time.
+        max_bytes (int): Cache budget.
+    """
+
+    def __init__(self, catalog=None, root=THUMB_DIR, workers=2, max_bytes=DEFAULT_MAX_MB * 1024 ** 2,
+                 fmt=THUMB_FORMAT, log=print):
+        self.catalog = catalog
+        self.fmt = fmt
+        self.ext = ".webp" if fmt == "webp" else ".jpg"
+        self.mimetype = MIMETYPES[fmt]
+        self.cache = ResultCache(root=root, max_bytes=max_bytes, log=log)
+        self.log = log
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        self._pending = {}  # key -> Future of a render in progress
+        self._lock = threading.Lock()
+
+    def source_digest(self, rel_id, path):
+        """sha256 of the source, from the catalog when it is still current."""
+        st = os.stat(path)
+        if self.catalog is not None:
+            digest = self.catalog.digest_for(rel_id, st.st_mtime, st.st_size)
+            if digest:
+                return digest
+        digest = file_digest(path)
+        if self.catalog is not None:
+            self.catalog.set_digest(rel_id, st.st_mtime, st.st_size, digest)
+        return digest
+
+    def key(self, rel_id, path, width):
+        return cache_key(self.source_digest(rel_id, path), thumb=width, format=self.fmt, version=THUMB_VERSION)
+
+    def get(self, key, path, width):
+        """Path of the cached preview for `key`, rendering it first on a miss."""
+        if self.cache.touch(key, self.ext):
+            return self.cache.path_for(key, self.ext)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pool.submit(self._render, key, path, width)
+                self._pending[key] = future
+        return future.result()
+
+    def _render(self, key, path, width):
+        tmp_path = os.path.join(self.cache.root, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            os.makedirs(self.cache.root, exist_ok=True)
+            render_thumbnail(path, tmp_path, width, self.fmt)
+            self.cache.store(key, tmp_path, self.ext)
+            entry = self.cache.path_for(key, self.ext)
+            if not os.path.exists(entry):
+                raise OSError(f"Could not cache the preview of {os.path.basename(path)}")
+            return entry
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
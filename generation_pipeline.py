@@ -21,13 +21,35 @@ import time
 import gc
 import math
 import torch
+import numpy as np
 from PIL import Image
 from realesrgan import RealESRGANer
 from models import RRDBNet
+from pipeline_stages import run_stages
+from tiled_inference import TiledUpscaler, TileCheckpoint, load_rrdbnet
+from tile_autotune import load_tuned_config
+from precision import PRECISION_MODES, resolve_precision, calibration_tiles
+from compiled_models import COMPILE_BACKENDS, load_compiled, is_compiled
+from upscale_planner import plan_upscale, describe as describe_plan
+from output_writer import (OutputWriter, OUTPUT_FORMATS, PNG_FILTERS, PNG_STRATEGIES, DEFAULT_PNG_LEVEL,
+                           DEFAULT_PNG_FILTER, DEFAULT_PNG_STRATEGY, DEFAULT_JPEG_QUALITY)
+from result_cache import ResultCache, file_digest, cache_key, DEFAULT_MAX_GB as CACHE_MAX_GB
+from pipeline_state import PipelineState, STATE_FILENAME
+from pipeline_metrics import PipelineMetrics, METRICS_FILENAME
 
 import datetime
 import traceback
 import shutil
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, namedtuple
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 GENERATIONS_ROOT = os.path.join(BASE_DIR, "generations")
@@ -35,21 +57,179 @@ WEIGHTS_DIR = os.path.join(BASE_DIR, "weights")
 LOG_DIR = os.path.join(BASE_DIR, "logs")
 LOG_FILE = os.path.join(LOG_DIR, "upscale.log")
 ERROR_LOG_FILE = os.path.join(LOG_DIR, "error.log")
+METRICS_FILE = os.path.join(LOG_DIR, METRICS_FILENAME)
 TARGET_ASPECT_RATIO = 16 / 9
 TARGET_MIN_MP = 4
+# Release hosting each model's weights (x2plus was published later)
+WEIGHTS_RELEASES = {"RealESRGAN_x4plus": "v0.1.0", "RealESRGAN_x2plus": "v0.2.1"}
 
 # === TILE SIZE CONFIGURATION ===
-# 512: 빠름, VRAM 많이 사용 (8GB+ 필요)
-# 384: 균형, VRAM 중간 (~6GB) - 권장
-# 256: 느림 (~50% 증가), VRAM 적게 사용 (~4GB)
-TILE_SIZE = 256
+# Fallback only: run `python tile_autotune.py` once per host to benchmark tile
+# sizes/thread counts under a memory budget. The winner is stored in
+# weights/tile_tuning.json and used automatically (--tile overrides both).
+DEFAULT_TILE_SIZE = 256
+
+# === TILE BATCH CONFIGURATION ===
+# Tiles pushed through RRDBNet per forward pass by the batched TiledUpscaler.
+# 0 falls back to the stock RealESRGANer (one tile per forward).
+TILE_BATCH = 4
+# --staged mode: max images whose tiles share batches in one inference step
+IMAGE_BATCH = 2
+# Opt-in: buffer-based dense blocks (models.FusedRRDB) in the batched engine.
+# Same weights and output and ~32% fewer bytes allocated, but FusedRRDBTrunk
+# runs batch samples one at a time, so whether it beats stock at TILE_BATCH > 1
+# depends on the tile size and host - check with benchmarks/bench_rdb.py
+# before enabling. int8 always uses the stock blocks.
+FUSED_RDB = False
+
+# === UPSAMPLER POOL CONFIGURATION ===
+# Loaded models stay resident between images; they are only evicted when the
+# host runs low on memory (or the pool exceeds UPSAMPLER_POOL_SIZE entries).
+# Two entries so runs that mix x2 and x4 plans don't reload on every switch.
+UPSAMPLER_POOL_SIZE = 2
+UPSAMPLER_MIN_FREE_MB = 2048
+
+# Model outputs of at least this many megapixels are stitched in a memory-mapped
+# scratch canvas (<run>/_scratch) with per-tile-row checkpoints, so RAM stays at
+# about one tile row and a crash resumes from the last finished row. These
+# canvases are resampled and PNG-encoded in row blocks (output_writer.py), so
+# the full-size output is never held in RAM either
+TILE_CHECKPOINT_MIN_MP = 8
+
+# Runs with fewer images than this don't pay back a model compile (~15s per
+# model on one CPU core): they run eager unless the graph is already cached
+COMPILE_MIN_IMAGES = 8
+
+# Calibration images taken from the run for int8 quantization
+INT8_CALIBRATION_IMAGES = 4
+
+UpsamplerKey = namedtuple("UpsamplerKey", ["model_name", "scale", "tile", "precision", "tile_batch", "backend"],
+                          defaults=[TILE_BATCH, "none"])
+
+
+def available_memory_mb(device=None):
+    """Return free memory (MB) on the device that holds the model, or None if unknown."""
+    if device is not None and device.type == 'cuda':
+        free, _ = torch.cuda.mem_get_info(device)
+        return free / (1024 * 1024)
+    if psutil is not None:
+        return psutil.virtual_memory().available / (1024 * 1024)
+    return None
+
+
+class UpsamplerPool:
+    """Long-lived cache of upsamplers keyed by (model_name, scale, tile, precision, tile_batch, backend).
+
+    Replaces the old "load model fresh for each image" strategy: weights are read
+    once per key, and memory safety comes from an explicit eviction policy instead:
+      - LRU eviction once more than `max_entries` configurations are cached
+      - `trim()` evicts least recently used entries while free memory on the
+        model device is below `min_free_mb`
+    """
+
+    def __init__(self, factory, max_entries=UPSAMPLER_POOL_SIZE, min_free_mb=UPSAMPLER_MIN_FREE_MB,
+                 device=None, log=print):
+        self.factory = factory
+        self.max_entries = max_entries
+        self.min_free_mb = min_free_mb
+        self.device = device
+        self.log = log
+        self._entries = OrderedDict()
+        self.loads = 0
+        self.hits = 0
+
+    def get(self, key):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+        # Make room before loading so two models never peak together
+        while len(self._entries) >= self.max_entries:
+            self._evict_oldest("pool full")
+        t0 = time.time()
+        upsampler = self.factory(key)
+        self.loads += 1
+        self._entries[key] = upsampler
+        self.log(f"Loaded upsampler {key.model_name} (scale={key.scale}, tile={key.tile}, "
+                 f"precision={key.precision}, tile_batch={key.tile_batch}, backend={key.backend}) "
+                 f"in {time.time() - t0:.2f}s")
+        return upsampler
+
+    def trim(self):
+        """Evict cached upsamplers while the device is under memory pressure."""
+        free_mb = available_memory_mb(self.device)
+        while self._entries and free_mb is not None and free_mb < self.min_free_mb:
+            self._evict_oldest(f"low memory: {free_mb:.0f}MB free < {self.min_free_mb}MB")
+            free_mb = available_memory_mb(self.device)
+
+    def clear(self):
+        while self._entries:
+            self._evict_oldest("pool closed")
+
+    def _evict_oldest(self, reason):
+        key, upsampler = self._entries.popitem(last=False)
+        del upsampler
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        self.log(f"Evicted upsampler {key.model_name} (tile={key.tile}) - {reason}")
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# === PROCESSED/ OUTPUT MODE ===
+# write: save the cropped PNG before upscaling (legacy behaviour)
+# async: hand the crop to the upsampler in memory, save the PNG on a background thread
+# skip:  never write processed/ (crop only lives in memory)
+PROCESSED_MODES = ("write", "async", "skip")
+
+
+def pil_to_cv2(img):
+    """Convert a PIL image to the array layout cv2.imread(IMREAD_UNCHANGED) returns (BGR/BGRA/gray).
+
+    RGB images come back as a reversed-channel view of the PIL buffer (no extra
+    copy); the upsampler converts to float32 as its first step anyway.
+    """
+    if img.mode not in ("RGB", "RGBA", "L", "I;16"):
+        has_alpha = "transparency" in img.info or img.mode in ("LA", "PA")
+        img = img.convert("RGBA" if has_alpha else "RGB")
+    arr = np.asarray(img)
+    if img.mode == "RGB":
+        return arr[:, :, ::-1]
+    if img.mode == "RGBA":
+        return cv2.cvtColor(arr, cv2.COLOR_RGBA2BGRA)
+    return arr
+
+
+def crop_box_16_9(width, height):
+    """Center 16:9 crop box (left, top, right, bottom) for a width x height image."""
+    if width / height > TARGET_ASPECT_RATIO:
+        new_width = int(height * TARGET_ASPECT_RATIO)
+        offset = (width - new_width) // 2
+        return offset, 0, offset + new_width, height
+    if width / height < TARGET_ASPECT_RATIO:
+        new_height = int(width / TARGET_ASPECT_RATIO)
+        offset = (height - new_height) // 2
+        return 0, offset, width, offset + new_height
+    return 0, 0, width, height
+
 
 class ImagePipeline:
-    def __init__(self, run_timestamp):
+    def __init__(self, run_timestamp, log_queue=None, processed_mode="async", tile_batch=None, tile_size=None,
+                 precision="auto", compile_backend="torchscript", result_cache=True, cache_max_gb=CACHE_MAX_GB,
+                 resume=False, output_options=None):
+        if processed_mode not in PROCESSED_MODES:
+            raise ValueError(f"processed_mode must be one of {PROCESSED_MODES}, got {processed_mode!r}")
         self.timestamp = run_timestamp
+        self.processed_mode = processed_mode
+        # Set in worker processes: log lines are forwarded to the parent instead of the log file
+        self.log_queue = log_queue
         self.run_dir = os.path.join(GENERATIONS_ROOT, self.timestamp)
         self.processed_dir = os.path.join(self.run_dir, "processed")
         self.upscaled_dir = os.path.join(self.run_dir, "upscaled")
+        self.scratch_dir = os.path.join(self.run_dir, "_scratch")
         
         os.makedirs(self.run_dir, exist_ok=True)
         os.makedirs(self.processed_dir, exist_ok=True)
@@ -63,12 +243,62 @@ class ImagePipeline:
 
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.log(f"Initialized Pipeline for {self.timestamp} on device: {self.device}")
-        self.log(f"Tile size: {TILE_SIZE} (lower = more stable, slower)")
+        self._resolve_tile_config(tile_size, tile_batch)
+        # Compiled graphs only apply to the batched engine
+        self.compile_backend = compile_backend if self.tile_batch > 0 else "none"
+        self.precision, note = resolve_precision(precision, self.device)
+        if self.tile_batch == 0 and self.precision in ("bf16", "int8"):
+            self.precision, note = "fp32", f"{self.precision} needs the batched engine (--tile-batch > 0)"
+        self.log(f"Precision: {self.precision}" + (f" (requested {precision}: {note})" if note else ""))
+
+        self.upsamplers = UpsamplerPool(self._load_upsampler, device=self.device, log=self.log)
+        self.cache_max_gb = cache_max_gb
+        self.cache = ResultCache(max_bytes=cache_max_gb * 1024 ** 3, log=self.log) if result_cache else None
+        # --resume: keep only outputs the run manifest verifies; workers report updates to the parent
+        self.resume = resume
+        self.state = PipelineState(self.run_dir, autosave=log_queue is None, log=self.log)
+        # Format/compression of upscaled/ outputs (see output_writer.py)
+        self.writer = OutputWriter(**(output_options or {}), log=self.log)
+        self.log(f"Output: {self.writer.describe()}")
+        # Per-image stage timings (JSON lines next to upscale.log); workers hand records to the parent
+        self.metrics = PipelineMetrics(self.timestamp, path=METRICS_FILE if log_queue is None else None,
+                                       log=self.log)
+        self._save_executor = None
+        self._pending_saves = []
         
+    def _resolve_tile_config(self, tile_size, tile_batch=None):
+        """Pick the tile size and batch: explicit argument > autotuned config for this host > default."""
+        tuned = load_tuned_config(self.device)
+        if tile_batch is not None:
+            self.tile_batch = tile_batch
+        elif tuned and tuned.get("tile_batch"):
+            self.tile_batch = tuned["tile_batch"]  # the tuned tile was timed at this batch
+        else:
+            self.tile_batch = TILE_BATCH
+        if tile_size:
+            self.tile_size = tile_size
+            source = "explicit"
+        elif tuned:
+            self.tile_size = tuned["tile"]
+            source = f"autotuned {tuned.get('tuned_at', '')}"
+            # Worker processes get their thread cap from the pool instead
+            if self.log_queue is None and tuned.get("threads"):
+                torch.set_num_threads(tuned["threads"])
+                source += f", {tuned['threads']} threads"
+        else:
+            self.tile_size = DEFAULT_TILE_SIZE
+            source = "default - run tile_autotune.py to tune this host"
+        self.log(f"Tile size: {self.tile_size} ({source}), tile batch: {self.tile_batch}")
+
     def log(self, message):
         """Write message to log file and stdout."""
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        formatted = f"[{timestamp}] {message}"
+        if self.log_queue is not None:
+            self.log_queue.put(f"[{timestamp}] [W{os.getpid()}] {message}")
+            return
+        self._write_log_line(f"[{timestamp}] {message}")
+
+    def _write_log_line(self, formatted):
         print(formatted, flush=True)
         try:
             with open(LOG_FILE, "a", encoding="utf-8") as f:
@@ -76,54 +306,271 @@ class ImagePipeline:
         except Exception as e:
             print(f"Error writing to log: {e}", flush=True)
         
-    def get_upsampler(self):
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-        model_path = os.path.join(WEIGHTS_DIR, "RealESRGAN_x4plus.pth")
-        
+    def get_upsampler(self, model_name="RealESRGAN_x4plus", scale=4, tile=None, precision=None, tile_batch=None):
+        """Return a cached upsampler for these settings, loading the weights on first use."""
+        if tile is None:
+            tile = self.tile_size
+        if precision is None:
+            precision = self.precision
+        if tile_batch is None:
+            tile_batch = self.tile_batch
+        return self.upsamplers.get(UpsamplerKey(model_name, scale, tile, precision, tile_batch, self.compile_backend))
+
+    def ensure_weights(self, model_name="RealESRGAN_x4plus"):
+        """Return the local weights path, downloading the model on first use."""
+        model_path = os.path.join(WEIGHTS_DIR, f"{model_name}.pth")
         if not os.path.exists(model_path):
             os.makedirs(WEIGHTS_DIR, exist_ok=True)
-            self.log("Downloading Real-ESRGAN model...")
+            self.log(f"Downloading Real-ESRGAN model {model_name}...")
             import urllib.request
-            url = "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth"
+            release = WEIGHTS_RELEASES.get(model_name, "v0.1.0")
+            url = f"https://github.com/xinntao/Real-ESRGAN/releases/download/{release}/{model_name}.pth"
             urllib.request.urlretrieve(url, model_path)
-        
+        return model_path
+
+    def _load_upsampler(self, key):
+        model_path = self.ensure_weights(key.model_name)
+        if key.tile_batch > 0:
+            tile_pad = 10
+            # FX quantization can't trace the in-place buffer writes
+            fused = FUSED_RDB and key.precision != "int8"
+            model, plan = load_compiled(
+                key.model_name, model_path, key.scale, key.precision,
+                device=self.device,
+                backend=key.backend,
+                fused=fused,
+                load_model=lambda: load_rrdbnet(model_path, scale=key.scale, fused=fused),
+                calibration=self._calibration_tiles() if key.precision == "int8" else None,
+                log=self.log,
+            )
+            return TiledUpscaler(
+                model,
+                scale=key.scale,
+                tile=key.tile,
+                tile_pad=tile_pad,
+                batch_size=key.tile_batch,
+                precision=key.precision,
+                device=self.device,
+                plan=plan,
+                log=self.log,
+            )
+
+        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=key.scale)
         upsampler = RealESRGANer(
-            scale=4,
+            scale=key.scale,
             model_path=model_path,
             model=model,
-            tile=TILE_SIZE,  # Configurable tile size for VRAM management
+            tile=key.tile,  # Configurable tile size for VRAM management
             tile_pad=10,
             pre_pad=0,
-            half=True,    # FP16 enabled for memory cleanup
+            half=key.precision == "fp16",    # FP16 only where supported (CUDA)
             gpu_id=0 if torch.cuda.is_available() else None
         )
         return upsampler
 
-    def crop_to_16_9(self, img_path, out_path):
-        with Image.open(img_path) as img:
-            width, height = img.size
-            if width / height != TARGET_ASPECT_RATIO:
-                # Simple center crop logic if needed, but assuming mostly square to landscape
-                # For this task, we assume we just need to ensure aspect ratio
-                current_ratio = width / height
-                if current_ratio > TARGET_ASPECT_RATIO:
-                    new_width = int(height * TARGET_ASPECT_RATIO)
-                    offset = (width - new_width) // 2
-                    crop_box = (offset, 0, offset + new_width, height)
-                else:
-                    new_height = int(width / TARGET_ASPECT_RATIO)
-                    offset = (height - new_height) // 2
-                    crop_box = (0, offset, width, offset + new_height)
-                img = img.crop(crop_box)
+    def _calibration_tiles(self):
+        """int8 calibration crops from this run's raw images (synthetic fallback if none)."""
+        images = []
+        for fname in self.list_raw_files()[:INT8_CALIBRATION_IMAGES]:
+            img = cv2.imread(os.path.join(self.run_dir, fname), cv2.IMREAD_COLOR)
+            if img is not None:
+                images.append(img)
+        if not images:
+            self.log("WARNING: no images for int8 calibration - using a synthetic pattern")
+        return calibration_tiles(images)
+
+    @staticmethod
+    def decode_raw(img_path):
+        """Open and fully decode a raw image (PIL)."""
+        img = Image.open(img_path)
+        img.load()
+        return img
+
+    def crop_to_16_9(self, img_path, out_path=None):
+        """Crop `img_path` to 16:9 and return the cropped PIL image.
+
+        If `out_path` is given the crop is also written there synchronously.
+        """
+        img = self.center_crop_16_9(self.decode_raw(img_path))
+        if out_path:
             # PNG for lossless quality (no JPEG compression artifacts)
             img.save(out_path, format='PNG')
+        return img
+
+    def save_processed(self, img, out_path, cache_key=None, fname=None):
+        """Persist a cropped image to processed/ according to `processed_mode`.
+
+        Once written it is cached under `cache_key` and recorded in the run
+        manifest for raw file `fname`.
+        """
+        if self.processed_mode == "skip":
+            return
+        if self.processed_mode == "write":
+            self._save_and_record(img, out_path, cache_key, fname)
+            return
+        if self._save_executor is None:
+            self._save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="processed-writer")
+        self._pending_saves.append(
+            (out_path, self._save_executor.submit(self._save_and_record, img, out_path, cache_key, fname)))
+
+    def _save_and_record(self, img, out_path, cache_key, fname):
+        t0 = time.time()
+        self._save_png_atomic(img, out_path)
+        self.store_cached(cache_key, out_path)
+        if fname is not None:
+            self.state.record_output(fname, "processed", out_path, seconds=time.time() - t0)
+
+    @staticmethod
+    def _save_png_atomic(img, out_path):
+        # Write under a temp name so a crash never leaves a truncated PNG that looks finished
+        tmp_path = out_path + ".tmp"
+        img.save(tmp_path, format='PNG')
+        os.replace(tmp_path, out_path)
+
+    def remove_stale_temp_files(self):
+        """Delete *.tmp leftovers of writes interrupted by a crash."""
+        removed = 0
+        for folder in (self.processed_dir, self.upscaled_dir):
+            for fname in os.listdir(folder):
+                if fname.endswith(".tmp"):
+                    try:
+                        os.remove(os.path.join(folder, fname))
+                        removed += 1
+                    except OSError:
+                        pass
+        if removed:
+            self.log(f"Removed {removed} temp file(s) left by an interrupted run")
+
+    def wait_for_saves(self):
+        """Block until background processed/ writes finish; log any that failed."""
+        pending, self._pending_saves = self._pending_saves, []
+        for out_path, future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                self.log_error(f"Failed to save {out_path}", e)
+
+    def center_crop_16_9(self, img):
+        """Return `img` center-cropped to 16:9 (unchanged if it already is)."""
+        crop_box = crop_box_16_9(*img.size)
+        if crop_box != (0, 0) + img.size:
+            img = img.crop(crop_box)
+        return img
+
+    def plan_for(self, img):
+        """Cheapest model pass + Lanczos resample that brings `img` (cv2 array) to TARGET_MIN_MP."""
+        return plan_upscale(img.shape[1], img.shape[0], TARGET_MIN_MP)
+
+    def plan_for_raw(self, raw_path):
+        """(crop_box, plan) for a raw file, from its header only (no decode)."""
+        with Image.open(raw_path) as img:
+            crop_box = crop_box_16_9(*img.size)
+        left, top, right, bottom = crop_box
+        return crop_box, plan_upscale(right - left, bottom - top, TARGET_MIN_MP)
+
+    def planned_models(self, raw_files):
+        """(model_name, scale) pairs the run will need."""
+        models = set()
+        for fname in raw_files:
+            try:
+                _, plan = self.plan_for_raw(os.path.join(self.run_dir, fname))
+            except OSError:
+                continue
+            models.add((plan.model_name, plan.model_scale))
+        return sorted(models)
+
+    def _skip_compile_for_small_run(self, raw_files):
+        """Run eager when compiling the models this run needs would cost more than it saves."""
+        if self.compile_backend == "none" or len(raw_files) >= COMPILE_MIN_IMAGES:
+            return
+        if self.compile_backend == "torchscript" and self.precision != "bf16":
+            fused = FUSED_RDB and self.precision != "int8"
+            missing = [name for name, scale in self.planned_models(raw_files)
+                       if not is_compiled(name, self.ensure_weights(name), scale, self.precision, fused=fused)]
+            if not missing:
+                return
+        self.log(f"Compile skipped ({self.compile_backend}): {len(raw_files)} image(s) < {COMPILE_MIN_IMAGES}, "
+                 f"running eager")
+        self.compile_backend = "none"
+
+    def cache_keys(self, raw_path, digest):
+        """Result-cache keys (crop, upscale) for a raw file with sha256 `digest`; None where caching doesn't apply."""
+        if self.cache is None:
+            return None, None
+        crop_box, plan = self.plan_for_raw(raw_path)
+        crop = cache_key(digest, op="crop_16_9", box=crop_box)
+        upscale = cache_key(digest, op="upscale", box=crop_box, model=plan.model_name, scale=plan.model_scale,
+                            out_size=plan.out_size, tile=self.tile_size, precision=self.precision,
+                            **self.writer.cache_params())
+        return (None if self.processed_mode == "skip" else crop), upscale
+
+    def fetch_cached(self, key, dest_path):
+        return key is not None and self.cache.fetch(key, dest_path, ext=os.path.splitext(dest_path)[1])
+
+    def store_cached(self, key, path):
+        if key is not None:
+            self.cache.store(key, path, ext=os.path.splitext(path)[1])
+
+    def output_done(self, fname, stage, path, digest):
+        """Whether an existing `stage` output at `path` can be kept.
+
+        Normally any existing file counts; with --resume it must also match the
+        run manifest (size + sha256, same source digest).
+        """
+        if not os.path.exists(path):
+            return False
+        if not self.resume or self.state.verified(fname, stage, path, digest):
+            return True
+        self.log(f"  Redoing {stage}/{os.path.basename(path)} - not verified by {STATE_FILENAME}")
+        self.state.invalidate(fname, stage)
+        return False
+
+    def checkpoint_for(self, fname, plan, upsampler):
+        """Scratch path prefix for tile-row checkpoints, or None if the output is small enough for RAM."""
+        model_w, model_h = plan.model_size
+        if not isinstance(upsampler, TiledUpscaler) or model_w * model_h < TILE_CHECKPOINT_MIN_MP * 1000000:
+            return None
+        return os.path.join(self.scratch_dir, fname.rsplit('.', 1)[0])
+
+    def upscale(self, upsampler, img, plan, checkpoint=None):
+        """Run the plan's model pass; the resample happens in write_upscaled()."""
+        if checkpoint is not None:
+            output, _ = upsampler.enhance(img, checkpoint=checkpoint)
+        else:
+            output, _ = upsampler.enhance(img)
+        return output
+
+    def write_upscaled(self, out_path, output, plan, label="", metrics=None):
+        """Resample a model output to the plan's size and write it atomically (see OutputWriter).
+
+        A memory-mapped canvas (tile checkpoint) is resampled and PNG-encoded
+        in row blocks instead of being loaded into RAM.
+        """
+        result = self.writer.write(out_path, output, plan)
+        if metrics is not None:
+            metrics.add("resize", result.resize_seconds)
+            metrics.add("encode", result.encode_seconds)
+            metrics.set(bytes=result.bytes)
+        self.log(f"  {label}Encoded {os.path.basename(out_path)}: {result.bytes / 1024 ** 2:.1f}MB in "
+                 f"{result.encode_seconds:.2f}s (resize {result.resize_seconds:.2f}s)")
+        return result
+
+    def copy_json_metadata(self, idx, total, fname):
+        """Copy JSON metadata file to upscaled folder if exists."""
+        json_fname = fname.rsplit('.', 1)[0] + '.json'
+        json_src = os.path.join(self.run_dir, json_fname)
+        json_dst = os.path.join(self.upscaled_dir, json_fname)
+        if os.path.exists(json_src) and not os.path.exists(json_dst):
+            shutil.copy2(json_src, json_dst)
+            self.log(f"  [{idx}/{total}] Copied JSON metadata: {json_fname}")
 
     def log_error(self, message, exception=None):
         """Write error to error log file."""
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         formatted = f"[{timestamp}] ERROR: {message}"
         if exception:
-            formatted += f"\n{traceback.format_exc()}"
+            tb = traceback.format_exception(type(exception), exception, exception.__traceback__)
+            formatted += f"\n{''.join(tb)}"
         print(formatted)
         try:
             with open(ERROR_LOG_FILE, "a", encoding="utf-8") as f:
@@ -131,81 +578,157 @@ class ImagePipeline:
         except Exception as e:
             print(f"Error writing to error log: {e}")
 
-    def process_all(self):
+    def list_raw_files(self):
+        return [f for f in os.listdir(self.run_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+
+    def tile_count(self, img):
+        """Model tiles for a cv2 image at the current tile size (alpha is a second plane)."""
+        tile = self.tile_size or max(img.shape[:2])
+        planes = 2 if img.ndim == 3 and img.shape[2] == 4 else 1
+        return math.ceil(img.shape[0] / tile) * math.ceil(img.shape[1] / tile) * planes
+
+    def process_one(self, idx, total, fname):
+        """Crop + upscale a single raw file. Returns "done", "skipped" or "failed"."""
+        metrics = self.metrics.image(fname)
+        status = self._process_one(idx, total, fname, metrics)
+        self.metrics.finish(metrics, status)
+        return status
+
+    def _process_one(self, idx, total, fname, metrics):
+        raw_path = os.path.join(self.run_dir, fname)
+        # Processed files are now PNG
+        processed_fname = fname.rsplit('.', 1)[0] + '.png'
+        processed_path = os.path.join(self.processed_dir, processed_fname)
+        upscaled_path = os.path.join(self.upscaled_dir, fname.rsplit('.', 1)[0] + self.writer.ext)
+        
+        try:
+            with metrics.stage("hash"):
+                digest = file_digest(raw_path)
+            self.state.set_source(fname, digest)
+            crop_key, upscale_key = self.cache_keys(raw_path, digest)
+
+            # 1. Crop - kept in memory; processed/ PNG is written per processed_mode
+            cropped = None
+            if not self.output_done(fname, "processed", processed_path, digest):
+                if self.fetch_cached(crop_key, processed_path):
+                    self.state.record_output(fname, "processed", processed_path, cached=True)
+                else:
+                    with metrics.stage("decode"):
+                        raw = self.decode_raw(raw_path)
+                    with metrics.stage("crop"):
+                        cropped = self.center_crop_16_9(raw)
+                        del raw
+                        self.save_processed(cropped, processed_path, cache_key=crop_key, fname=fname)
+            
+            # 2. Upscale - Model comes from the pool (loaded once per batch)
+            if self.output_done(fname, "upscaled", upscaled_path, digest):
+                self.log(f"  [{idx}/{total}] Skipped (already exists): {fname}")
+                return "skipped"
+            if self.fetch_cached(upscale_key, upscaled_path):
+                self.state.record_output(fname, "upscaled", upscaled_path, cached=True)
+                self.state.update(fname, status="done")
+                self.log(f"  [{idx}/{total}] Done: {fname} (result cache)")
+                with metrics.stage("json_copy"):
+                    self.copy_json_metadata(idx, total, fname)
+                metrics.set(cached=True)
+                return "done"
+            self.state.update(fname, status="upscaling")
+
+            self.log(f"  [{idx}/{total}] Upscaling {fname}...")
+            t0 = time.time()
+            
+            if cropped is not None:
+                with metrics.stage("crop"):
+                    img = pil_to_cv2(cropped)
+                    del cropped
+            else:
+                with metrics.stage("decode"):
+                    img = cv2.imread(processed_path, cv2.IMREAD_UNCHANGED)
+                if img is None:
+                    raise ValueError(f"Failed to read image: {processed_path}")
+            
+            plan = self.plan_for(img)
+            self.log(f"  [{idx}/{total}] Plan: {describe_plan(plan)}")
+            metrics.set(plan=describe_plan(plan), tiles=self.tile_count(img))
+            with metrics.stage("model_load"):
+                upsampler = self.get_upsampler(plan.model_name, plan.model_scale)
+            checkpoint = self.checkpoint_for(fname, plan, upsampler)
+            with metrics.stage("inference"):
+                output = self.upscale(upsampler, img, plan, checkpoint)
+            self.write_upscaled(upscaled_path, output, plan, label=f"[{idx}/{total}] ", metrics=metrics)
+            self.store_cached(upscale_key, upscaled_path)
+            self.state.record_output(fname, "upscaled", upscaled_path, seconds=time.time() - t0,
+                                     plan=describe_plan(plan))
+            self.state.update(fname, status="done")
+            
+            # === MEMORY CLEANUP ===
+            # Free per-image buffers; the model itself is only
+            # unloaded by the pool when memory runs low.
+            del img, output, upsampler
+            gc.collect()
+            if checkpoint is not None:
+                TileCheckpoint.discard(checkpoint)
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            self.upsamplers.trim()
+            # ======================
+            
+            dt = time.time() - t0
+            self.log(f"  [{idx}/{total}] Done: {fname} ({dt:.2f}s)")
+            
+            with metrics.stage("json_copy"):
+                self.copy_json_metadata(idx, total, fname)
+            return "done"
+                
+        except Exception as e:
+            self.log_error(f"Failed to process {fname}", e)
+            self.log(f"  [{idx}/{total}] FAILED: {fname} - {str(e)}")
+            self.state.update(fname, status="failed", error=str(e))
+            # Continue with next image
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            gc.collect()
+            self.upsamplers.trim()
+            return "failed"
+
+    def process_all(self, workers=1, threads_per_worker=None, staged=False, queue_size=2):
         self.log(f"Starting batch processing: {self.timestamp}")
-        self.log(f"=== Memory Optimized Mode: 1 image at a time ===")
         start_total = time.time()
         
-        raw_files = [f for f in os.listdir(self.run_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        raw_files = self.list_raw_files()
         total = len(raw_files)
         
         if total == 0:
             self.log("No images to process")
             return
+        self.remove_stale_temp_files()
+        if self.resume:
+            self.log(f"Resume mode: outputs are verified against {STATE_FILENAME}")
         
-        count = 0
-        failed = 0
-        
-        for idx, fname in enumerate(raw_files, 1):
-            raw_path = os.path.join(self.run_dir, fname)
-            # Processed files are now PNG
-            processed_fname = fname.rsplit('.', 1)[0] + '.png'
-            processed_path = os.path.join(self.processed_dir, processed_fname)
-            upscaled_path = os.path.join(self.upscaled_dir, processed_fname)
-            
-            try:
-                # 1. Crop (saves as PNG now)
-                if not os.path.exists(processed_path):
-                    self.crop_to_16_9(raw_path, processed_path)
-                
-                # 2. Upscale - Load model fresh for each image to prevent memory accumulation
-                if not os.path.exists(upscaled_path):
-                    self.log(f"  [{idx}/{total}] Upscaling {fname}...")
-                    t0 = time.time()
-                    
-                    # Create upsampler for this image only
-                    upsampler = self.get_upsampler()
-                    
-                    img = cv2.imread(processed_path, cv2.IMREAD_UNCHANGED)
-                    if img is None:
-                        raise ValueError(f"Failed to read image: {processed_path}")
-                    
-                    # Calculate required scale to hit TARGET_MIN_MP
-                    current_pixels = img.shape[0] * img.shape[1]
-                    required_scale = math.ceil((TARGET_MIN_MP * 1000000 / current_pixels) ** 0.5)
-                    final_outscale = max(4, required_scale)
-                    
-                    output, _ = upsampler.enhance(img, outscale=final_outscale)
-                    cv2.imwrite(upscaled_path, output)
-                    
-                    # === AGGRESSIVE MEMORY CLEANUP ===
-                    del img, output, upsampler
-                    torch.cuda.empty_cache()
-                    gc.collect()
-                    # =================================
-                    
-                    dt = time.time() - t0
-                    self.log(f"  [{idx}/{total}] Done: {fname} ({dt:.2f}s)")
-                    count += 1
-                    
-                    # Copy JSON metadata file to upscaled folder if exists
-                    json_fname = fname.rsplit('.', 1)[0] + '.json'
-                    json_src = os.path.join(self.run_dir, json_fname)
-                    json_dst = os.path.join(self.upscaled_dir, json_fname)
-                    if os.path.exists(json_src) and not os.path.exists(json_dst):
-                        shutil.copy2(json_src, json_dst)
-                        self.log(f"  [{idx}/{total}] Copied JSON metadata: {json_fname}")
-                else:
-                    self.log(f"  [{idx}/{total}] Skipped (already exists): {fname}")
-                    
-            except Exception as e:
-                failed += 1
-                self.log_error(f"Failed to process {fname}", e)
-                self.log(f"  [{idx}/{total}] FAILED: {fname} - {str(e)}")
-                # Continue with next image
-                torch.cuda.empty_cache()
-                gc.collect()
+        self._skip_compile_for_small_run(raw_files)
+        workers = max(1, min(workers, total))
+        if workers > 1:
+            if staged:
+                self.log("WARNING: --staged is ignored with --workers > 1")
+            results = self._process_parallel(raw_files, workers, threads_per_worker)
+        elif staged:
+            results = self._process_staged(raw_files, queue_size)
+        else:
+            self.log(f"=== Memory Optimized Mode: 1 image at a time (model kept resident) ===")
+            results = [self.process_one(idx, total, fname) for idx, fname in enumerate(raw_files, 1)]
+            self.wait_for_saves()
+            self.log_reuse_stats()
+            self.upsamplers.clear()
         
+        for line in self.metrics.summary_lines():
+            self.log(line)
+        self.metrics.sampler.stop()
+        count = results.count("done")
+        failed = results.count("failed")
+        if failed:
+            self.log(f"Tile checkpoints of failed images are kept in {self.scratch_dir}")
+        else:
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
         total_time = time.time() - start_total
         self.log(f"===== 완료! 성공: {count}/{total}, 실패: {failed} =====")
         self.log(f"Total time: {total_time:.2f}s. Avg: {total_time/max(1, count):.2f}s/img")
@@ -216,8 +739,281 @@ class ImagePipeline:
         except:
             pass
 
+    def _process_staged(self, raw_files, queue_size=2, encode_workers=2, image_batch=IMAGE_BATCH):
+        """Stream images through decode -> crop -> inference -> encode stages.
+
+        Stages run on separate threads joined by bounded queues, so inference
+        keeps the model busy while the previous image is PNG-encoded and the
+        next one is decoded/cropped. Two encoder threads keep compression from
+        backing up into inference. Images already waiting for inference (up to
+        `image_batch`) are upscaled together so their tiles share batches.
+        """
+        self.log(f"=== Staged Mode: decode -> crop -> inference -> encode (queue={queue_size}) ===")
+        total = len(raw_files)
+        items = ({"idx": idx, "total": total, "fname": fname} for idx, fname in enumerate(raw_files, 1))
+        stages = [
+            ("decode", self._stage_decode, 1),
+            ("crop", self._stage_crop, 1),
+            ("inference", self._stage_inference, 1, image_batch),  # upsamplers are not thread-safe
+            ("encode", self._stage_encode, encode_workers),
+        ]
+        finished, _ = run_stages(items, stages, queue_size=queue_size, log=self.log)
+        self.wait_for_saves()
+
+        results = []
+        for item in finished:
+            if item.get("error") is not None:
+                self.log_error(f"Failed to process {item['fname']}", item["error"])
+                self.log(f"  [{item['idx']}/{total}] FAILED: {item['fname']} - {item['error']}")
+                self.state.update(item["fname"], status="failed", error=str(item["error"]))
+                if "metrics" in item:
+                    self.metrics.finish(item["metrics"], "failed")
+                results.append("failed")
+            else:
+                results.append(item["status"])
+        self.log_reuse_stats()
+        self.upsamplers.clear()
+        return results
+
+    def log_reuse_stats(self):
+        self.log(f"Model loads: {self.upsamplers.loads}, reuses: {self.upsamplers.hits}")
+        if self.cache is not None:
+            self.log(f"Result cache: {self.cache.hits} hits, {self.cache.misses} misses")
+
+    # Stages set item["status"] once an image is finished; later stages pass it through.
+    def _stage_decode(self, item):
+        base = item["fname"].rsplit('.', 1)[0]
+        raw_path = os.path.join(self.run_dir, item["fname"])
+        fname = item["fname"]
+        item["processed_path"] = os.path.join(self.processed_dir, base + '.png')
+        item["upscaled_path"] = os.path.join(self.upscaled_dir, base + self.writer.ext)
+        metrics = item["metrics"] = self.metrics.image(fname)
+        with metrics.stage("hash"):
+            digest = file_digest(raw_path)
+        self.state.set_source(fname, digest)
+        item["crop_key"], item["upscale_key"] = self.cache_keys(raw_path, digest)
+        if self.output_done(fname, "upscaled", item["upscaled_path"], digest):
+            self.log(f"  [{item['idx']}/{item['total']}] Skipped (already exists): {fname}")
+            item["status"] = "skipped"
+            self.metrics.finish(metrics, "skipped")
+        elif self.fetch_cached(item["upscale_key"], item["upscaled_path"]):
+            self.state.record_output(fname, "upscaled", item["upscaled_path"], cached=True)
+            self.state.update(fname, status="done")
+            self.log(f"  [{item['idx']}/{item['total']}] Done: {fname} (result cache)")
+            with metrics.stage("json_copy"):
+                self.copy_json_metadata(item["idx"], item["total"], fname)
+            item["status"] = "done"
+            metrics.set(cached=True)
+            self.metrics.finish(metrics, "done")
+        elif self.output_done(fname, "processed", item["processed_path"], digest) or \
+                self.fetch_cached(item["crop_key"], item["processed_path"]):
+            with metrics.stage("decode"):
+                item["array"] = cv2.imread(item["processed_path"], cv2.IMREAD_UNCHANGED)
+            if item["array"] is None:
+                raise ValueError(f"Failed to read image: {item['processed_path']}")
+        else:
+            with metrics.stage("decode"):
+                item["image"] = self.decode_raw(raw_path)
+        return item
+
+    def _stage_crop(self, item):
+        if "image" in item:
+            with item["metrics"].stage("crop"):
+                img = self.center_crop_16_9(item.pop("image"))
+                self.save_processed(img, item["processed_path"], cache_key=item["crop_key"],
+                                    fname=item["fname"])
+                item["array"] = pil_to_cv2(img)
+        return item
+
+    def _stage_inference(self, items):
+        todo = [item for item in items if "status" not in item]
+        if not todo:
+            return items
+        t0 = time.time()
+        for item in todo:
+            self.log(f"  [{item['idx']}/{item['total']}] Upscaling {item['fname']}...")
+            self.state.update(item["fname"], status="upscaling")
+            item["t0"] = t0
+        # Images sharing a model are upscaled together so their tiles share batches
+        by_model = OrderedDict()
+        for item in todo:
+            plan = self.plan_for(item["array"])
+            self.log(f"  [{item['idx']}/{item['total']}] Plan: {describe_plan(plan)}")
+            item["metrics"].set(plan=describe_plan(plan), tiles=self.tile_count(item["array"]))
+            by_model.setdefault((plan.model_name, plan.model_scale), []).append((item, plan))
+        for (model_name, scale), group in by_model.items():
+            t_load = time.perf_counter()
+            upsampler = self.get_upsampler(model_name, scale)
+            t_infer = time.perf_counter()
+            imgs = [item.pop("array") for item, _ in group]
+            if isinstance(upsampler, TiledUpscaler):
+                for item, plan in group:
+                    item["checkpoint"] = self.checkpoint_for(item["fname"], plan, upsampler)
+                outputs = upsampler.enhance_many(imgs, checkpoints=[item["checkpoint"] for item, _ in group])
+            else:
+                outputs = [upsampler.enhance(img) for img in imgs]
+            # Shared batches: split the group's time by each image's share of the tiles
+            infer_seconds = time.perf_counter() - t_infer
+            group_tiles = sum(item["metrics"].extra["tiles"] for item, _ in group)
+            for (item, plan), (output, _) in zip(group, outputs):
+                item["output"] = output
+                item["plan"] = plan
+                item["metrics"].add("model_load", (t_infer - t_load) / len(group))
+                item["metrics"].add("inference", infer_seconds * item["metrics"].extra["tiles"] / group_tiles)
+            del imgs, outputs, upsampler
+        self.upsamplers.trim()
+        return items
+
+    def _stage_encode(self, item):
+        if "status" in item:
+            return item
+        self.write_upscaled(item["upscaled_path"], item.pop("output"), item["plan"],
+                            label=f"[{item['idx']}/{item['total']}] ", metrics=item["metrics"])
+        if item.get("checkpoint") is not None:
+            gc.collect()  # release the memory map before deleting it (Windows)
+            TileCheckpoint.discard(item["checkpoint"])
+        self.store_cached(item["upscale_key"], item["upscaled_path"])
+        dt = time.time() - item["t0"]
+        self.state.record_output(item["fname"], "upscaled", item["upscaled_path"], seconds=dt,
+                                 plan=describe_plan(item["plan"]))
+        self.state.update(item["fname"], status="done")
+        self.log(f"  [{item['idx']}/{item['total']}] Done: {item['fname']} ({dt:.2f}s)")
+        with item["metrics"].stage("json_copy"):
+            self.copy_json_metadata(item["idx"], item["total"], item["fname"])
+        item["status"] = "done"
+        self.metrics.finish(item["metrics"], "done")
+        return item
+
+    def _process_parallel(self, raw_files, workers, threads_per_worker=None):
+        """Shard raw files across a process pool; each worker loads the model once.
+
+        Workers don't touch upscale.log themselves - their log lines are sent back
+        over a queue and written here, so the log stays one ordered stream.
+        """
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+        self.log(f"=== Parallel Mode: {workers} workers x {threads_per_worker} torch threads ===")
+        if self.device.type == 'cuda':
+            self.log("WARNING: every worker loads its own model copy onto the GPU")
+
+        # Download (and compile) once up front instead of racing N workers on the same files
+        for model_name, scale in self.planned_models(raw_files):
+            self.ensure_weights(model_name)
+            if self.compile_backend == "torchscript":
+                self.get_upsampler(model_name, scale)
+                self.upsamplers.clear()
+
+        ctx = multiprocessing.get_context("spawn")
+        log_queue = ctx.Queue()
+        drain = threading.Thread(target=self._drain_log_queue, args=(log_queue,), daemon=True)
+        drain.start()
+
+        total = len(raw_files)
+        jobs = [(idx, total, fname) for idx, fname in enumerate(raw_files, 1)]
+        results = []
+        try:
+            with ctx.Pool(workers, initializer=_init_worker,
+                          initargs=(self.timestamp, log_queue, threads_per_worker, self.worker_options())) as pool:
+                for fname, status, updates, record in pool.imap_unordered(_process_in_worker, jobs):
+                    self.state.merge(fname, updates)
+                    self.metrics.emit(record)
+                    results.append(status)
+                    self.log(f"Progress: {len(results)}/{total} ({fname}: {status})")
+        finally:
+            log_queue.put(None)
+            drain.join()
+        return results
+
+    def worker_options(self):
+        """ImagePipeline keyword arguments that worker processes must share with this pipeline."""
+        return {"processed_mode": self.processed_mode, "tile_batch": self.tile_batch, "tile_size": self.tile_size,
+                "precision": self.precision, "compile_backend": self.compile_backend,
+                "result_cache": self.cache is not None, "cache_max_gb": self.cache_max_gb, "resume": self.resume,
+                "output_options": self.writer.options()}
+
+    def _drain_log_queue(self, log_queue):
+        while True:
+            line = log_queue.get()
+            if line is None:
+                break
+            self._write_log_line(line)
+
+
+# === WORKER PROCESS ENTRY POINTS (--workers N) ===
+_worker_pipeline = None
+
+def _init_worker(timestamp, log_queue, threads, options):
+    global _worker_pipeline
+    # Cap intra-op threads so N workers don't oversubscribe the cores
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    cv2.setNumThreads(1)
+    _worker_pipeline = ImagePipeline(timestamp, log_queue=log_queue, **options)
+
+def _process_in_worker(job):
+    idx, total, fname = job
+    status = _worker_pipeline.process_one(idx, total, fname)
+    # The pool is terminated on exit, so don't leave processed/ writes in flight
+    _worker_pipeline.wait_for_saves()
+    return fname, status, _worker_pipeline.state.pop_updates(fname), _worker_pipeline.metrics.pop(fname)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        ImagePipeline(sys.argv[1]).process_all()
-    else:
-        print("Usage: python generation_pipeline.py <TIMESTAMP>")
+    parser = argparse.ArgumentParser(description="Crop (16:9) and upscale a generation run.",
+                                     usage="python generation_pipeline.py <TIMESTAMP> [options]")
+    parser.add_argument("timestamp", help="Folder name under generations/")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Upscale worker processes (default: 1 = sequential)")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="torch intra-op threads per worker (default: cpu_count // workers)")
+    parser.add_argument("--processed", choices=PROCESSED_MODES, default="async",
+                        help="How the cropped PNG in processed/ is written: before upscaling (write), "
+                             "in the background (async, default) or not at all (skip)")
+    parser.add_argument("--tile", type=int, default=None,
+                        help="Tile size override (default: autotuned value, else %d)" % DEFAULT_TILE_SIZE)
+    parser.add_argument("--tile-batch", type=int, default=None,
+                        help=f"Tiles per RRDBNet forward pass (default: autotuned value, else {TILE_BATCH}; "
+                             "0 = stock RealESRGANer)")
+    parser.add_argument("--precision", choices=PRECISION_MODES, default="auto",
+                        help="Inference precision (default: auto = fp16 on CUDA, fp32 on CPU). "
+                             "Check quality first with: python precision.py --reference generations/<TS>")
+    parser.add_argument("--compile", choices=COMPILE_BACKENDS, default="torchscript",
+                        help="Compiled-model cache under weights/compiled (default: torchscript)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Disable the content-addressed result cache (cache/results)")
+    parser.add_argument("--cache-gb", type=float, default=CACHE_MAX_GB,
+                        help=f"Result cache size budget, LRU-evicted (default: {CACHE_MAX_GB})")
+    parser.add_argument("--resume", action="store_true",
+                        help=f"Redo any output not verified by generations/<TS>/{STATE_FILENAME} "
+                             "(default: existing files are trusted)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="png",
+                        help="upscaled/ output format (default: png; jpeg = 8-bit 4:4:4 for Adobe Stock)")
+    parser.add_argument("--png-level", type=int, default=DEFAULT_PNG_LEVEL, choices=range(10), metavar="0-9",
+                        help=f"PNG zlib compression level (default: {DEFAULT_PNG_LEVEL})")
+    parser.add_argument("--png-filter", choices=PNG_FILTERS, default=DEFAULT_PNG_FILTER,
+                        help=f"PNG row filter (default: {DEFAULT_PNG_FILTER})")
+    parser.add_argument("--png-strategy", choices=PNG_STRATEGIES, default=DEFAULT_PNG_STRATEGY,
+                        help=f"PNG zlib strategy (default: {DEFAULT_PNG_STRATEGY})")
+    parser.add_argument("--encode-threads", type=int, default=1,
+                        help="Threads deflating each PNG in parallel chunks (default: 1)")
+    parser.add_argument("--jpeg-quality", type=int, default=DEFAULT_JPEG_QUALITY,
+                        help=f"JPEG quality for --format jpeg (default: {DEFAULT_JPEG_QUALITY})")
+    parser.add_argument("--staged", action="store_true",
+                        help="Overlap decode/crop/inference/encode on separate threads (single process)")
+    parser.add_argument("--queue-size", type=int, default=2,
+                        help="Images buffered between stages in --staged mode (default: 2)")
+    args = parser.parse_args()
+    if args.tile and args.tile % 2:
+        parser.error("--tile must be even (the x2 model needs tiles divisible by 2)")
+    output_options = {"fmt": args.format, "png_level": args.png_level, "png_filter": args.png_filter,
+                      "png_strategy": args.png_strategy, "threads": args.encode_threads,
+                      "jpeg_quality": args.jpeg_quality}
+    ImagePipeline(args.timestamp, processed_mode=args.processed, tile_batch=args.tile_batch,
+                  tile_size=args.tile, precision=args.precision, compile_backend=args.compile,
+                  result_cache=not args.no_cache, cache_max_gb=args.cache_gb, resume=args.resume,
+                  output_options=output_options).process_all(workers=args.workers,
+                                                             threads_per_worker=args.threads_per_worker,
+                                                             staged=args.staged, queue_size=args.queue_size)
@@ -27,13 +27,9 @@ def pixel_unshuffle(x, scale):
     Returns:
         Tensor: the pixel unshuffled feature.
     """
-    b, c, hh, hw = x.size()
-    out_channel = c * (scale**2)
-    assert hh % scale == 0 and hw % scale == 0
-    h = hh // scale
-    w = hw // scale
-    x_view = x.view(b, c, h, scale, w, scale)
-    return x_view.permute(0, 1, 3, 5, 2, 4).reshape(b, out_channel, h, w)
+    # Same channel order as the basicsr view/permute version; the builtin has no
+    # Python-level shape assert, so torch.fx (int8 quantization) can trace it
+    return F.pixel_unshuffle(x, scale)
 
 def default_init_weights(module_list, scale=1, bias_fill=0, **kwargs):
     """Initialize network weights.
@@ -120,6 +116,88 @@ class RRDB(nn.Module):
         return out * 0.2 + x
 
 
+class FusedResidualDenseBlock(ResidualDenseBlock):
+    """Residual Dense Block writing into a shared channel buffer.
+
+    Same parameters (conv1..conv5) as ResidualDenseBlock, so checkpoints load
+    unchanged. Instead of re-concatenating the growing feature map before every
+    conv, each conv output is written once into its channel slice of `buf`
+    (b, num_feat + 4 * num_grow_ch, h, w), whose first num_feat channels hold
+    the block input. Each conv then reads a channel prefix of `buf`, which is
+    only contiguous (copy-free) for b == 1 - FusedRRDBTrunk feeds the blocks
+    one sample at a time.
+
+    Args:
+        num_feat (int): Channel number of intermediate features.
+        num_grow_ch (int): Channels for each growth.
+    """
+
+    def __init__(self, num_feat=64, num_grow_ch=32):
+        super(FusedResidualDenseBlock, self).__init__(num_feat, num_grow_ch)
+        self.num_feat = num_feat
+        self.num_grow_ch = num_grow_ch
+
+    def forward(self, buf):
+        c1 = self.num_feat
+        c2 = c1 + self.num_grow_ch
+        c3 = c2 + self.num_grow_ch
+        c4 = c3 + self.num_grow_ch
+        c5 = c4 + self.num_grow_ch
+        buf[:, c1:c2] = self.conv1(buf[:, :c1])
+        F.leaky_relu_(buf[:, c1:c2], 0.2)
+        buf[:, c2:c3] = self.conv2(buf[:, :c2])
+        F.leaky_relu_(buf[:, c2:c3], 0.2)
+        buf[:, c3:c4] = self.conv3(buf[:, :c3])
+        F.leaky_relu_(buf[:, c3:c4], 0.2)
+        buf[:, c4:c5] = self.conv4(buf[:, :c4])
+        F.leaky_relu_(buf[:, c4:c5], 0.2)
+        # Empirically, we use 0.2 to scale the residual for better performance
+        return self.conv5(buf).mul_(0.2).add_(buf[:, :c1])
+
+
+class FusedRRDB(nn.Module):
+    """RRDB whose three dense blocks share one preallocated channel buffer.
+
+    Args:
+        num_feat (int): Channel number of intermediate features.
+        num_grow_ch (int): Channels for each growth.
+    """
+
+    def __init__(self, num_feat, num_grow_ch=32):
+        super(FusedRRDB, self).__init__()
+        self.num_feat = num_feat
+        self.num_grow_ch = num_grow_ch
+        self.rdb1 = FusedResidualDenseBlock(num_feat, num_grow_ch)
+        self.rdb2 = FusedResidualDenseBlock(num_feat, num_grow_ch)
+        self.rdb3 = FusedResidualDenseBlock(num_feat, num_grow_ch)
+
+    def forward(self, x):
+        nf = self.num_feat
+        buf = x.new_empty((x.size(0), nf + 4 * self.num_grow_ch, x.size(2), x.size(3)))
+        buf[:, :nf] = x
+        buf[:, :nf] = self.rdb1(buf)
+        buf[:, :nf] = self.rdb2(buf)
+        out = self.rdb3(buf)
+        # Empirically, we use 0.2 to scale the residual for better performance
+        return out.mul_(0.2).add_(x)
+
+
+class FusedRRDBTrunk(nn.Sequential):
+    """Sequential of FusedRRDB blocks that runs each batch sample separately.
+
+    Keeps the dense-block channel prefixes contiguous for any batch size.
+    State-dict keys are the same as make_layer(RRDB, ...).
+    """
+
+    def forward(self, x):
+        outs = []
+        for feat in x.split(1):
+            for block in self:
+                feat = block(feat)
+            outs.append(feat)
+        return torch.cat(outs)
+
+
 class RRDBNet(nn.Module):
     """Networks consisting of Residual in Residual Dense Block, which is used
     in ESRGAN.
@@ -138,9 +216,11 @@ class RRDBNet(nn.Module):
             Default: 64
         num_block (int): Block number in the trunk network. Defaults: 23
         num_grow_ch (int): Channels for each growth. Default: 32.
+        fused (bool): Use FusedRRDBTrunk (same weights, no per-conv torch.cat).
+            Default: False.
     """
 
-    def __init__(self, num_in_ch, num_out_ch, scale=4, num_feat=64, num_block=23, num_grow_ch=32):
+    def __init__(self, num_in_ch, num_out_ch, scale=4, num_feat=64, num_block=23, num_grow_ch=32, fused=False):
         super(RRDBNet, self).__init__()
         self.scale = scale
         if scale == 2:
@@ -148,7 +228,10 @@ class RRDBNet(nn.Module):
         elif scale == 1:
             num_in_ch = num_in_ch * 16
         self.conv_first = nn.Conv2d(num_in_ch, num_feat, 3, 1, 1)
-        self.body = make_layer(RRDB, num_block, num_feat=num_feat, num_grow_ch=num_grow_ch)
+        if fused:
+            self.body = FusedRRDBTrunk(*make_layer(FusedRRDB, num_block, num_feat=num_feat, num_grow_ch=num_grow_ch))
+        else:
+            self.body = make_layer(RRDB, num_block, num_feat=num_feat, num_grow_ch=num_grow_ch)
         self.conv_body = nn.Conv2d(num_feat, num_feat, 3, 1, 1)
         # upsample
         self.conv_up1 = nn.Conv2d(num_feat, num_feat, 3, 1, 1)
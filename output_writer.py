@@ -0,0 +1,167 @@
+"""
+Output Writer
+
+Encodes the upscaled images that ImagePipeline writes to upscaled/. The
+resample to the plan's output size happens here too, so memory-mapped model
+outputs can be resampled and encoded in row blocks (see png_stream.py).
+
+PNG (default): compression level, zlib strategy and row filter are
+configurable, and `threads > 1` deflates row blocks in parallel. The defaults
+match what cv2.imwrite did before (level 1, Z_RLE, Sub filter).
+
+JPEG: a high-quality path for Adobe Stock, which accepts 8-bit sRGB JPEGs of
+up to 45MB. 16-bit outputs are reduced to 8 bits, alpha is flattened onto
+white, and chroma is kept at 4:4:4. The resample and the 8-bit conversion run
+in row blocks like PNG, but OpenCV's JPEG encoder takes a whole image, so the
+final 8-bit BGR raster (3 bytes per output pixel) is held in RAM - JPEG
+output is bounded by that raster, not by one row block.
+"""
+
+import os
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from png_stream import FILTERS, STRATEGIES, write_png, array_row_blocks
+from upscale_planner import resize_to_plan, iter_resized_rows
+
+OUTPUT_FORMATS = ("png", "jpeg")
+PNG_FILTERS = tuple(FILTERS) + ("adaptive",)
+PNG_STRATEGIES = tuple(STRATEGIES)
+DEFAULT_PNG_LEVEL = 1
+DEFAULT_PNG_FILTER = "sub"
+DEFAULT_PNG_STRATEGY = "rle"
+DEFAULT_JPEG_QUALITY = 95
+# Adobe Stock upload limit
+STOCK_MAX_BYTES = 45 * 1024 ** 2
+
+# bytes: file size; resize_seconds / encode_seconds: time spent resampling / encoding
+WriteResult = namedtuple("WriteResult", ["bytes", "resize_seconds", "encode_seconds"])
+
+
+def _resized_blocks(output, plan):
+    yield from array_row_blocks(resize_to_plan(output, plan))
+
+
+def _to_jpeg_pixels(block):
+    """8-bit BGR rows for the JPEG encoder: 16-bit reduced, gray expanded, alpha flattened onto white."""
+    if block.dtype == np.uint16:
+        block = (block >> 8).astype(np.uint8)
+    if block.ndim == 2:
+        return cv2.cvtColor(block, cv2.COLOR_GRAY2BGR)
+    if block.shape[2] == 4:
+        alpha = block[:, :, 3:4].astype(np.float32) / 255
+        return (block[:, :, :3] * alpha + 255 * (1 - alpha)).round().astype(np.uint8)
+    return block
+
+
+def _jpeg_raster(blocks, out_size):
+    """Assemble resampled row blocks into the 8-bit BGR image the JPEG encoder needs."""
+    out_w, out_h = out_size
+    img = np.empty((out_h, out_w, 3), dtype=np.uint8)
+    y = 0
+    for block in blocks:
+        img[y:y + len(block)] = _to_jpeg_pixels(block)
+        y += len(block)
+    return img
+
+
+class _Timed:
+    """Iterator wrapper that adds the time spent producing items to `seconds`."""
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            return next(self.iterator)
+        finally:
+            self.seconds += time.perf_counter() - t0
+
+
+class OutputWriter:
+    """Resample + encode upscaled outputs.
+
+    Args:
+        fmt (str): "png" or "jpeg".
+        png_level (int): zlib level 0-9.
+        png_filter (str): PNG row filter, one of PNG_FILTERS.
+        png_strategy (str): zlib strategy, one of PNG_STRATEGIES.
+        threads (int): PNG deflate threads (1 = single zlib stream).
+        jpeg_quality (int): JPEG quality 1-100.
+    """
+
+    def __init__(self, fmt="png", png_level=DEFAULT_PNG_LEVEL, png_filter=DEFAULT_PNG_FILTER,
+                 png_strategy=DEFAULT_PNG_STRATEGY, threads=1, jpeg_quality=DEFAULT_JPEG_QUALITY, log=print):
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"fmt must be one of {OUTPUT_FORMATS}, got {fmt!r}")
+        if png_filter not in PNG_FILTERS or png_strategy not in PNG_STRATEGIES:
+            raise ValueError(f"Unknown PNG filter/strategy: {png_filter!r}, {png_strategy!r}")
+        self.fmt = fmt
+        self.png_level = png_level
+        self.png_filter = png_filter
+        self.png_strategy = png_strategy
+        self.threads = max(1, threads)
+        self.jpeg_quality = jpeg_quality
+        self.log = log
+
+    @property
+    def ext(self):
+        return ".jpg" if self.fmt == "jpeg" else ".png"
+
+    def options(self):
+        """Constructor keyword arguments (for worker processes)."""
+        return {"fmt": self.fmt, "png_level": self.png_level, "png_filter": self.png_filter,
+                "png_strategy": self.png_strategy, "threads": self.threads, "jpeg_quality": self.jpeg_quality}
+
+    def cache_params(self):
+        """Result-cache key parameters that change the encoded pixels (PNG settings are lossless)."""
+        return {"format": "jpeg", "quality": self.jpeg_quality} if self.fmt == "jpeg" else {}
+
+    def describe(self):
+        if self.fmt == "jpeg":
+            return f"JPEG q{self.jpeg_quality} 4:4:4"
+        return f"PNG level {self.png_level}, {self.png_filter} filter, {self.png_strategy}, {self.threads} thread(s)"
+
+    def write(self, out_path, output, plan):
+        """Resample `output` to plan.out_size and write it to `out_path` atomically. Returns a WriteResult."""
+        t0 = time.perf_counter()
+        if isinstance(output, np.memmap):
+            # Memory-mapped canvas: resample block by block while encoding
+            blocks = _Timed(iter_resized_rows(output, plan))
+        else:
+            blocks = _Timed(_resized_blocks(output, plan))
+        if self.fmt == "jpeg":
+            img = _jpeg_raster(blocks, plan.out_size)
+            t1 = time.perf_counter()
+            size = self._write_jpeg(out_path, img)
+            return WriteResult(size, blocks.seconds, time.perf_counter() - t1)
+
+        channels = 1 if output.ndim == 2 else output.shape[2]
+        size = write_png(out_path, blocks, *plan.out_size, channels, output.dtype, level=self.png_level,
+                         filter_name=self.png_filter, strategy=self.png_strategy, threads=self.threads)
+        total = time.perf_counter() - t0
+        return WriteResult(size, blocks.seconds, total - blocks.seconds)
+
+    def _write_jpeg(self, out_path, img):
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+        if hasattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR"):  # OpenCV >= 4.5.5
+            params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444]
+        ok, buf = cv2.imencode(".jpg", img, params)
+        if not ok:
+            raise ValueError(f"Failed to encode {out_path}")
+        if buf.size > STOCK_MAX_BYTES:
+            self.log(f"WARNING: {os.path.basename(out_path)} is {buf.size / 1024 ** 2:.1f}MB, "
+                     f"over Adobe Stock's {STOCK_MAX_BYTES // 1024 ** 2}MB limit - lower --jpeg-quality")
+        tmp_path = out_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            buf.tofile(f)
+        os.replace(tmp_path, out_path)
+        return buf.size
@@ -0,0 +1,212 @@
+"""
+Per-image, per-stage metrics for generation_pipeline.py.
+
+Every processed image produces one JSON line in logs/upscale_metrics.jsonl
+(next to upscale.log) with the seconds spent in each stage - hash (source
+sha256), decode, crop, model_load, inference, resize, encode, json_copy -
+plus the tile count, inference time per tile, the peak RSS of the process
+while the image was in flight and its CPU utilization (process CPU time /
+wall time, in % of one core). At the end of a run, summary_lines() renders a table of where the
+time went so the stage that limits throughput on a host is obvious.
+
+With --workers N each worker measures its own images and hands the records
+to the parent (pop), which writes them. In --staged mode images overlap, so
+RSS and CPU figures are process-wide while each image was in flight.
+"""
+
+import os
+import json
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+METRICS_FILENAME = "upscale_metrics.jsonl"
+STAGES = ("hash", "decode", "crop", "model_load", "inference", "resize", "encode", "json_copy")
+
+
+class RSSSampler:
+    """Background thread sampling process RSS; tracks the peak inside each open window.
+
+    Windows may overlap (--staged), each one sees every sample taken while it
+    is open. Without psutil peaks are unknown (None).
+    """
+
+    def __init__(self, interval=0.05):
+        self.process = psutil.Process() if psutil is not None else None
+        self.interval = interval
+        self._windows = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = self.process.memory_info().rss
+        with self._lock:
+            for key, peak in self._windows.items():
+                self._windows[key] = max(peak, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def open(self):
+        """Start a window; returns its id."""
+        if self.process is None:
+            return None
+        window = next(self._ids)
+        with self._lock:
+            self._windows[window] = 0
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+        self._sample()
+        return window
+
+    def close(self, window):
+        """End a window; returns its peak RSS in MB (None if unknown)."""
+        if window is None:
+            return None
+        self._sample()
+        with self._lock:
+            peak = self._windows.pop(window, 0)
+        return round(peak / 1024 ** 2, 1)
+
+    def stop(self):
+        """Stop the sampling thread; the next open() starts a new one."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+        self._stop.clear()
+
+
+class ImageMetrics:
+    """Stage timings of one image. Use `with metrics.stage("encode"): ...` or add()."""
+
+    def __init__(self, fname, sampler):
+        self.fname = fname
+        self.stages = {}
+        self.extra = {}
+        self.finished = False
+        self._sampler = sampler
+        self._window = sampler.open()
+        self._t0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def set(self, **fields):
+        self.extra.update(fields)
+
+    def finish(self, status):
+        """Close the image and return its JSON record."""
+        self.finished = True
+        wall = time.perf_counter() - self._t0
+        cpu = time.process_time() - self._cpu0
+        record = {"fname": self.fname, "status": status, "pid": os.getpid(),
+                  "stages": {name: round(sec, 4) for name, sec in self.stages.items()},
+                  "wall_seconds": round(wall, 3),
+                  "cpu_percent": round(100 * cpu / wall, 1) if wall > 0 else None,
+                  "peak_rss_mb": self._sampler.close(self._window)}
+        record.update(self.extra)
+        tiles = record.get("tiles")
+        if tiles and "inference" in self.stages:
+            record["ms_per_tile"] = round(1000 * self.stages["inference"] / tiles, 2)
+        return record
+
+
+class PipelineMetrics:
+    """Collects ImageMetrics records of a run and appends them to `path` as JSON lines.
+
+    Args:
+        run (str): Run timestamp, stored in every record.
+        path (str): JSONL file, or None in worker processes (records are
+            kept for pop() and written by the parent).
+    """
+
+    def __init__(self, run, path=None, log=print):
+        self.run = run
+        self.path = path
+        self.log = log
+        self.records = []
+        self.sampler = RSSSampler()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def image(self, fname):
+        return ImageMetrics(fname, self.sampler)
+
+    def finish(self, metrics, status):
+        """Record a finished image (no-op if it was already finished)."""
+        if metrics.finished:
+            return
+        record = metrics.finish(status)
+        if self.path is None:
+            with self._lock:
+                self._pending[metrics.fname] = record
+        else:
+            self.emit(record)
+
+    def pop(self, fname):
+        """Record of `fname` for the parent process (worker side)."""
+        with self._lock:
+            return self._pending.pop(fname, None)
+
+    def emit(self, record):
+        if record is None:
+            return
+        record = dict(record, run=self.run, at=datetime.now().isoformat(timespec="seconds"))
+        with self._lock:
+            self.records.append(record)
+            if self.path is None:
+                return
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as e:
+                self.log(f"WARNING: could not write {os.path.basename(self.path)}: {e}")
+
+    def summary_lines(self):
+        """Stage table of this run's upscaled images (skipped / cached / failed ones are left out)."""
+        records = [r for r in self.records if r["status"] == "done" and not r.get("cached")]
+        if not records:
+            return []
+        names = [s for s in STAGES if any(s in r["stages"] for r in records)]
+        names += sorted({s for r in records for s in r["stages"]} - set(names))
+        totals = {s: sum(r["stages"].get(s, 0.0) for r in records) for s in names}
+        grand_total = sum(totals.values()) or 1.0
+        lines = [f"Stage metrics ({len(records)} images, {os.path.basename(self.path or METRICS_FILENAME)}):",
+                 f"  {'stage':<11}{'images':>7}{'total':>10}{'avg':>10}{'max':>10}{'share':>8}"]
+        for s in names:
+            values = [r["stages"][s] for r in records if s in r["stages"]]
+            lines.append(f"  {s:<11}{len(values):>7}{totals[s]:>9.2f}s{totals[s] / len(values):>9.3f}s"
+                         f"{max(values):>9.3f}s{100 * totals[s] / grand_total:>7.1f}%")
+        tiles = sum(r.get("tiles", 0) for r in records)
+        if tiles and totals.get("inference"):
+            lines.append(f"  inference: {tiles} tiles, {1000 * totals['inference'] / tiles:.1f}ms/tile")
+        peaks = [r["peak_rss_mb"] for r in records if r.get("peak_rss_mb") is not None]
+        cpu = [r["cpu_percent"] for r in records if r.get("cpu_percent") is not None]
+        if peaks:
+            lines.append(f"  peak RSS: {max(peaks):.0f}MB (avg per image {sum(peaks) / len(peaks):.0f}MB)")
+        if cpu:
+            lines.append(f"  CPU: {sum(cpu) / len(cpu):.0f}% of one core on average")
+        bottleneck = max(names, key=totals.get)
+        lines.append(f"  slowest stage: {bottleneck} ({100 * totals[bottleneck] / grand_total:.0f}% of stage time)")
+        return lines
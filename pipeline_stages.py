@@ -0,0 +1,134 @@
+"""
+Staged (streaming) execution helper for ImagePipeline.
+
+Each stage runs on its own thread(s) and hands work items to the next stage
+through a bounded queue, so PNG decode/encode and disk I/O overlap with model
+inference instead of running in lockstep with it.
+"""
+
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class StageStats:
+    """Per-stage timing: time spent working, starved (waiting for input) and blocked (downstream full)."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy=0.0, starved=0.0, blocked=0.0, items=0):
+        with self._lock:
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+            self.items += items
+
+    def summary(self):
+        avg_ms = self.busy / max(1, self.items) * 1000
+        return (f"{self.name:<10} x{self.workers}  items={self.items:<4} busy={self.busy:7.2f}s "
+                f"avg={avg_ms:8.1f}ms  starved={self.starved:7.2f}s  blocked={self.blocked:7.2f}s")
+
+
+def run_stages(items, stages, queue_size=2, log=print):
+    """Push `items` through `stages` and return the items that came out of the last stage.
+
+    Args:
+        items: Iterable of work items (dicts). Each item flows through every stage.
+        stages: List of (name, fn, workers) or (name, fn, workers, batch).
+            `fn(item)` updates the item in place. With `batch` > 1 the stage instead
+            gets `fn(items)` with up to `batch` items that are already queued (it
+            never waits to fill a batch).
+            If a stage raises, the exception is stored in item["error"] and later
+            stages pass the item through untouched.
+        queue_size: Capacity of each inter-stage queue (bounds memory in flight).
+        log: Logging callable for the timing summary.
+
+    Returns:
+        (results, stats) - finished items in completion order and a list of StageStats.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    results = queue.Queue()
+    stats = [StageStats(stage[0], stage[2]) for stage in stages]
+    threads = []
+
+    def worker(stage_idx, fn, batch, remaining):
+        in_q = queues[stage_idx]
+        out_q = queues[stage_idx + 1] if stage_idx + 1 < len(stages) else results
+        st = stats[stage_idx]
+        done = False
+        while not done:
+            t0 = time.perf_counter()
+            batch_items = [in_q.get()]
+            # Top up the batch with whatever is already waiting
+            while batch_items[-1] is not _DONE and len(batch_items) < batch:
+                try:
+                    batch_items.append(in_q.get_nowait())
+                except queue.Empty:
+                    break
+            t1 = time.perf_counter()
+            if batch_items[-1] is _DONE:
+                batch_items.pop()
+                done = True
+
+            if batch_items:
+                ok = [item for item in batch_items if item.get("error") is None]
+                # A failing batch fails all of its items; a failing item only itself
+                groups = [ok] if batch > 1 else [[item] for item in ok]
+                for group in groups:
+                    if not group:
+                        continue
+                    try:
+                        fn(group if batch > 1 else group[0])
+                    except Exception as e:
+                        for item in group:
+                            item["error"] = e
+                t2 = time.perf_counter()
+                for item in batch_items:
+                    out_q.put(item)
+                t3 = time.perf_counter()
+                st.add(busy=t2 - t1, starved=t1 - t0, blocked=t3 - t2, items=len(batch_items))
+            else:
+                st.add(starved=t1 - t0)
+
+        with remaining["lock"]:
+            remaining["count"] -= 1
+            last = remaining["count"] == 0
+        # The last worker of a stage closes the next one
+        if last and out_q is not results:
+            for _ in range(stages[stage_idx + 1][2]):
+                out_q.put(_DONE)
+
+    for stage_idx, stage in enumerate(stages):
+        name, fn, workers = stage[:3]
+        batch = stage[3] if len(stage) > 3 else 1
+        remaining = {"count": workers, "lock": threading.Lock()}
+        for n in range(workers):
+            t = threading.Thread(target=worker, args=(stage_idx, fn, batch, remaining),
+                                 name=f"stage-{name}-{n}", daemon=True)
+            t.start()
+            threads.append(t)
+
+    for item in items:
+        queues[0].put(item)
+    for _ in range(stages[0][2]):
+        queues[0].put(_DONE)
+    for t in threads:
+        t.join()
+
+    log("=== Stage timing (busy = working, starved = waiting for input, blocked = waiting on next stage) ===")
+    for st in stats:
+        log("  " + st.summary())
+
+    finished = []
+    while not results.empty():
+        finished.append(results.get())
+    return finished, stats
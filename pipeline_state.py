@@ -0,0 +1,140 @@
+"""
+Per-run checkpoint manifest for generation_pipeline.py.
+
+generations/<ts>/_pipeline_state.json records, per raw image, which outputs
+were completed (processed/ crop, upscaled/ PNG) together with their size,
+sha256 and timing, plus the sha256 of the source file. The manifest is
+rewritten atomically (temp file + rename) after every change, so it always
+describes a consistent point in time even if the process is killed.
+
+With `--resume` the pipeline trusts only outputs the manifest vouches for:
+a file that exists but is missing from the manifest, doesn't match its
+recorded size/hash, or belongs to a since-modified source is redone from
+the last verified stage.
+"""
+
+import os
+import json
+import threading
+from datetime import datetime
+
+from result_cache import file_digest
+
+STATE_FILENAME = "_pipeline_state.json"
+STAGES = ("processed", "upscaled")
+
+
+class PipelineState:
+    """Thread-safe manifest of per-image progress for one run folder.
+
+    Args:
+        run_dir: generations/<ts> folder the manifest lives in.
+        autosave: Write the manifest after every update. Worker processes use
+            autosave=False and hand their updates to the parent (pop_updates).
+    """
+
+    def __init__(self, run_dir, autosave=True, log=print):
+        self.path = os.path.join(run_dir, STATE_FILENAME)
+        self.autosave = autosave
+        self.log = log
+        self.images = {}
+        self._updates = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.images = json.load(f).get("images", {})
+        except (OSError, ValueError) as e:
+            self.log(f"WARNING: unreadable {STATE_FILENAME}, starting a new one: {e}")
+            self.images = {}
+
+    def save(self):
+        with self._lock:
+            data = {"updated_at": datetime.now().isoformat(timespec="seconds"), "images": self.images}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def get(self, fname):
+        with self._lock:
+            return dict(self.images.get(fname, {}))
+
+    def update(self, fname, **fields):
+        """Merge `fields` into the record for `fname` (and persist it)."""
+        fields["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self.images.setdefault(fname, {}).update(fields)
+            self._updates.setdefault(fname, {}).update(fields)
+        if self.autosave:
+            self.save()
+
+    def record_output(self, fname, stage, path, seconds=None, **extra):
+        """Mark `stage` of `fname` complete with the size and hash of the file written at `path`."""
+        entry = {"bytes": os.path.getsize(path), "sha256": file_digest(path)}
+        if seconds is not None:
+            entry["seconds"] = round(seconds, 3)
+        entry.update(extra)
+        self.update(fname, **{stage: entry})
+
+    def set_source(self, fname, digest):
+        """Record the source's sha256; if it differs from the recorded one, its outputs no longer verify."""
+        with self._lock:
+            record = self.images.setdefault(fname, {})
+            previous = record.get("source_sha256")
+            if previous == digest:
+                return
+            updates = self._updates.setdefault(fname, {})
+            if previous is not None:
+                for stage in STAGES:
+                    if record.pop(stage, None) is not None:
+                        updates[stage] = None
+            fields = {"source_sha256": digest, "updated_at": datetime.now().isoformat(timespec="seconds")}
+            record.update(fields)
+            updates.update(fields)
+        if self.autosave:
+            self.save()
+
+    def invalidate(self, fname, stage):
+        with self._lock:
+            record = self.images.get(fname, {})
+            record.pop(stage, None)
+            self._updates.setdefault(fname, {})[stage] = None
+        if self.autosave:
+            self.save()
+
+    def verified(self, fname, stage, path, source_digest):
+        """True if `path` is exactly the `stage` output the manifest recorded for this source."""
+        record = self.get(fname)
+        entry = record.get(stage)
+        if not entry or record.get("source_sha256") != source_digest:
+            return False
+        try:
+            if os.path.getsize(path) != entry["bytes"]:
+                return False
+            return file_digest(path) == entry["sha256"]
+        except OSError:
+            return False
+
+    def pop_updates(self, fname):
+        """Updates made to `fname` since the last call (sent from workers to the parent)."""
+        with self._lock:
+            return self._updates.pop(fname, {})
+
+    def merge(self, fname, updates):
+        """Apply updates produced by a worker process."""
+        if not updates:
+            return
+        with self._lock:
+            record = self.images.setdefault(fname, {})
+            for key, value in updates.items():
+                if value is None:
+                    record.pop(key, None)
+                else:
+                    record[key] = value
+        if self.autosave:
+            self.save()
@@ -0,0 +1,194 @@
+"""
+Streaming PNG encoder.
+
+cv2.imwrite needs the whole image in RAM and then builds the whole compressed
+file in memory on top of it. write_png() instead takes the image as an
+iterable of row blocks (cv2 layout: BGR/BGRA/gray, uint8 or uint16), filters
+and deflates each block as it arrives and appends IDAT chunks to the file, so
+an output that lives in a memory-mapped canvas is never materialized in RAM.
+
+The defaults (Sub filter, zlib level 1, Z_RLE) are the ones cv2.imwrite uses,
+so streamed and in-memory outputs are about the same size.
+
+With threads > 1 each row block is deflated on its own thread (pigz-style):
+blocks end on a sync flush and are primed with the previous block's last 32KB
+as a preset dictionary, so they concatenate into one valid zlib stream that
+compresses almost as well as a single-threaded one.
+"""
+
+import os
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Compressed bytes buffered before an IDAT chunk is written
+IDAT_CHUNK_BYTES = 256 * 1024
+# Rows per block when streaming a plain array (see array_row_blocks)
+BLOCK_ROWS = 64
+
+FILTERS = {"none": 0, "sub": 1, "up": 2, "avg": 3, "paeth": 4}
+COLOR_TYPES = {1: 0, 3: 2, 4: 6}  # channels -> PNG color type (gray, RGB, RGBA)
+STRATEGIES = {"default": zlib.Z_DEFAULT_STRATEGY, "filtered": zlib.Z_FILTERED, "huffman": zlib.Z_HUFFMAN_ONLY,
+              "rle": zlib.Z_RLE, "fixed": zlib.Z_FIXED}
+DEFLATE_WINDOW = 32 * 1024
+
+
+def _chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+
+def _filter_rows(rows, prior, bpp, filter_type):
+    """Apply one PNG filter to (n, rowbytes) uint8 rows; `prior` is the row above the first one."""
+    if filter_type == 0:
+        return rows
+    up = np.concatenate([prior[None], rows[:-1]])
+    if filter_type == 2:
+        return rows - up
+    left = np.zeros_like(rows)
+    left[:, bpp:] = rows[:, :-bpp]
+    if filter_type == 1:
+        return rows - left
+    if filter_type == 3:
+        return rows - ((left.astype(np.uint16) + up) >> 1).astype(np.uint8)
+    upper_left = np.zeros_like(rows)
+    upper_left[:, bpp:] = up[:, :-bpp]
+    a, b, c = (x.astype(np.int16) for x in (left, up, upper_left))
+    p = a + b - c
+    pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+    predictor = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upper_left))
+    return rows - predictor
+
+
+def filter_block(rows, prior, bpp, filter_name="sub"):
+    """Filter a block of raw rows into PNG scanlines (filter-type byte + filtered bytes).
+
+    filter_name is one of FILTERS or "adaptive", which picks the filter with
+    the smallest sum of absolute (signed) bytes per row, like libpng.
+    """
+    if filter_name != "adaptive":
+        filter_type = FILTERS[filter_name]
+        filtered = _filter_rows(rows, prior, bpp, filter_type)
+        types = np.full((rows.shape[0], 1), filter_type, dtype=np.uint8)
+        return np.concatenate([types, filtered], axis=1)
+    candidates = np.stack([_filter_rows(rows, prior, bpp, t) for t in range(5)])
+    cost = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis=2)
+    best = cost.argmin(axis=0)
+    filtered = candidates[best, np.arange(rows.shape[0])]
+    return np.concatenate([best.astype(np.uint8)[:, None], filtered], axis=1)
+
+
+def raw_rows(block):
+    """PNG byte layout of a cv2 row block: RGB(A) channel order, big-endian samples, (n, rowbytes) uint8."""
+    if block.ndim == 3:
+        block = block[:, :, [2, 1, 0, 3][:block.shape[2]]]
+    if block.dtype == np.uint16:
+        block = block.astype(">u2")
+    block = np.ascontiguousarray(block)
+    return block.view(np.uint8).reshape(block.shape[0], -1)
+
+
+def array_row_blocks(img, block_rows=BLOCK_ROWS):
+    """Iterate an image (array or memmap) in blocks of `block_rows` rows."""
+    for y in range(0, img.shape[0], block_rows):
+        yield img[y:y + block_rows]
+
+
+def _deflate_block(data, zdict, level, strategy):
+    """Raw-deflate one block, ending on a byte-aligned sync flush (safe to concatenate)."""
+    kwargs = {"zdict": zdict} if zdict else {}
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, strategy, **kwargs)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def _scanlines(blocks, width, bpp, filter_name, counter):
+    """Filtered scanline bytes per row block; counts rows into counter[0]."""
+    prior = np.zeros(width * bpp, dtype=np.uint8)
+    for block in blocks:
+        rows = raw_rows(block)
+        if rows.shape[1] != width * bpp:
+            raise ValueError(f"Row block of {rows.shape[1]} bytes, expected {width * bpp}")
+        yield filter_block(rows, prior, bpp, filter_name).tobytes()
+        prior = rows[-1]
+        counter[0] += rows.shape[0]
+
+
+def _deflate_serial(scanlines, level, strategy):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, strategy)
+    for data in scanlines:
+        yield compressor.compress(data)
+    yield compressor.flush()
+
+
+def _deflate_parallel(scanlines, level, strategy, threads):
+    """zlib stream of the scanlines with each block deflated on a worker thread, in order."""
+    yield b"\x78\x9c"  # zlib header: deflate, 32KB window
+    adler = 1
+    zdict = b""
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="png-deflate") as pool:
+        for data in scanlines:
+            in_flight.append(pool.submit(_deflate_block, data, zdict, level, strategy))
+            adler = zlib.adler32(data, adler)
+            zdict = data[-DEFLATE_WINDOW:]
+            # Bound the blocks held in memory to a couple per thread
+            while len(in_flight) > 2 * threads:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+    yield zlib.compressobj(level, zlib.DEFLATED, -15).flush(zlib.Z_FINISH)  # empty final block
+    yield struct.pack(">I", adler)
+
+
+def write_png(path, blocks, width, height, channels, dtype=np.uint8, level=1, filter_name="sub",
+              strategy="rle", threads=1):
+    """Encode row blocks into a PNG at `path` (written under a temp name + rename).
+
+    Args:
+        blocks: Iterable of cv2-layout arrays of shape (rows, width[, channels])
+            covering `height` rows in order.
+        level / strategy: zlib compression level (0-9) and strategy (see STRATEGIES).
+        filter_name: PNG row filter, see filter_block().
+        threads: Deflate row blocks on this many threads (1 = one zlib stream).
+    Returns the number of bytes written.
+    """
+    dtype = np.dtype(dtype)
+    if channels not in COLOR_TYPES or dtype not in (np.uint8, np.uint16):
+        raise ValueError(f"Unsupported PNG layout: {channels} channel(s) of {dtype}")
+    bpp = channels * dtype.itemsize
+    header = struct.pack(">IIBBBBB", width, height, dtype.itemsize * 8, COLOR_TYPES[channels], 0, 0, 0)
+    rows_written = [0]
+    scanlines = _scanlines(blocks, width, bpp, filter_name, rows_written)
+    if threads > 1:
+        stream = _deflate_parallel(scanlines, level, STRATEGIES[strategy], threads)
+    else:
+        stream = _deflate_serial(scanlines, level, STRATEGIES[strategy])
+
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(PNG_SIGNATURE + _chunk(b"IHDR", header))
+            pending = []
+            pending_bytes = 0
+            for data in stream:
+                pending.append(data)
+                pending_bytes += len(data)
+                if pending_bytes >= IDAT_CHUNK_BYTES:
+                    f.write(_chunk(b"IDAT", b"".join(pending)))
+                    pending, pending_bytes = [], 0
+            f.write(_chunk(b"IDAT", b"".join(pending)))
+            f.write(_chunk(b"IEND", b""))
+            size = f.tell()
+        if rows_written[0] != height:
+            raise ValueError(f"Got {rows_written[0]} rows, expected {height}")
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    os.replace(tmp_path, path)
+    return size
@@ -0,0 +1,223 @@
+"""
+Precision strategies for RRDBNet inference.
+
+    fp32  - reference quality
+    fp16  - half precision; only honoured on CUDA (CPU fp16 convs are slow or unsupported)
+    bf16  - fp32 weights + bfloat16 autocast, on CPUs with native bf16 (AVX512-BF16 / AMX)
+    int8  - statically quantized conv weights/activations (FX graph mode, x86/fbgemm backend)
+    auto  - fp16 on CUDA, fp32 on CPU
+
+Lower precisions trade fidelity for speed; `python precision.py --reference DIR`
+measures exactly how much (PSNR/SSIM against fp32 plus speedup) before you opt in.
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import contextlib
+import warnings
+from datetime import datetime
+
+import cv2
+import numpy as np
+import torch
+
+PRECISION_MODES = ("auto", "fp32", "fp16", "bf16", "int8")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPORT_FILE = os.path.join(BASE_DIR, "logs", "precision_report.json")
+# Size of the center crops used for int8 calibration and quality reports
+CALIBRATION_TILE = 128
+
+
+def cpu_supports_bf16():
+    """True if oneDNN has native bf16 kernels on this CPU."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def resolve_precision(requested, device):
+    """Map a requested mode to one the device can actually run. Returns (precision, note)."""
+    if requested == "auto":
+        return ("fp16", "auto") if device.type == 'cuda' else ("fp32", "auto")
+    if requested == "fp16" and device.type != 'cuda':
+        return "fp32", "fp16 is not supported on CPU"
+    if requested == "bf16" and device.type == 'cpu' and not cpu_supports_bf16():
+        return "fp32", "this CPU has no native bf16"
+    if requested == "int8" and device.type != 'cpu':
+        return "fp16", "int8 kernels are CPU-only"
+    return requested, None
+
+
+def quantize_int8(model, calibration):
+    """Statically quantize RRDBNet to int8 using calibration tiles (list of 1x3xHxW float tensors)."""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    model = copy.deepcopy(model).float().cpu().eval()
+    # Quantized leaky_relu has no in-place variant
+    for module in model.modules():
+        if isinstance(module, torch.nn.LeakyReLU):
+            module.inplace = False
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        prepared = prepare_fx(model, get_default_qconfig_mapping("x86"), example_inputs=(calibration[0],))
+        with torch.inference_mode():
+            for tile in calibration:
+                prepared(tile)
+        return convert_fx(prepared)
+
+
+def calibration_tiles(images, size=CALIBRATION_TILE):
+    """Center crops of BGR uint8 images as model-ready 1x3xHxW RGB float tensors."""
+    tiles = []
+    for img in images:
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        img = img[:, :, :3]
+        h, w = img.shape[:2]
+        y0, x0 = max(0, (h - size) // 2), max(0, (w - size) // 2)
+        crop = cv2.cvtColor(img[y0:y0 + size, x0:x0 + size], cv2.COLOR_BGR2RGB).astype(np.float32) / 255
+        tiles.append(torch.from_numpy(np.transpose(crop, (2, 0, 1))).unsqueeze(0))
+    if not tiles:
+        # No reference content available - a gradient + noise is better than nothing
+        ramp = np.linspace(0, 1, size, dtype=np.float32)
+        noise = np.random.default_rng(0).random((3, size, size), dtype=np.float32) * 0.2
+        tiles.append(torch.from_numpy(np.clip(ramp[None, None, :] * 0.8 + noise, 0, 1)).unsqueeze(0))
+    return tiles
+
+
+class InferencePlan:
+    """How inputs must be fed to a model prepared by prepare_model()."""
+
+    def __init__(self, precision, device, input_dtype):
+        self.precision = precision
+        self.device = device
+        self.input_dtype = input_dtype
+
+    @classmethod
+    def for_precision(cls, precision, device):
+        if precision == "int8":
+            return cls("int8", torch.device('cpu'), torch.float32)
+        return cls(precision, device, torch.float16 if precision == "fp16" else torch.float32)
+
+    def context(self):
+        if self.precision == "bf16":
+            return torch.autocast(self.device.type, dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+
+def prepare_model(model, precision, device, calibration=None):
+    """Convert a loaded fp32 RRDBNet for `precision` (already resolved). Returns (model, InferencePlan)."""
+    plan = InferencePlan.for_precision(precision, device)
+    if precision == "int8":
+        if calibration is None:
+            calibration = calibration_tiles([])
+        return quantize_int8(model, calibration), plan
+    return model.to(plan.device, dtype=plan.input_dtype).eval(), plan
+
+
+# === QUALITY REPORT ===
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def ssim(a, b):
+    """Mean SSIM over channels (Gaussian window 11, sigma 1.5 - the standard Wang et al. setup)."""
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda x: cv2.GaussianBlur(x, (11, 11), 1.5)
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    cov = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+
+def precision_report(model_path, reference_dir, precisions=("bf16", "int8"), tile=128, tile_batch=4,
+                     crop=256, log=print):
+    """Upscale a reference set with each precision and compare against fp32.
+
+    Images are center-cropped to `crop` px to keep the run short. Writes
+    logs/precision_report.json and returns the per-precision summary.
+    """
+    from tiled_inference import TiledUpscaler, load_rrdbnet
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    files = sorted(f for f in os.listdir(reference_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    images = []
+    for fname in files:
+        img = cv2.imread(os.path.join(reference_dir, fname), cv2.IMREAD_COLOR)
+        if img is not None:
+            h, w = img.shape[:2]
+            y0, x0 = max(0, (h - crop) // 2), max(0, (w - crop) // 2)
+            images.append((fname, np.ascontiguousarray(img[y0:y0 + crop, x0:x0 + crop])))
+    if not images:
+        raise ValueError(f"No reference images in {reference_dir}")
+
+    base_model = load_rrdbnet(model_path)
+    calibration = calibration_tiles([img for _, img in images])
+
+    def run(precision):
+        # prepare_model converts in place (fp16 on CUDA), so every run starts from its own fp32 copy
+        upsampler = TiledUpscaler(copy.deepcopy(base_model), tile=tile, batch_size=tile_batch, precision=precision,
+                                  calibration=calibration, device=device)
+        outputs, elapsed = [], 0.0
+        for _, img in images:
+            t0 = time.perf_counter()
+            outputs.append(upsampler.enhance(img)[0])
+            elapsed += time.perf_counter() - t0
+        return outputs, elapsed
+
+    log(f"Reference: {len(images)} images from {reference_dir} ({crop}px crops)")
+    reference, ref_time = run("fp32")
+    report = {"fp32": {"seconds": round(ref_time, 3), "speedup": 1.0, "psnr": None, "ssim": None}}
+    log(f"  fp32  {ref_time:7.2f}s  (reference)")
+    for requested in precisions:
+        precision, note = resolve_precision(requested, device)
+        if precision != requested:
+            log(f"  {requested:<5} skipped: {note}")
+            report[requested] = {"skipped": note}
+            continue
+        outputs, elapsed = run(precision)
+        per_image = [{"file": fname, "psnr": round(psnr(ref, out), 2), "ssim": round(ssim(ref, out), 4)}
+                     for (fname, _), ref, out in zip(images, reference, outputs)]
+        summary = {
+            "seconds": round(elapsed, 3),
+            "speedup": round(ref_time / elapsed, 2),
+            "psnr": round(min(p["psnr"] for p in per_image), 2),
+            "ssim": round(min(p["ssim"] for p in per_image), 4),
+            "images": per_image,
+        }
+        report[precision] = summary
+        log(f"  {precision:<5} {elapsed:7.2f}s  x{summary['speedup']:.2f}  "
+            f"worst PSNR {summary['psnr']:.2f}dB  worst SSIM {summary['ssim']:.4f}")
+
+    os.makedirs(os.path.dirname(REPORT_FILE), exist_ok=True)
+    with open(REPORT_FILE, "w", encoding="utf-8") as f:
+        json.dump({"created_at": datetime.now().isoformat(timespec="seconds"), "device": str(device),
+                   "reference_dir": reference_dir, "results": report}, f, indent=2)
+    log(f"Report saved: {REPORT_FILE}")
+    return report
+
+
+if __name__ == "__main__":
+    import generation_pipeline  # applies the torchvision patch
+    parser = argparse.ArgumentParser(description="Compare bf16/int8 upscales against fp32 (PSNR/SSIM + speedup).")
+    parser.add_argument("--reference", required=True, help="Folder of reference images (e.g. generations/<ts>)")
+    parser.add_argument("--precisions", nargs="+", default=["bf16", "int8"], choices=PRECISION_MODES[2:])
+    parser.add_argument("--crop", type=int, default=256, help="Center crop size per image (default: 256)")
+    args = parser.parse_args()
+    weights = os.path.join(generation_pipeline.WEIGHTS_DIR, "RealESRGAN_x4plus.pth")
+    if not os.path.exists(weights):
+        sys.exit(f"Weights not found: {weights} (run generation_pipeline.py once to download)")
+    precision_report(weights, args.reference, args.precisions, crop=args.crop)
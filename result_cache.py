@@ -0,0 +1,155 @@
+"""
+Content-addressed result cache for crops and upscales.
+
+Entries are keyed by a hash of the source image bytes plus every parameter
+that affects the result (crop box, model, scale, output size, tile, precision),
+so a renamed file, a retry or the same image in another timestamp folder is
+served from the cache instead of being upscaled again. Results are hardlinked
+into the run folder (copied when the cache lives on another filesystem).
+
+The cache directory is shared by all runs and kept under a size budget by
+evicting the least recently used entries. Recency is kept in an empty
+`<entry>.used` marker next to each entry: an entry shares its inode with the
+delivered outputs, so touching the entry itself would change the mtime of
+every upscaled file linked to it (and with it the dashboard's catalog,
+ETags and versioned image URLs).
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, "cache", "results")
+DEFAULT_MAX_GB = 20
+# Marker whose mtime records an entry's last use
+USED_SUFFIX = ".used"
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """sha256 hex digest of a file's bytes."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(source_digest, **params):
+    """Key for the result of applying `params` to the source with `source_digest`."""
+    payload = json.dumps({"source": source_digest, **params}, sort_keys=True, default=list)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _link_or_copy(src, dst):
+    """Atomically place `src` at `dst` as a hardlink (copy across filesystems)."""
+    tmp_path = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+class ResultCache:
+    """Size-bounded LRU store of result files under `root`, sharded by key prefix.
+
+    Safe to share between threads and worker processes: entries are only ever
+    created by atomic rename, and eviction tolerates files vanishing under it.
+    The size budget is tracked per process, so it is a soft bound with workers.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=DEFAULT_MAX_GB * 1024 ** 3, log=print):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.log = log
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # lazily scanned
+        self._lock = threading.Lock()
+
+    def path_for(self, key, ext=".png"):
+        return os.path.join(self.root, key[:2], key + ext)
+
+    def fetch(self, key, dest_path, ext=".png"):
+        """Place the cached result for `key` at `dest_path`. Returns False on a miss."""
+        entry = self.path_for(key, ext)
+        try:
+            _link_or_copy(entry, dest_path)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.touch(key, ext)
+        self.hits += 1
+        return True
+
+    def touch(self, key, ext=".png"):
+        """Mark the entry for `key` as just used. Returns False if there is no such entry."""
+        entry = self.path_for(key, ext)
+        if not os.path.exists(entry):
+            return False
+        try:
+            os.utime(entry + USED_SUFFIX)
+        except FileNotFoundError:
+            try:
+                open(entry + USED_SUFFIX, "ab").close()
+            except OSError:
+                pass
+        return True
+
+    def store(self, key, src_path, ext=".png"):
+        """Add `src_path` as the result for `key` and evict old entries if over budget."""
+        entry = self.path_for(key, ext)
+        if self.touch(key, ext):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        try:
+            _link_or_copy(src_path, entry)
+        except OSError as e:
+            self.log(f"WARNING: could not cache {os.path.basename(src_path)}: {e}")
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(entry)
+        self.evict()
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for fname in filenames:
+                if fname.endswith((".tmp", USED_SUFFIX)):
+                    continue
+                path = os.path.join(dirpath, fname)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                try:
+                    used = os.stat(path + USED_SUFFIX).st_mtime
+                except FileNotFoundError:
+                    used = st.st_mtime
+                yield max(st.st_mtime, used), st.st_size, path
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits `max_bytes`."""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            if self._size <= self.max_bytes:
+                return
+            entries = sorted(self._entries())
+            self._size = sum(size for _, size, _ in entries)
+            freed = 0
+            for _, size, path in entries:
+                if self._size <= self.max_bytes:
+                    break
+                for stale in (path, path + USED_SUFFIX):
+                    try:
+                        os.remove(stale)
+                    except FileNotFoundError:
+                        pass
+                self._size -= size
+                freed += size
+        if freed:
+            self.log(f"Result cache: evicted {freed / 1024 ** 2:.0f}MB (budget {self.max_bytes / 1024 ** 3:.1f}GB)")
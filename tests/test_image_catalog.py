@@ -0,0 +1,63 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dashboard"))
+
+from image_catalog import ImageCatalog
+
+
+def read_sidecar(filename, image_dir):
+    json_path = os.path.join(image_dir, filename.rsplit(".", 1)[0] + ".json")
+    if not os.path.exists(json_path):
+        return {"Title": filename, "Keywords": "", "Category": "1", "has_json": False}
+    with open(json_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return {"Title": meta["title"], "Keywords": "", "Category": "1", "has_json": True}
+
+
+def make_run(tmp_path):
+    run = tmp_path / "generations" / "20260101_000000"
+    run.mkdir(parents=True)
+    (run / "img0.png").write_bytes(b"png")
+    (run / "img0.json").write_text(json.dumps({"title": "Old"}), encoding="utf-8")
+    return run
+
+
+def edit_in_place(path, title):
+    """Rewrite a sidecar the way update_json_metadata.py does (same inode, directory mtime unchanged)."""
+    dir_mtime = os.stat(path.parent).st_mtime_ns
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"title": title}, f)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))  # coarse mtime filesystems
+    assert os.stat(path.parent).st_mtime_ns == dir_mtime
+
+
+def titles(catalog):
+    return [img["title"] for img in catalog.list_images()]
+
+
+def test_refresh_picks_up_sidecar_edited_in_place(tmp_path):
+    run = make_run(tmp_path)
+    catalog = ImageCatalog(tmp_path / "generations", tmp_path, str(tmp_path / "catalog.db"), read_sidecar,
+                           log=lambda message: None)
+    catalog.refresh()
+    assert titles(catalog) == ["Old"]
+
+    edit_in_place(run / "img0.json", "New")
+    assert catalog.refresh()[1] == 1
+    assert titles(catalog) == ["New"]
+
+
+def test_refresh_paths_rescans_the_changed_file(tmp_path):
+    run = make_run(tmp_path)
+    deltas = []
+    catalog = ImageCatalog(tmp_path / "generations", tmp_path, str(tmp_path / "catalog.db"), read_sidecar,
+                           on_change=lambda upserted, removed: deltas.append(upserted), log=lambda message: None)
+    catalog.refresh()
+
+    edit_in_place(run / "img0.json", "New")
+    catalog.refresh(paths=[str(run / "img0.json")])
+    assert titles(catalog) == ["New"]
+    assert [img["title"] for img in deltas[-1]] == ["New"]
@@ -0,0 +1,39 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dashboard"))
+
+from log_tail import LogTail
+
+
+def write(path, text, mode="a"):
+    with open(path, mode, encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_truncated_log_restarts_at_zero(tmp_path):
+    path = str(tmp_path / "upscale.log")
+    write(path, "".join(f"old line {i}\n" for i in range(20)))
+    tail = LogTail(path, max_bytes=0, log=lambda message: None)
+    first = tail.read()
+
+    # Truncated in place (same inode), then refilled past the client's offset
+    write(path, "new line 0\n" + "x" * first["offset"] + "\n", mode="w")
+    result = tail.read(first["offset"], first["file"])
+    assert result["reset"]
+    assert result["lines"][0] == "new line 0\n"
+
+
+def test_clear_resets_clients(tmp_path):
+    path = str(tmp_path / "upscale.log")
+    write(path, "a\nb\n")
+    tail = LogTail(path, max_bytes=0, log=lambda message: None)
+    first = tail.read()
+
+    tail.clear("cleared\n")
+    write(path, "c\n")
+    result = tail.read(first["offset"], first["file"])
+    assert result["reset"]
+    assert result["lines"] == ["cleared\n", "c\n"]
+    assert tail.read(result["offset"], result["file"]) == {"lines": [], "offset": result["offset"],
+                                                         "file": result["file"], "reset": False}
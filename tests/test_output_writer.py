@@ -0,0 +1,33 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import output_writer
+from output_writer import OutputWriter
+from upscale_planner import resize_to_plan
+
+
+class Plan:
+    def __init__(self, out_size):
+        self.out_size = out_size
+
+
+def test_jpeg_from_memmap_is_resampled_in_row_blocks(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    canvas = np.lib.format.open_memmap(str(tmp_path / "canvas.npy"), mode="w+", dtype=np.uint16, shape=(300, 400, 3))
+    canvas[:] = rng.integers(0, 65536, canvas.shape, dtype=np.uint16)
+    plan = Plan((320, 240))
+
+    # The full-size canvas must never be resampled (and loaded) in one piece
+    monkeypatch.setattr(output_writer, "resize_to_plan", lambda *a: (_ for _ in ()).throw(AssertionError))
+    OutputWriter(fmt="jpeg", jpeg_quality=100, log=lambda message: None).write(
+        str(tmp_path / "out.jpg"), canvas, plan)
+
+    written = cv2.imread(str(tmp_path / "out.jpg"))
+    expected = (resize_to_plan(np.asarray(canvas), plan) >> 8).astype(np.uint8)
+    assert written.shape == (240, 320, 3)
+    assert np.abs(written.astype(int) - expected).mean() < 8
@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline_state import PipelineState
+from result_cache import file_digest
+
+
+def test_changed_source_invalidates_recorded_outputs(tmp_path):
+    raw = tmp_path / "img0.png"
+    out = tmp_path / "upscaled.png"
+    raw.write_bytes(b"original")
+    out.write_bytes(b"upscale of original")
+
+    state = PipelineState(str(tmp_path), log=lambda message: None)
+    state.set_source("img0.png", file_digest(raw))
+    state.record_output("img0.png", "upscaled", str(out))
+    assert state.verified("img0.png", "upscaled", str(out), file_digest(raw))
+
+    raw.write_bytes(b"edited")
+    resumed = PipelineState(str(tmp_path), autosave=False, log=lambda message: None)
+    resumed.set_source("img0.png", file_digest(raw))
+    assert not resumed.verified("img0.png", "upscaled", str(out), file_digest(raw))
+    # Worker processes hand the drop to the parent's manifest
+    assert resumed.pop_updates("img0.png")["upscaled"] is None
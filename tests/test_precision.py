@@ -0,0 +1,21 @@
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import RRDBNet
+from precision import quantize_int8, calibration_tiles
+
+
+def test_int8_quantizes_x2_model():
+    # x2 runs pixel_unshuffle before the trunk, which torch.fx has to trace
+    model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=16, num_block=1, num_grow_ch=8, scale=2).eval()
+    quantized = quantize_int8(model, calibration_tiles([], size=32))
+
+    x = torch.rand(1, 3, 32, 32)
+    with torch.inference_mode():
+        out, ref = quantized(x), model(x)
+    assert out.shape == (1, 3, 64, 64)
+    assert (out - ref).abs().mean() < 0.05
@@ -0,0 +1,270 @@
+"""
+Tile Size Autotuner
+
+Benchmarks a few tile sizes and torch thread counts on a sample image on the
+current host and stores the fastest configuration that fits the memory budget
+in weights/tile_tuning.json. ImagePipeline picks it up automatically, so every
+deployment host runs at its own best throughput without code edits.
+
+The pipeline runs one tile size for both the x2 and the x4 model (see
+upscale_planner.py), so every candidate is timed with both and ranked by
+their combined throughput. Tile sizes must be even for the x2 model.
+
+Usage:
+    python tile_autotune.py [--sample IMAGE] [--budget-mb MB] [--tiles 128 256 384] [--threads 4 8]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+from datetime import datetime
+
+from upscale_planner import MODELS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WEIGHTS_DIR = os.path.join(BASE_DIR, "weights")
+TUNING_FILE = os.path.join(WEIGHTS_DIR, "tile_tuning.json")
+
+DEFAULT_TILE_CANDIDATES = (128, 192, 256, 384, 512)
+TILE_PAD = 10
+# Native model scales the pipeline runs
+TUNED_SCALES = tuple(sorted(MODELS))
+# Each candidate is timed on a square sample of SAMPLE_TILES x SAMPLE_TILES full
+# tiles of its own size, so px/s and peak memory aren't measured on a partial tile
+SAMPLE_TILES = 2
+# Rough RRDBNet activation footprint per padded input pixel at x4, in bytes
+# (dominated by the 64-channel feature maps after the two 2x upsampling convs)
+BYTES_PER_TILE_PIXEL = 1100 * 4
+
+
+def host_key(device=None):
+    """Identify the deployment host + compute device the tuning applies to."""
+    import torch
+    if device is not None and device.type == 'cuda':
+        device_name = torch.cuda.get_device_name(device)
+    else:
+        device_name = f"{platform.machine()} x{os.cpu_count()}"
+    return f"{platform.node()}|{device_name}"
+
+
+def load_tuned_config(device=None, path=TUNING_FILE):
+    """Return the tuned config dict for this host, or None if it was never tuned."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get(host_key(device))
+    except (OSError, ValueError):
+        return None
+
+
+def save_tuned_config(config, device=None, path=TUNING_FILE):
+    data = {}
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+    data[host_key(device)] = config
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def estimate_tile_memory_mb(tile, tile_batch, scale=4):
+    """Upper-bound estimate of activation memory for one batch of padded tiles."""
+    padded = (tile + 2 * TILE_PAD) ** 2
+    return padded * tile_batch * BYTES_PER_TILE_PIXEL * (scale / 4) ** 2 / (1024 * 1024)
+
+
+class _PeakRSS:
+    """Sample process RSS on a background thread to catch the peak during a run."""
+
+    def __init__(self, interval=0.01):
+        import psutil
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.baseline = self.process.memory_info().rss
+        self.peak = self.baseline
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def delta_mb(self):
+        return (self.peak - self.baseline) / (1024 * 1024)
+
+
+def _load_sample(sample_path, side):
+    """A side x side BGR crop of `sample_path` (upscaled first if it is smaller), or noise without a sample."""
+    import cv2
+    import numpy as np
+    if sample_path:
+        img = cv2.imread(sample_path, cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError(f"Failed to read sample image: {sample_path}")
+        if min(img.shape[:2]) < side:
+            factor = side / min(img.shape[:2])
+            img = cv2.resize(img, (max(side, round(img.shape[1] * factor)), max(side, round(img.shape[0] * factor))),
+                             interpolation=cv2.INTER_CUBIC)
+        y0 = (img.shape[0] - side) // 2
+        x0 = (img.shape[1] - side) // 2
+        return np.ascontiguousarray(img[y0:y0 + side, x0:x0 + side])
+    # Inference cost doesn't depend on content, so noise is a fine stand-in
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (side, side, 3), dtype=np.uint8)
+
+
+def autotune(model_paths=None, sample_path=None, tile_sizes=DEFAULT_TILE_CANDIDATES, thread_counts=None,
+             tile_batch=4, memory_budget_mb=None, repeats=1, scales=TUNED_SCALES, log=print):
+    """Time every (threads, tile) pair and return the fastest config within the memory budget.
+
+    Args:
+        model_paths: {scale: Real-ESRGAN weights}. Random weights are used where
+            missing (throughput doesn't depend on the weight values).
+        sample_path: Image to time on; a center crop of SAMPLE_TILES x SAMPLE_TILES tiles is used.
+        tile_sizes: Candidate tile sizes.
+        thread_counts: Candidate torch intra-op thread counts (default: cores, cores/2, cores/4).
+        tile_batch: Tiles per forward pass, as used by the pipeline.
+        memory_budget_mb: Peak extra RSS allowed (default: 50% of available memory).
+        repeats: Timed runs per config (the best one counts).
+        scales: Model scales every config is timed with; px/s counts the sample once through each.
+    """
+    odd = [tile for tile in tile_sizes if tile % 2]
+    if 2 in scales and odd:
+        raise ValueError(f"Tile sizes must be even for the x2 model: {odd}")
+    import torch
+    from models import RRDBNet
+    from tiled_inference import TiledUpscaler, load_rrdbnet
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    cores = os.cpu_count() or 1
+    if thread_counts is None:
+        thread_counts = sorted({max(1, cores // d) for d in (1, 2, 4)}, reverse=True)
+    if memory_budget_mb is None:
+        try:
+            import psutil
+            memory_budget_mb = psutil.virtual_memory().available / (1024 * 1024) * 0.5
+        except ImportError:
+            memory_budget_mb = float("inf")
+
+    model_paths = model_paths or {}
+    models = {}
+    for scale in scales:
+        path = model_paths.get(scale)
+        if path and os.path.exists(path):
+            models[scale] = load_rrdbnet(path, scale=scale)
+        else:
+            log(f"x{scale} weights not found - timing with random weights")
+            models[scale] = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32,
+                                    scale=scale).eval()
+
+    original_threads = torch.get_num_threads()
+    results = []
+    log(f"Autotuning on {host_key(device)}: tiles={list(tile_sizes)} threads={list(thread_counts)} "
+        f"scales={list(scales)} batch={tile_batch} budget={memory_budget_mb:.0f}MB")
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            for tile in tile_sizes:
+                entry = {"tile": tile, "threads": threads}
+                estimate = max(estimate_tile_memory_mb(tile, tile_batch, scale) for scale in scales)
+                if estimate > memory_budget_mb:
+                    entry.update(status="skipped", reason=f"estimated {estimate:.0f}MB > budget")
+                    results.append(entry)
+                    log(f"  tile={tile:<4} threads={threads:<3} skipped (est. {estimate:.0f}MB)")
+                    continue
+                sample = _load_sample(sample_path, tile * SAMPLE_TILES)
+                pixels = sample.shape[0] * sample.shape[1]
+                seconds, peak_mb = {}, 0
+                try:
+                    for scale in scales:
+                        upsampler = TiledUpscaler(models[scale], scale=scale, tile=tile, tile_pad=TILE_PAD,
+                                                  batch_size=tile_batch, device=device)
+                        upsampler.enhance(sample[:tile, :tile])  # warm-up
+                        best = float("inf")
+                        with _PeakRSS() as rss:
+                            for _ in range(repeats):
+                                t0 = time.perf_counter()
+                                upsampler.enhance(sample)
+                                best = min(best, time.perf_counter() - t0)
+                        seconds[f"x{scale}"] = round(best, 3)
+                        peak_mb = max(peak_mb, rss.delta_mb)
+                except RuntimeError as e:  # OOM
+                    entry.update(status="failed", reason=str(e).splitlines()[0])
+                    results.append(entry)
+                    log(f"  tile={tile:<4} threads={threads:<3} failed: {entry['reason']}")
+                    continue
+                px_per_s = pixels * len(seconds) / sum(seconds.values())  # the sample once through each model
+                entry.update(status="ok" if peak_mb <= memory_budget_mb else "over_budget",
+                             seconds=seconds, px_per_s=round(px_per_s), peak_mb=round(peak_mb))
+                results.append(entry)
+                timings = "  ".join(f"{name} {s:6.2f}s" for name, s in seconds.items())
+                log(f"  tile={tile:<4} threads={threads:<3} {timings}  {px_per_s:9.0f} px/s  "
+                    f"peak +{peak_mb:.0f}MB")
+    finally:
+        torch.set_num_threads(original_threads)
+
+    ok = [r for r in results if r["status"] == "ok"]
+    if not ok:
+        raise RuntimeError("No tile configuration fit the memory budget")
+    winner = max(ok, key=lambda r: r["px_per_s"])
+    config = {
+        "tile": winner["tile"],
+        "threads": winner["threads"],
+        "tile_batch": tile_batch,
+        "scales": list(scales),
+        "px_per_s": winner["px_per_s"],
+        "memory_budget_mb": round(memory_budget_mb),
+        "tuned_at": datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+    save_tuned_config(config, device)
+    log(f"Best: tile={winner['tile']} threads={winner['threads']} ({winner['px_per_s']} px/s) -> {TUNING_FILE}")
+    return config
+
+
+if __name__ == "__main__":
+    import generation_pipeline  # applies the torchvision patch and provides the defaults
+    parser = argparse.ArgumentParser(description="Benchmark tile sizes/threads and persist the best config.")
+    parser.add_argument("--sample", help="Image to benchmark on (default: synthetic noise)")
+    parser.add_argument("--budget-mb", type=float, default=None, help="Peak extra memory allowed (MB)")
+    parser.add_argument("--tiles", type=int, nargs="+", default=list(DEFAULT_TILE_CANDIDATES))
+    parser.add_argument("--threads", type=int, nargs="+", default=None)
+    parser.add_argument("--tile-batch", type=int, default=generation_pipeline.TILE_BATCH)
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+    if args.tile_batch < 1:
+        sys.exit("--tile-batch must be >= 1 (autotuning uses the batched TiledUpscaler)")
+    odd = [tile for tile in args.tiles if tile % 2]
+    if odd:
+        parser.error(f"--tiles must be even (the x2 model needs tiles divisible by 2): {odd}")
+    autotune(
+        model_paths={scale: os.path.join(WEIGHTS_DIR, f"{name}.pth") for scale, name in MODELS.items()},
+        sample_path=args.sample,
+        tile_sizes=args.tiles,
+        thread_counts=args.threads,
+        tile_batch=args.tile_batch,
+        memory_budget_mb=args.budget_mb,
+        repeats=args.repeats,
+    )
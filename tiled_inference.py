@@ -0,0 +1,316 @@
+"""
+Batched tiled inference for RRDBNet.
+
+Drop-in replacement for RealESRGANer.enhance() that cuts images into the same
+padded tiles (tile / tile_pad overlap) but pushes them through the network in
+mini-batches instead of one tile at a time. Tiles from several images can share
+a batch via enhance_many(), which keeps the conv/GEMM kernels busy on CPU.
+
+For very large outputs, pass `checkpoint=<path prefix>`: the output canvas is
+then a memory-mapped .npy scratch file and every finished tile row is flushed
+and recorded, so RAM holds roughly one tile row and an interrupted image
+resumes from its last completed row.
+"""
+
+import os
+import json
+import math
+import hashlib
+from collections import namedtuple
+
+import cv2
+import numpy as np
+import torch
+from torch.nn import functional as F
+
+from models import RRDBNet
+from precision import prepare_model
+
+# One padded input tile and where its (unpadded) output goes
+TileJob = namedtuple("TileJob", ["image_idx", "plane", "row", "in_box", "out_box", "crop_box"])
+
+
+def load_rrdbnet(model_path, scale=4, num_block=23, fused=False):
+    """Build an RRDBNet and load Real-ESRGAN weights (params_ema preferred, like RealESRGANer).
+
+    fused=True builds the buffer-based dense blocks (models.FusedRRDB); the
+    weights are identical, only the forward pass allocates less.
+    """
+    model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=num_block, num_grow_ch=32, scale=scale,
+                    fused=fused)
+    loadnet = torch.load(model_path, map_location=torch.device('cpu'))
+    keyname = 'params_ema' if 'params_ema' in loadnet else 'params'
+    model.load_state_dict(loadnet[keyname], strict=True)
+    model.eval()
+    return model
+
+
+class TileCheckpoint:
+    """Memory-mapped output canvas (<path>.npy) plus completed tile-row count (<path>.json).
+
+    The row count is only trusted if `signature` (input hash, geometry, model
+    settings) matches the one it was written with; otherwise a fresh canvas
+    is created.
+    """
+
+    def __init__(self, path, shape, dtype, signature):
+        self.canvas_path = path + ".npy"
+        self.meta_path = path + ".json"
+        self.signature = signature
+        self.rows_done = 0
+        self.canvas = None
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("signature") == signature:
+                canvas = np.load(self.canvas_path, mmap_mode="r+")
+                if canvas.shape == tuple(shape) and canvas.dtype == dtype:
+                    self.canvas, self.rows_done = canvas, meta["rows_done"]
+        except (OSError, ValueError, KeyError):
+            pass
+        if self.canvas is None:
+            os.makedirs(os.path.dirname(self.canvas_path) or ".", exist_ok=True)
+            self.canvas = np.lib.format.open_memmap(self.canvas_path, mode="w+", dtype=dtype, shape=tuple(shape))
+            self._write_meta()
+
+    def row_done(self, row):
+        """Persist the canvas and mark tile rows up to `row` complete."""
+        self.canvas.flush()
+        self.rows_done = row + 1
+        self._write_meta()
+
+    def _write_meta(self):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"signature": self.signature, "rows_done": self.rows_done}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    @staticmethod
+    def discard(path):
+        """Delete the scratch files of a finished image (drop all references to its output first)."""
+        for suffix in (".npy", ".json"):
+            try:
+                os.remove(path + suffix)
+            except OSError:
+                pass
+
+
+class _PreparedImage:
+    """Per-image state: input planes as tensors plus the output canvas being stitched."""
+
+    def __init__(self, img, scale, mod_scale, device, dtype, checkpoint=None, settings=None):
+        self.h_input, self.w_input = img.shape[0:2]
+        # Hashed before any conversion so a resumed checkpoint provably belongs to this input
+        source_sha1 = hashlib.sha1(np.ascontiguousarray(img)).hexdigest() if checkpoint else None
+        img = img.astype(np.float32)
+        if np.max(img) > 256:  # 16-bit image
+            self.max_range = 65535
+            self.out_dtype = np.uint16
+        else:
+            self.max_range = 255
+            self.out_dtype = np.uint8
+        img = img / self.max_range
+
+        # planes: name -> RGB float array fed to the model
+        planes = {}
+        if len(img.shape) == 2:  # gray image
+            self.img_mode = 'L'
+            planes['gray'] = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+            channels = 1
+        elif img.shape[2] == 4:  # RGBA image - alpha is upscaled by the model too
+            self.img_mode = 'RGBA'
+            planes['color'] = cv2.cvtColor(img[:, :, 0:3], cv2.COLOR_BGR2RGB)
+            planes['alpha'] = cv2.cvtColor(img[:, :, 3], cv2.COLOR_GRAY2RGB)
+            channels = 4
+        else:
+            self.img_mode = 'RGB'
+            planes['color'] = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            channels = 3
+
+        # mod pad so pixel_unshuffle (scale 2 / 1) sees divisible sizes
+        self.mod_pad_h = (mod_scale - self.h_input % mod_scale) % mod_scale
+        self.mod_pad_w = (mod_scale - self.w_input % mod_scale) % mod_scale
+        self.planes = {}
+        for name, arr in planes.items():
+            t = torch.from_numpy(np.transpose(arr, (2, 0, 1))).unsqueeze(0).to(device=device, dtype=dtype)
+            if self.mod_pad_h or self.mod_pad_w:
+                t = F.pad(t, (0, self.mod_pad_w, 0, self.mod_pad_h), 'reflect')
+            self.planes[name] = t
+        _, _, self.height, self.width = next(iter(self.planes.values())).shape
+
+        out_shape = (self.height * scale, self.width * scale)
+        if channels > 1:
+            out_shape += (channels,)
+        self.checkpoint = None
+        if checkpoint:
+            signature = dict(settings or {}, source_sha1=source_sha1, shape=list(out_shape))
+            self.checkpoint = TileCheckpoint(checkpoint, out_shape, np.dtype(self.out_dtype), signature)
+            self.output = self.checkpoint.canvas
+        else:
+            self.output = np.zeros(out_shape, dtype=self.out_dtype)
+
+    def paste(self, plane, out_box, tile):
+        """Quantize a model output tile (3, h, w RGB float) into the canvas."""
+        y0, y1, x0, x1 = out_box
+        tile = np.transpose(tile, (1, 2, 0))[:, :, ::-1]  # RGB -> BGR, HWC
+        if plane in ('gray', 'alpha'):
+            tile = cv2.cvtColor(np.ascontiguousarray(tile), cv2.COLOR_BGR2GRAY)
+        tile = (tile * self.max_range).round().astype(self.out_dtype)
+        if plane == 'color':
+            self.output[y0:y1, x0:x1, 0:3] = tile
+        elif plane == 'alpha':
+            self.output[y0:y1, x0:x1, 3] = tile
+        else:
+            self.output[y0:y1, x0:x1] = tile
+
+    def result(self, scale):
+        return self.output[0:self.h_input * scale, 0:self.w_input * scale]
+
+
+class TiledUpscaler:
+    """RealESRGANer-compatible upsampler that runs RRDBNet on mini-batches of tiles.
+
+    Args:
+        model (nn.Module): Loaded RRDBNet (see load_rrdbnet).
+        scale (int): Native model scale (4, 2 or 1).
+        tile (int): Tile size in input pixels, 0 = whole image as one tile.
+        tile_pad (int): Overlap added around each tile to hide seams. Default: 10.
+        batch_size (int): Tiles per forward pass. Only tiles with identical padded
+            shape are batched together (interior tiles, and edge tiles of same-size images).
+        precision (str): fp32 / fp16 / bf16 / int8, already resolved for the device
+            (see precision.resolve_precision).
+        calibration (list[Tensor]): Calibration tiles for int8 (see precision.calibration_tiles).
+        device (torch.device): Defaults to cuda if available.
+        plan (InferencePlan): Pass when `model` is already prepared/compiled for
+            `precision` (see compiled_models.load_compiled); skips preparation.
+        log (callable): Progress messages (checkpoint resumes). Default: print.
+    """
+
+    def __init__(self, model, scale=4, tile=256, tile_pad=10, batch_size=4, precision="fp32", calibration=None,
+                 device=None, plan=None, log=print):
+        self.log = log
+        self.scale = scale
+        self.tile_size = tile
+        self.tile_pad = tile_pad
+        self.batch_size = max(1, batch_size)
+        self.mod_scale = {2: 2, 1: 4}.get(scale, 1)
+        if self.tile_size % self.mod_scale or self.tile_pad % self.mod_scale:
+            raise ValueError(f"tile ({tile}) and tile_pad ({tile_pad}) must be multiples of {self.mod_scale} "
+                             f"for a x{scale} model")
+        device = device or torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        if plan is None:
+            self.model, self.plan = prepare_model(model, precision, device, calibration)
+        else:
+            self.model, self.plan = model, plan
+        self.precision = precision
+        self.device = self.plan.device
+        self.dtype = self.plan.input_dtype
+
+    def enhance(self, img, outscale=None, alpha_upsampler='realesrgan', checkpoint=None):
+        """Upscale one BGR/BGRA/gray uint8|uint16 image. Returns (output, img_mode).
+
+        With `checkpoint` (a scratch path prefix) the output is a view of a
+        memory-mapped canvas; see TileCheckpoint.
+        """
+        return self.enhance_many([img], [outscale], [checkpoint])[0]
+
+    def enhance_many(self, imgs, outscales=None, checkpoints=None):
+        """Upscale several images, sharing tile batches between them."""
+        if outscales is None:
+            outscales = [None] * len(imgs)
+        if checkpoints is None:
+            checkpoints = [None] * len(imgs)
+        settings = {"scale": self.scale, "tile": self.tile_size, "tile_pad": self.tile_pad,
+                    "precision": self.precision}
+        prepared = [_PreparedImage(img, self.scale, self.mod_scale, self.device, self.dtype, checkpoint, settings)
+                    for img, checkpoint in zip(imgs, checkpoints)]
+        for prep, checkpoint in zip(prepared, checkpoints):
+            if prep.checkpoint is not None and prep.checkpoint.rows_done:
+                self.log(f"Resuming {os.path.basename(checkpoint)} from tile row {prep.checkpoint.rows_done}")
+        self._run_tiles(prepared, self._tile_jobs(prepared))
+
+        results = []
+        for prep, outscale in zip(prepared, outscales):
+            output = prep.result(self.scale)
+            if outscale is not None and outscale != float(self.scale):
+                output = cv2.resize(output, (int(prep.w_input * outscale), int(prep.h_input * outscale)),
+                                    interpolation=cv2.INTER_LANCZOS4)
+            results.append((output, prep.img_mode))
+        return results
+
+    def _tile_jobs(self, prepared):
+        """Yield TileJobs with RealESRGANer.tile_process geometry, one tile row (all planes) at a time.
+
+        Rows a checkpoint already holds are skipped.
+        """
+        for image_idx, prep in enumerate(prepared):
+            tile = self.tile_size or max(prep.width, prep.height)
+            tiles_x = math.ceil(prep.width / tile)
+            tiles_y = math.ceil(prep.height / tile)
+            first_row = prep.checkpoint.rows_done if prep.checkpoint is not None else 0
+            for y in range(first_row, tiles_y):
+                for plane in prep.planes:
+                    for x in range(tiles_x):
+                        # input tile area on total image
+                        in_x0 = x * tile
+                        in_x1 = min(in_x0 + tile, prep.width)
+                        in_y0 = y * tile
+                        in_y1 = min(in_y0 + tile, prep.height)
+                        # ... with padding
+                        pad_x0 = max(in_x0 - self.tile_pad, 0)
+                        pad_x1 = min(in_x1 + self.tile_pad, prep.width)
+                        pad_y0 = max(in_y0 - self.tile_pad, 0)
+                        pad_y1 = min(in_y1 + self.tile_pad, prep.height)
+                        # output area on the canvas, and the unpadded part of the output tile
+                        s = self.scale
+                        out_box = (in_y0 * s, in_y1 * s, in_x0 * s, in_x1 * s)
+                        cy0 = (in_y0 - pad_y0) * s
+                        cx0 = (in_x0 - pad_x0) * s
+                        crop_box = (cy0, cy0 + (in_y1 - in_y0) * s, cx0, cx0 + (in_x1 - in_x0) * s)
+                        yield TileJob(image_idx, plane, y, (pad_y0, pad_y1, pad_x0, pad_x1), out_box, crop_box)
+
+    def _run_tiles(self, prepared, jobs):
+        """Group same-shape tiles into batches of `batch_size` and stitch the outputs.
+
+        When a checkpointed image finishes a tile row, everything pending is
+        flushed so the row can be recorded as complete.
+        """
+        pending = {}
+
+        def flush():
+            for group in pending.values():
+                if group:
+                    self._run_batch(prepared, group)
+                    group.clear()
+
+        def finish_row(image_idx, row):
+            checkpoint = prepared[image_idx].checkpoint
+            if checkpoint is not None:
+                flush()
+                checkpoint.row_done(row)
+
+        current = None
+        for job in jobs:
+            if current is not None and current != (job.image_idx, job.row):
+                finish_row(*current)
+            current = (job.image_idx, job.row)
+            y0, y1, x0, x1 = job.in_box
+            group = pending.setdefault((y1 - y0, x1 - x0), [])
+            group.append(job)
+            if len(group) >= self.batch_size:
+                self._run_batch(prepared, group)
+                group.clear()
+        flush()
+        if current is not None:
+            finish_row(*current)
+
+    @torch.inference_mode()
+    def _run_batch(self, prepared, group):
+        batch = torch.cat([prepared[job.image_idx].planes[job.plane][:, :, y0:y1, x0:x1]
+                           for job in group for (y0, y1, x0, x1) in [job.in_box]], dim=0)
+        with self.plan.context():
+            output = self.model(batch)
+        output = output.float().clamp_(0, 1).cpu().numpy()
+        for job, out_tile in zip(group, output):
+            cy0, cy1, cx0, cx1 = job.crop_box
+            prepared[job.image_idx].paste(job.plane, job.out_box, out_tile[:, cy0:cy1, cx0:cx1])
@@ -0,0 +1,176 @@
+"""
+Upscale Planner
+
+Picks the cheapest way to bring a (16:9 cropped) image up to the Adobe Stock
+minimum resolution. The old rule - run the x4 model, then resample to
+max(4, ceil(sqrt(4MP / pixels))) - turns a typical 1376x768 draft into a
+16.9MP image, roughly 4x the pixels the target needs, and spends the full x4
+network on all of them.
+
+A plan is one native model pass (RealESRGAN_x2plus or _x4plus, whichever is
+cheapest while still reaching the target) followed by a Lanczos resample to
+the exact output size. The x2 model runs its RRDB trunk on a pixel-unshuffled
+half-resolution input, so it costs about a quarter of the x4 model per input
+pixel. Only images that need more than x4 are Lanczos-upscaled past the model.
+
+Usage:
+    python upscale_planner.py <TIMESTAMP>    # print plans + pixel budget for a run
+"""
+
+import os
+import sys
+import math
+import argparse
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# Native models the planner can choose from: scale -> weights name
+MODELS = {2: "RealESRGAN_x2plus", 4: "RealESRGAN_x4plus"}
+
+# in_size / model_size / out_size are (width, height)
+UpscalePlan = namedtuple("UpscalePlan", ["model_name", "model_scale", "in_size", "model_size", "out_size",
+                                         "gmacs"])
+
+
+def rrdbnet_macs_per_pixel(scale, num_feat=64, num_grow_ch=32, num_block=23):
+    """Multiply-accumulates per *input* pixel for one RRDBNet forward at `scale`."""
+    conv = lambda c_in, c_out: 9 * c_in * c_out
+    rdb = sum(conv(num_feat + i * num_grow_ch, num_grow_ch) for i in range(4)) + \
+        conv(num_feat + 4 * num_grow_ch, num_feat)
+    # x2 / x1 models pixel-unshuffle first, so the trunk runs on 1/4 or 1/16 of the pixels
+    unshuffle = {4: 1, 2: 2, 1: 4}[scale]
+    trunk_px = 1 / unshuffle ** 2
+    trunk = trunk_px * (conv(3 * unshuffle ** 2, num_feat) + num_block * 3 * rdb + conv(num_feat, num_feat))
+    # Head: two nearest-neighbour x2 upsamples (each followed by a conv), conv_hr and conv_last
+    head = trunk_px * (4 * conv(num_feat, num_feat) + 16 * (2 * conv(num_feat, num_feat) + conv(num_feat, 3)))
+    return trunk + head
+
+
+def target_size(width, height, target_mp):
+    """Smallest (width, height) with the same aspect ratio and at least `target_mp` megapixels."""
+    scale = math.sqrt(target_mp * 1000000 / (width * height))
+    return math.ceil(width * scale), math.ceil(height * scale)
+
+
+def plan_upscale(width, height, target_mp=4, models=MODELS):
+    """Return the cheapest UpscalePlan that reaches `target_mp` for a width x height input.
+
+    Images already at the target keep their size but still get one pass of
+    the cheapest model (the pipeline's output is always model-enhanced).
+    """
+    out_w, out_h = target_size(width, height, target_mp)
+    if out_w * out_h < width * height:
+        out_w, out_h = width, height
+    required = max(out_w / width, out_h / height)
+
+    def plan_for(scale):
+        gmacs = rrdbnet_macs_per_pixel(scale) * width * height / 1e9
+        return UpscalePlan(models[scale], scale, (width, height), (width * scale, height * scale),
+                           (out_w, out_h), round(gmacs, 1))
+
+    reaching = [plan_for(s) for s in models if s >= required]
+    if reaching:
+        return min(reaching, key=lambda p: p.gmacs)
+    # Bigger than any native model: largest model + Lanczos upscale (the legacy behaviour)
+    return plan_for(max(models))
+
+
+def legacy_plan(width, height, target_mp=4):
+    """What the pipeline did before the planner: x4 model, then resample to an integer outscale >= 4."""
+    outscale = max(4, math.ceil((target_mp * 1000000 / (width * height)) ** 0.5))
+    gmacs = rrdbnet_macs_per_pixel(4) * width * height / 1e9
+    return UpscalePlan(MODELS[4], 4, (width, height), (width * 4, height * 4),
+                       (int(width * outscale), int(height * outscale)), round(gmacs, 1))
+
+
+def resize_to_plan(output, plan):
+    """Lanczos-resample a model output to the plan's exact output size (no-op if it already matches)."""
+    out_w, out_h = plan.out_size
+    if output.shape[1] == out_w and output.shape[0] == out_h:
+        return output
+    return cv2.resize(output, (out_w, out_h), interpolation=cv2.INTER_LANCZOS4)
+
+
+def _lanczos4_taps(src_len, dst_len):
+    """Source indices and weights (dst_len, 8) of cv2's INTER_LANCZOS4 along one axis (replicated border)."""
+    pos = (np.arange(dst_len) + 0.5) * (src_len / dst_len) - 0.5
+    start = np.floor(pos)
+    offsets = np.arange(8) - 3
+    dist = (pos - start)[:, None] - offsets
+    weights = np.sinc(dist) * np.sinc(dist / 4)
+    weights /= weights.sum(axis=1, keepdims=True)
+    idx = np.clip(start.astype(np.int64)[:, None] + offsets, 0, src_len - 1)
+    return idx, weights.astype(np.float32)
+
+
+def iter_resized_rows(output, plan, block_rows=64):
+    """Yield the plan's Lanczos resample of `output` in blocks of `block_rows` output rows.
+
+    Streaming counterpart of resize_to_plan() for memory-mapped model outputs:
+    only the source rows under one block's filter taps are read at a time.
+    The horizontal pass is cv2's, the vertical one uses the same Lanczos4
+    weights in float32, so pixels match resize_to_plan() to within +-1.
+    """
+    out_w, out_h = plan.out_size
+    src_h, src_w = output.shape[:2]
+    if (src_w, src_h) == (out_w, out_h):
+        for y in range(0, src_h, block_rows):
+            yield output[y:y + block_rows]
+        return
+    idx, weights = _lanczos4_taps(src_h, out_h)
+    max_value = np.iinfo(output.dtype).max
+    for y in range(0, out_h, block_rows):
+        rows_idx, rows_w = idx[y:y + block_rows], weights[y:y + block_rows]
+        lo, hi = rows_idx.min(), rows_idx.max() + 1
+        strip = cv2.resize(np.asarray(output[lo:hi], dtype=np.float32), (out_w, hi - lo),
+                           interpolation=cv2.INTER_LANCZOS4)
+        if strip.ndim == 2:
+            strip = strip[:, :, None]
+        block = np.zeros((len(rows_idx), out_w, strip.shape[2]), dtype=np.float32)
+        for k in range(8):
+            block += rows_w[:, k, None, None] * strip[rows_idx[:, k] - lo]
+        block = np.clip(np.rint(block), 0, max_value).astype(output.dtype)
+        yield block[:, :, 0] if output.ndim == 2 else block
+
+
+def describe(plan):
+    """One-line pixel budget of a plan for the log."""
+    (in_w, in_h), (m_w, m_h), (o_w, o_h) = plan.in_size, plan.model_size, plan.out_size
+    line = f"{in_w}x{in_h} -> x{plan.model_scale} model {m_w}x{m_h} ({m_w * m_h / 1e6:.1f}MP, {plan.gmacs} GMAC)"
+    if (m_w, m_h) != (o_w, o_h):
+        line += f" -> Lanczos {o_w}x{o_h}"
+    return line + f" = {o_w * o_h / 1e6:.1f}MP"
+
+
+if __name__ == "__main__":
+    import generation_pipeline
+    from PIL import Image
+    parser = argparse.ArgumentParser(description="Show the upscale plan and pixel budget for every image in a run.")
+    parser.add_argument("timestamp", help="Timestamp folder name (e.g., 20251226_181818)")
+    parser.add_argument("--target-mp", type=float, default=generation_pipeline.TARGET_MIN_MP)
+    args = parser.parse_args()
+
+    run_dir = os.path.join(generation_pipeline.GENERATIONS_ROOT, args.timestamp)
+    if not os.path.isdir(run_dir):
+        sys.exit(f"Run folder not found: {run_dir}")
+    totals = {"model": 0, "out": 0, "gmacs": 0.0, "legacy_model": 0, "legacy_out": 0, "legacy_gmacs": 0.0}
+    for fname in sorted(os.listdir(run_dir)):
+        if not fname.lower().endswith(('.png', '.jpg', '.jpeg')):
+            continue
+        with Image.open(os.path.join(run_dir, fname)) as img:
+            left, top, right, bottom = generation_pipeline.crop_box_16_9(*img.size)
+        width, height = right - left, bottom - top
+        plan = plan_upscale(width, height, args.target_mp)
+        legacy = legacy_plan(width, height, args.target_mp)
+        print(f"{fname}: {describe(plan)}")
+        for prefix, p in (("", plan), ("legacy_", legacy)):
+            totals[prefix + "model"] += p.model_size[0] * p.model_size[1]
+            totals[prefix + "out"] += p.out_size[0] * p.out_size[1]
+            totals[prefix + "gmacs"] += p.gmacs
+    if totals["gmacs"]:
+        print(f"Planned: model {totals['model'] / 1e6:.1f}MP, output {totals['out'] / 1e6:.1f}MP, "
+              f"{totals['gmacs']:.0f} GMAC")
+        print(f"Legacy:  model {totals['legacy_model'] / 1e6:.1f}MP, output {totals['legacy_out'] / 1e6:.1f}MP, "
+              f"{totals['legacy_gmacs']:.0f} GMAC (x{totals['legacy_gmacs'] / totals['gmacs']:.2f} compute)")